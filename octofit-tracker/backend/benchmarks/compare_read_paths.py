@@ -0,0 +1,110 @@
+"""
+Load a read endpoint with many concurrent, optionally slow, clients and
+report throughput and latency.
+
+Run it once against the WSGI server and once against the ASGI server (see
+docs/async_read_path.md), e.g.:
+
+    python benchmarks/compare_read_paths.py http://localhost:8000/api/activities/recent/ --clients 500
+    python benchmarks/compare_read_paths.py http://localhost:8001/api/async/activities/recent/ --clients 500
+
+With --compare, it loads the second URL the same way right after the first
+and also prints the pair as a row of the table in docs/async_read_path.md.
+
+Each client opens its own connection. With --send-delay it sends its request
+headers one line at a time with that many seconds in between, like a mobile
+client on a poor network, so the server has to keep the connection open.
+Only the standard library is used.
+"""
+import argparse
+import asyncio
+import statistics
+import time
+from urllib.parse import urlsplit
+
+
+async def fetch(url, send_delay):
+    """Issue one GET over a fresh connection; return (status, seconds)"""
+    parts = urlsplit(url)
+    path = parts.path + (f'?{parts.query}' if parts.query else '')
+    lines = [
+        f'GET {path} HTTP/1.1\r\n',
+        f'Host: {parts.netloc}\r\n',
+        'Accept: application/json\r\n',
+        'Connection: close\r\n',
+        '\r\n',
+    ]
+    started = time.perf_counter()
+    reader, writer = await asyncio.open_connection(parts.hostname, parts.port or 80)
+    try:
+        for line in lines:
+            writer.write(line.encode('ascii'))
+            await writer.drain()
+            if send_delay:
+                await asyncio.sleep(send_delay)
+        status_line = await reader.readline()
+        await reader.read()
+    finally:
+        writer.close()
+    status = int(status_line.split()[1]) if status_line else 0
+    return status, time.perf_counter() - started
+
+
+async def client(url, requests, send_delay, results):
+    for _ in range(requests):
+        try:
+            results.append(await fetch(url, send_delay))
+        except OSError:
+            results.append((0, None))
+
+
+async def run(url, clients, requests, send_delay):
+    results = []
+    started = time.perf_counter()
+    await asyncio.gather(*(client(url, requests, send_delay, results) for _ in range(clients)))
+    return results, time.perf_counter() - started
+
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def report(url, clients, requests, send_delay, results, elapsed):
+    """Print one run; return its (req/s, p95 ms or None)"""
+    ok = sorted(seconds for status, seconds in results if status == 200)
+    print(f'{url}')
+    print(f'  clients={clients} requests/client={requests} send-delay={send_delay}s')
+    print(f'  completed {len(ok)}/{len(results)} in {elapsed:.2f}s: {len(ok) / elapsed:.1f} req/s')
+    if not ok:
+        return len(ok) / elapsed, None
+    print(f'  latency ms: p50={statistics.median(ok) * 1000:.1f} '
+          f'p95={percentile(ok, 0.95) * 1000:.1f} '
+          f'p99={percentile(ok, 0.99) * 1000:.1f} max={ok[-1] * 1000:.1f}')
+    return len(ok) / elapsed, percentile(ok, 0.95) * 1000
+
+
+def table_cell(throughput, p95):
+    return f'{throughput:.0f} ({p95:.0f} ms)' if p95 is not None else f'{throughput:.0f} (-)'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('url')
+    parser.add_argument('--clients', type=int, default=100, help='Concurrent connections')
+    parser.add_argument('--requests', type=int, default=10, help='Requests per client')
+    parser.add_argument('--send-delay', type=float, default=0.0,
+                        help='Seconds between request header lines (simulates slow clients)')
+    parser.add_argument('--compare', metavar='URL', default=None,
+                        help='Also load this URL (the ASGI side) and print both as a table row')
+    args = parser.parse_args()
+
+    cells = []
+    for url in filter(None, (args.url, args.compare)):
+        results, elapsed = asyncio.run(run(url, args.clients, args.requests, args.send_delay))
+        cells.append(table_cell(*report(url, args.clients, args.requests, args.send_delay, results, elapsed)))
+    if args.compare:
+        print(f'| `{urlsplit(args.url).path}` | {args.clients} | {args.send_delay:g} s | {cells[0]} | {cells[1]} |')
+
+
+if __name__ == '__main__':
+    main()
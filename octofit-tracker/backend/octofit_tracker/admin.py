@@ -1,12 +1,99 @@
 from django.contrib import admin
-from .models import User, Team, Activity, Leaderboard, Workout
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.contrib.admin.views.main import ChangeList
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.request import Request
+
+from .filter_choices import get_choices
+from .models import User, Team, Activity, Leaderboard, TeamStanding, Workout
+from .pagination import KeysetPagination
+from .repository import Repository
+
+
+class PrecomputedValuesFilter(admin.AllValuesFieldListFilter):
+    """List filter whose choices come from filter_choices instead of a DISTINCT scan"""
+
+    def __init__(self, field, request, params, model, model_admin, field_path):
+        super().__init__(field, request, params, model, model_admin, field_path)
+        self.lookup_choices = get_choices(model, field_path)
+
+
+class CursorChangeList(ChangeList):
+    """
+    Changelist paged by keyset cursor in the model admin's `ordering`.
+
+    Nothing is counted: unfiltered lists show the collection's estimated
+    document count, and filtered or searched ones only the rows on the page.
+    """
+    cursor_var = 'cursor'
+
+    def get_filters_params(self, params=None):
+        lookup_params = super().get_filters_params(params)
+        lookup_params.pop(self.cursor_var, None)
+        return lookup_params
+
+    def get_results(self, request):
+        paginator = KeysetPagination()
+        paginator.page_size = self.list_per_page
+        paginator.page_size_query_param = None
+        paginator.cursor_query_param = self.cursor_var
+        try:
+            self.result_list = paginator.paginate_queryset(self.queryset, Request(request), self.model_admin)
+        except NotFound:
+            raise IncorrectLookupParameters
+        self.next_link = paginator.get_next_link()
+        self.previous_link = paginator.get_previous_link()
+
+        self.is_filtered = bool(self.query) or self.has_active_filters
+        if self.is_filtered:
+            self.result_count = len(self.result_list)
+        else:
+            self.result_count = Repository(self.model).estimated_count()
+        self.full_result_count = None
+        self.show_full_result_count = False
+        self.show_admin_actions = True
+        self.can_show_all = False
+        self.multi_page = self.next_link is not None or self.previous_link is not None
+        self.paginator = paginator
+
+
+class PerformanceModeAdmin(admin.ModelAdmin):
+    """
+    Admin for collections too large to count or scan on every page load.
+
+    - Pages by keyset cursor in `ordering` (which must end with _id), so
+      columns are not sortable and no count or offset query runs.
+    - Searches by prefix (`^field`) or exact value (`=field`), case
+      sensitively, so MongoDB can use an index on the field.
+    - List filters on plain fields should use PrecomputedValuesFilter.
+    """
+    change_list_template = 'admin/octofit_tracker/cursor_change_list.html'
+    show_full_result_count = False
+    sortable_by = ()
+
+    def get_changelist(self, request, **kwargs):
+        return CursorChangeList
+
+    def get_search_results(self, request, queryset, search_term):
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+        condition = Q()
+        for field in self.get_search_fields(request):
+            if field.startswith('='):
+                condition |= Q(**{field[1:]: search_term})
+            else:
+                condition |= Q(**{f'{field.lstrip("^")}__startswith': search_term})
+        return queryset.filter(condition), False
 
 
 @admin.register(User)
-class UserAdmin(admin.ModelAdmin):
+class UserAdmin(PerformanceModeAdmin):
     list_display = ['name', 'email', 'team_id', 'created_at']
-    search_fields = ['name', 'email']
-    list_filter = ['team_id', 'created_at']
+    search_fields = ['^name', '^email']
+    list_filter = [('team_id', PrecomputedValuesFilter), 'created_at']
+    ordering = ['_id']
 
 
 @admin.register(Team)
@@ -17,18 +104,25 @@ class TeamAdmin(admin.ModelAdmin):
 
 
 @admin.register(Activity)
-class ActivityAdmin(admin.ModelAdmin):
+class ActivityAdmin(PerformanceModeAdmin):
     list_display = ['activity_type', 'user_id', 'duration', 'distance', 'calories', 'date']
-    search_fields = ['user_id', 'activity_type']
-    list_filter = ['activity_type', 'date', 'created_at']
-    ordering = ['-date']
+    search_fields = ['=user_id']
+    list_filter = [('activity_type', PrecomputedValuesFilter), 'date', 'created_at']
+    ordering = ['-date', '-_id']
 
 
 @admin.register(Leaderboard)
-class LeaderboardAdmin(admin.ModelAdmin):
+class LeaderboardAdmin(PerformanceModeAdmin):
     list_display = ['rank', 'user_id', 'total_calories', 'total_activities', 'updated_at']
-    search_fields = ['user_id']
+    search_fields = ['=user_id']
     list_filter = ['updated_at']
+    ordering = ['rank', '_id']
+
+
+@admin.register(TeamStanding)
+class TeamStandingAdmin(admin.ModelAdmin):
+    list_display = ['rank', 'team_name', 'members', 'total_calories', 'avg_calories_per_member', 'updated_at']
+    search_fields = ['team_name']
     ordering = ['rank']
 
 
@@ -36,4 +130,6 @@ class LeaderboardAdmin(admin.ModelAdmin):
 class WorkoutAdmin(admin.ModelAdmin):
     list_display = ['name', 'difficulty_level', 'duration', 'exercise_type', 'created_at']
     search_fields = ['name', 'exercise_type']
-    list_filter = ['difficulty_level', 'exercise_type', 'created_at']
+    list_filter = [
+        ('difficulty_level', PrecomputedValuesFilter), ('exercise_type', PrecomputedValuesFilter), 'created_at'
+    ]
@@ -0,0 +1,14 @@
+from django.apps import AppConfig
+
+
+class OctofitTrackerConfig(AppConfig):
+    default_auto_field = 'django.db.models.BigAutoField'
+    name = 'octofit_tracker'
+
+    def ready(self):
+        # Register model signal handlers
+        from . import signals  # noqa: F401
+
+        # Time MongoDB commands for the profiling middleware
+        from .profiling import install
+        install()
@@ -0,0 +1,280 @@
+"""
+Tiered activity storage: old activities leave the hot `activities` collection.
+
+The archive_activities command moves activities from before a cutoff
+(OCTOFIT_ARCHIVE_AFTER_DAYS ago, rounded down to the first of the month)
+into two collections that the working set does not need:
+
+- ``activities_archive`` holds them as zlib-compressed BSON chunks of at
+  most OCTOFIT_ARCHIVE_CHUNK_SIZE activities of one user and month, with
+  their date range and totals alongside;
+- ``activity_summaries`` holds one document of totals per user and month,
+  recomputed from that month's chunks.
+
+Archiving never changes any user's totals, so the leaderboard and daily
+rollups are left as they are; rebuild_leaderboard adds the summaries to
+what it counts from the hot collection. by_user reads through
+find_across_tiers, which merges the archived activities of the user
+into the hot results in the same order. Archived activities are read-only.
+
+Chunks are keyed by user, month and their sequence within the month.
+For one user and month, the month's archived activities and the hot ones
+being moved are merged and rewritten as that month's chunks first, then
+the summary is recomputed, and the hot activities are deleted last. An
+interrupted run leaves some activities in both tiers; running the
+command again merges them by _id, so nothing is archived or counted
+twice, and finishes the move.
+"""
+import zlib
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+import bson
+from django.conf import settings
+from django.utils import timezone
+from pymongo import ReplaceOne
+
+from .cache import bump_version
+from .models import Activity, ActivityArchive, MonthlySummary
+from .repository import Repository, activities
+
+archive = Repository(ActivityArchive)
+summaries = Repository(MonthlySummary)
+
+
+def month_of(date):
+    """Midnight UTC, as stored by pymongo, on the first of the month a datetime falls on"""
+    if timezone.is_aware(date):
+        date = date.astimezone(dt_timezone.utc)
+    return datetime(date.year, date.month, 1)
+
+
+def archive_cutoff(days=None, now=None):
+    """Activities dated before this are archived: `days` ago, rounded down to the first of the month"""
+    days = settings.OCTOFIT_ARCHIVE_AFTER_DAYS if days is None else days
+    return month_of((now or timezone.now()) - timedelta(days=days))
+
+
+def archive_horizon():
+    """First day after the newest archived month, or None when nothing is archived"""
+    latest = summaries.cursor({}, {'month': 1}, ('-month',), limit=1)
+    newest = next(latest, None)
+    if newest is None:
+        return None
+    return (newest['month'] + timedelta(days=32)).replace(day=1)
+
+
+def compress(documents):
+    return bson.Binary(zlib.compress(bson.encode({'activities': documents})))
+
+
+def decompress(data):
+    return bson.decode(zlib.decompress(data))['activities']
+
+
+def chunk_document(documents, sequence=0):
+    """Archive chunk `sequence` (0 is the newest) for activities of one user and month, newest first"""
+    return {
+        'user_id': documents[0]['user_id'],
+        'month': month_of(documents[0]['date']),
+        'sequence': sequence,
+        'first_date': documents[-1]['date'],
+        'last_date': documents[0]['date'],
+        'count': len(documents),
+        'calories': sum(document['calories'] for document in documents),
+        'duration': sum(document['duration'] for document in documents),
+        'distance': float(sum(document.get('distance') or 0 for document in documents)),
+        'distance_count': sum(isinstance(document.get('distance'), (int, float)) for document in documents),
+        'data': compress(documents),
+    }
+
+
+def refresh_summary(user_id, month):
+    """Recompute a user's summary for one month from its archive chunks"""
+    totals = next(archive.collection.aggregate([
+        {'$match': {'user_id': user_id, 'month': month}},
+        {'$group': {
+            '_id': None,
+            'calories': {'$sum': '$calories'},
+            'duration': {'$sum': '$duration'},
+            'distance': {'$sum': '$distance'},
+            'distance_count': {'$sum': {'$ifNull': ['$distance_count', '$count']}},
+            'count': {'$sum': '$count'},
+        }},
+        {'$project': {'_id': 0}},
+    ]), None)
+    key = {'user_id': user_id, 'month': month}
+    if totals is None:
+        summaries.collection.delete_one(key)
+    else:
+        summaries.collection.replace_one(key, {**key, **totals}, upsert=True)
+
+
+def archive_activities(cutoff, dry_run=False):
+    """
+    Move the activities dated before `cutoff` to the archive, one user and
+    month at a time. Returns (activities archived, user months touched).
+    """
+    chunk_size = settings.OCTOFIT_ARCHIVE_CHUNK_SIZE
+    # Sorted like the by_user index, so each user's months come out newest first, one after the other
+    cursor = activities.cursor(
+        {'date': {'$lt': cutoff}}, ordering=('user_id', '-date', '-_id'), no_cursor_timeout=True
+    ).batch_size(chunk_size)
+    archived, months = 0, 0
+    group, key = [], None
+    try:
+        for document in cursor:
+            document_key = (document['user_id'], month_of(document['date']))
+            if group and document_key != key:
+                archived += _move(key, group, chunk_size, dry_run)
+                months += 1
+                group = []
+            key = document_key
+            group.append(document)
+        if group:
+            archived += _move(key, group, chunk_size, dry_run)
+            months += 1
+    finally:
+        cursor.close()
+    if archived and not dry_run:
+        bump_version(Activity._meta.db_table)
+    return archived, months
+
+
+def _move(key, documents, chunk_size, dry_run):
+    """Archive one user's activities from one month and delete them from the hot collection"""
+    if dry_run:
+        return len(documents)
+    user_id, month = key
+    month_query = {'user_id': user_id, 'month': month}
+    # Activities archived earlier in this month, including any copied by an interrupted run
+    moving = {document['_id'] for document in documents}
+    archived = [
+        document
+        for chunk in archive.cursor(month_query, {'data': 1})
+        for document in decompress(chunk['data'])
+        if document['_id'] not in moving
+    ]
+    merged = sort_documents(documents + archived, ('-date', '-_id'))
+    chunks = [
+        chunk_document(merged[start:start + chunk_size], sequence)
+        for sequence, start in enumerate(range(0, len(merged), chunk_size))
+    ]
+    archive.collection.bulk_write([
+        ReplaceOne({**month_query, 'sequence': chunk['sequence']}, chunk, upsert=True) for chunk in chunks
+    ])
+    archive.delete_many({**month_query, 'sequence': {'$gte': len(chunks)}})
+    refresh_summary(*key)
+    activities.delete_many({'_id': {'$in': [document['_id'] for document in documents]}})
+    return len(documents)
+
+
+def _comparable(value):
+    """Dates as naive UTC, as pymongo returns them, so cursor positions compare with stored values"""
+    if isinstance(value, datetime) and timezone.is_aware(value):
+        return value.astimezone(dt_timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def _follows(document, ordering, position):
+    """Whether a document comes after `position` in `ordering`, as keyset_query matches"""
+    for field, value in zip(ordering, position):
+        stored, value = _comparable(document[field.lstrip('-')]), _comparable(value)
+        if stored != value:
+            return stored < value if field.startswith('-') else stored > value
+    return False
+
+
+def sort_documents(documents, ordering):
+    """Sort documents in place by an ordering tuple such as ('-date', '-_id')"""
+    for field in reversed(ordering):
+        documents.sort(key=lambda document: _comparable(document[field.lstrip('-')]), reverse=field.startswith('-'))
+    return documents
+
+
+def find_archived(user_id, projection=None, ordering=('-date', '-_id'), position=None, limit=0, until=None):
+    """
+    Archived activities of a user, sorted by an ordering on date then _id
+    and starting after a keyset `position`, like Repository.find.
+
+    Chunks are read in the ordering's direction, and reading stops once no
+    further chunk can hold a document that belongs in the first `limit`.
+    `until` is the date of a document already known to be within them,
+    so chunks that start after it are not read at all.
+    """
+    descending = ordering[0].startswith('-')
+    # A chunk holds nothing earlier in the ordering than its bound
+    bound = 'last_date' if descending else 'first_date'
+    query = {'user_id': user_id}
+    if position is not None:
+        query['first_date' if descending else 'last_date'] = {'$lte' if descending else '$gte': position[0]}
+    if until is not None:
+        query[bound] = {'$gte' if descending else '$lte': until}
+    chunks = archive.cursor(query, ordering=(('-' if descending else '') + bound,))
+    found = []
+    for chunk in chunks:
+        if limit and len(found) >= limit:
+            kept = _comparable(found[limit - 1]['date'])
+            if (chunk[bound] < kept) if descending else (chunk[bound] > kept):
+                break
+        documents = decompress(chunk['data'])
+        if position is not None:
+            documents = [document for document in documents if _follows(document, ordering, position)]
+        found = sort_documents(found + documents, ordering)
+        if limit:
+            found = found[:limit]
+    chunks.close()
+    if projection:
+        found = [{name: document[name] for name in ('_id', *projection) if name in document} for document in found]
+    return found
+
+
+def find_across_tiers(query, projection=None, ordering=None, position=None, limit=0):
+    """
+    activities.find() for a {'user_id': ...} query, with the user's
+    archived activities merged in.
+
+    When the hot page is already full, only archive chunks that reach
+    past its last activity are read; usually there are none.
+    """
+    ordering = tuple(ordering or ('-date', '-_id'))
+    hot = activities.find(query, projection, ordering, position, limit)
+    until = hot[-1].get('date') if limit and len(hot) == limit else None
+    cold = find_archived(query['user_id'], projection, ordering, position, limit, until)
+    found = sort_documents(hot + cold, ordering) if cold else hot
+    return found[:limit] if limit else found
+
+
+
+def iter_archived(query, projection=None):
+    """
+    Archived activities matching an activities query on user_id and a
+    date range, one decompressed chunk at a time, by user and then newest
+    first (the by_user index order).
+    """
+    date = query.get('date') or {}
+    low, high = _comparable(date.get('$gte')), _comparable(date.get('$lt'))
+    chunk_query = {'user_id': query['user_id']} if 'user_id' in query else {}
+    if low is not None:
+        chunk_query['last_date'] = {'$gte': low}
+    if high is not None:
+        chunk_query['first_date'] = {'$lt': high}
+    chunks = archive.cursor(chunk_query, ordering=('user_id', '-last_date'), no_cursor_timeout=True)
+    try:
+        for chunk in chunks:
+            for document in decompress(chunk['data']):
+                if (low is not None and document['date'] < low) or (high is not None and document['date'] >= high):
+                    continue
+                if projection:
+                    document = {name: document[name] for name in ('_id', *projection) if name in document}
+                yield document
+    finally:
+        chunks.close()
+
+
+def iter_across_tiers(cursor, query, projection=None):
+    """Documents of a hot activities `cursor`, then the archived ones matching the same query; closes both"""
+    try:
+        yield from cursor
+        yield from iter_archived(query, projection)
+    finally:
+        cursor.close()
@@ -13,4 +13,15 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'octofit_tracker.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from . import events  # noqa: E402 (needs the app registry loaded above)
+
+# Served natively: Django 4.1 cannot stream a response from an async view
+EVENT_STREAM_PATH = '/api/async/leaderboard/stream/'
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'http' and scope['path'] == EVENT_STREAM_PATH:
+        return await events.asgi_stream(scope, receive, send)
+    return await django_application(scope, receive, send)
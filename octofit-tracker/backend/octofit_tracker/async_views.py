@@ -0,0 +1,114 @@
+"""
+Async versions of the hot read endpoints, for the ASGI application.
+
+These views run on the event loop. Each MongoDB query is handed to a small
+dedicated thread pool and awaited, so a thread is only busy while a query
+runs. It stays free while a slow client sends its request or reads the
+response, and one ASGI process can keep thousands of such clients
+connected. Responses are byte-identical to the synchronous endpoints.
+They use the same document serializers, JSON renderer and keyset
+pagination.
+
+Motor is not used: its releases that work with djongo's pinned
+pymongo 3.12 do not run on Python 3.10+.
+"""
+import asyncio
+import contextvars
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.http import HttpResponse
+from rest_framework import status
+from rest_framework.exceptions import NotFound
+from rest_framework.request import Request
+
+from .archive import find_across_tiers
+from .pagination import KeysetPagination
+from .renderers import FastJSONRenderer
+from .repository import activities, leaderboard, users
+from .serializers import ActivityDocumentSerializer, LeaderboardDocumentSerializer, UserDocumentSerializer
+from .views import ActivityViewSet, LeaderboardViewSet, parse_limit
+
+_executor = ThreadPoolExecutor(
+    max_workers=settings.OCTOFIT_ASYNC_DB_THREADS,
+    thread_name_prefix='octofit-db'
+)
+
+
+async def run_query(function, *args, **kwargs):
+    """Run a blocking pymongo call on the database thread pool, in the caller's context (for profiling)"""
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(_executor, functools.partial(context.run, function, *args, **kwargs))
+
+
+def find_documents(find, query, serializer_class, ordering, position=None, limit=0):
+    """Call a Repository.find-like `find` with the projection of a document serializer"""
+    projection = {name: 1 for name in serializer_class.field_names}
+    return find(query, projection, ordering, position, limit)
+
+
+def json_response(data, status_code=status.HTTP_200_OK):
+    return HttpResponse(FastJSONRenderer().render(data), status=status_code, content_type='application/json')
+
+
+async def paginated_documents(request, find, query, ordering, serializer_class):
+    """Keyset-paginate a query the way KeysetPagination pages a queryset"""
+    paginator = KeysetPagination()
+    try:
+        page = paginator.start_page(Request(request), ordering)
+    except NotFound as exc:
+        return json_response({'detail': exc.detail}, status_code=exc.status_code)
+    if page is None:
+        documents = await run_query(find_documents, find, query, serializer_class, ordering)
+        return json_response(serializer_class(documents, many=True).data)
+
+    ordering, position = page
+    documents = await run_query(
+        find_documents, find, query, serializer_class, ordering, position, paginator.page_size + 1
+    )
+    data = serializer_class(paginator.finish_page(documents), many=True).data
+    return json_response(paginator.get_paginated_response(data).data)
+
+
+async def activities_by_user(request):
+    """Get activities by user_id, archived ones included"""
+    user_id = request.GET.get('user_id', None)
+    if not user_id:
+        return json_response({'error': 'user_id parameter is required'}, status_code=status.HTTP_400_BAD_REQUEST)
+    return await paginated_documents(
+        request, find_across_tiers, {'user_id': user_id}, ActivityViewSet.ordering, ActivityDocumentSerializer
+    )
+
+
+async def recent_activities(request):
+    """Get recent activities"""
+    try:
+        limit = parse_limit(request.GET.get('limit'))
+    except ValueError:
+        return json_response({'error': 'limit must be an integer'}, status_code=status.HTTP_400_BAD_REQUEST)
+    documents = await run_query(
+        find_documents, activities.find, {}, ActivityDocumentSerializer, ActivityViewSet.ordering, limit=limit
+    )
+    return json_response(ActivityDocumentSerializer(documents, many=True).data)
+
+
+async def leaderboard_top(request):
+    """Get top N entries from leaderboard"""
+    try:
+        limit = parse_limit(request.GET.get('limit'))
+    except ValueError:
+        return json_response({'error': 'limit must be an integer'}, status_code=status.HTTP_400_BAD_REQUEST)
+    documents = await run_query(
+        find_documents, leaderboard.find, {}, LeaderboardDocumentSerializer, LeaderboardViewSet.ordering, limit=limit
+    )
+    return json_response(LeaderboardDocumentSerializer(documents, many=True).data)
+
+
+async def users_by_team(request):
+    """Get users by team_id"""
+    team_id = request.GET.get('team_id', None)
+    if not team_id:
+        return json_response({'error': 'team_id parameter is required'}, status_code=status.HTTP_400_BAD_REQUEST)
+    return await paginated_documents(request, users.find, {'team_id': team_id}, ('_id',), UserDocumentSerializer)
@@ -0,0 +1,86 @@
+"""
+Response cache for read-heavy endpoints.
+
+Serialized response data is kept in the ``responses`` cache (a per-process
+LocMemCache by default, which evicts least recently used entries and
+expires them after a TTL). Cache keys include a version counter for every
+collection the response is built from. The counters live in MongoDB, so
+when any worker process writes to a collection it bumps the version and
+all workers stop using the old entries at once.
+
+The same key is sent as a weak ETag. A request whose If-None-Match still
+matches gets a 304 without the data being loaded or serialized.
+"""
+import hashlib
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.utils.http import parse_etags
+from rest_framework import status
+from rest_framework.response import Response
+
+from .repository import get_database
+
+VERSIONS_COLLECTION = 'cache_versions'
+
+
+def _versions():
+    return get_database()[VERSIONS_COLLECTION]
+
+
+def bump_version(*collections):
+    """Invalidate every cached response built from the given collections"""
+    for collection in collections:
+        _versions().update_one({'_id': collection}, {'$inc': {'version': 1}}, upsert=True)
+
+
+def get_versions(collections):
+    """Current version counter of each collection, in order"""
+    found = {
+        document['_id']: document['version']
+        for document in _versions().find({'_id': {'$in': list(collections)}})
+    }
+    return [found.get(collection, 0) for collection in collections]
+
+
+def cache_response(*models, timeout=DEFAULT_TIMEOUT, vary=None):
+    """
+    Cache a viewset action's response data until one of `models` is written.
+
+    `timeout` overrides the TTL of the ``responses`` cache. `vary(self,
+    request)` returns more of the key, for responses that depend on
+    something other than the request and the collections, such as today's
+    date.
+    """
+    collections = [model._meta.db_table for model in models]
+
+    def decorator(view_method):
+        @wraps(view_method)
+        def wrapper(self, request, *args, **kwargs):
+            versions = get_versions(collections)
+            extra = vary(self, request) if vary is not None else None
+            key = hashlib.sha1(
+                f'{request.get_full_path()}|{request.accepted_renderer.format}|{versions}|{extra}'.encode('utf-8')
+            ).hexdigest()
+            etag = f'W/"{key}"'
+            headers = {'ETag': etag, 'Cache-Control': 'no-cache'}
+
+            if etag in parse_etags(request.headers.get('If-None-Match', '')):
+                return Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+            cache = caches[settings.OCTOFIT_RESPONSE_CACHE]
+            data = cache.get(key)
+            if data is None:
+                response = view_method(self, request, *args, **kwargs)
+                if response.status_code != status.HTTP_200_OK:
+                    return response
+                cache.set(key, response.data, timeout)
+            else:
+                response = Response(data)
+            for header, value in headers.items():
+                response[header] = value
+            return response
+        return wrapper
+    return decorator
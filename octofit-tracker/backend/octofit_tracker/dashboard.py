@@ -0,0 +1,103 @@
+"""
+Composite dashboard: the data every page of the app shows, in one response.
+
+Each section is an independent MongoDB query run concurrently on a shared
+thread pool, so the response takes about as long as the slowest section
+rather than the sum of all of them. Every section has its own time budget:
+a section that has not finished by then is reported as timed out and left
+out of the response, and its query is bounded on the server with maxTimeMS
+so it does not keep running. The other sections are still returned.
+"""
+import contextvars
+import functools
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+from django.conf import settings
+
+from .models import TeamStanding, Workout
+from .repository import Repository, activities, leaderboard
+from .serializers import (
+    ActivityDocumentSerializer,
+    LeaderboardDocumentSerializer,
+    TeamStandingDocumentSerializer,
+    WorkoutDocumentSerializer
+)
+
+logger = logging.getLogger(__name__)
+
+_executor = ThreadPoolExecutor(
+    max_workers=settings.OCTOFIT_DASHBOARD_THREADS,
+    thread_name_prefix='octofit-dashboard'
+)
+
+
+def _documents(repository, serializer_class, ordering, limit, budget_ms):
+    projection = {name: 1 for name in serializer_class.field_names}
+    documents = repository.cursor({}, projection, ordering, limit=limit).max_time_ms(budget_ms)
+    return serializer_class(list(documents), many=True).data
+
+
+def leaderboard_section(limit, budget_ms):
+    """Top `limit` leaderboard entries"""
+    return _documents(leaderboard, LeaderboardDocumentSerializer, ('rank', '_id'), limit, budget_ms)
+
+
+def recent_activities_section(limit, budget_ms):
+    """The `limit` most recent activities"""
+    return _documents(activities, ActivityDocumentSerializer, ('-date', '-_id'), limit, budget_ms)
+
+
+def teams_section(limit, budget_ms):
+    """Team standings, best first"""
+    return _documents(Repository(TeamStanding), TeamStandingDocumentSerializer, ('rank', '_id'), limit, budget_ms)
+
+
+def workouts_section(limit, budget_ms):
+    """A random sample of `limit` workouts"""
+    projection = {name: 1 for name in WorkoutDocumentSerializer.field_names}
+    documents = Repository(Workout).collection.aggregate(
+        [{'$sample': {'size': limit}}, {'$project': projection}], maxTimeMS=budget_ms
+    )
+    return WorkoutDocumentSerializer(list(documents), many=True).data
+
+
+# Section name: (function, query parameter holding its row count, default count)
+SECTIONS = {
+    'leaderboard': (leaderboard_section, 'top', 10),
+    'recent_activities': (recent_activities_section, 'recent', 10),
+    'teams': (teams_section, 'teams', 10),
+    'workouts': (workouts_section, 'workouts', 5),
+}
+
+
+def build_dashboard(requested, budget_ms=None, sections=SECTIONS):
+    """
+    Run the `requested` {section name: row count} concurrently.
+
+    Returns ({name: data}, {name: error}) where each section missing from
+    the data timed out after `budget_ms` (OCTOFIT_DASHBOARD_SECTION_TIMEOUT_MS
+    by default) or failed.
+    """
+    budget_ms = budget_ms or settings.OCTOFIT_DASHBOARD_SECTION_TIMEOUT_MS
+    started = time.perf_counter()
+    futures = {
+        name: _executor.submit(
+            functools.partial(contextvars.copy_context().run, sections[name][0], limit, budget_ms)
+        )
+        for name, limit in requested.items()
+    }
+    data, errors = {}, {}
+    for name, future in futures.items():
+        # Every budget starts at submission, so sections waited on later get what is left of theirs
+        remaining = budget_ms / 1000 - (time.perf_counter() - started)
+        try:
+            data[name] = future.result(timeout=max(remaining, 0))
+        except TimeoutError:
+            future.cancel()
+            errors[name] = 'timed out'
+        except Exception:
+            logger.exception('Dashboard section %s failed', name)
+            errors[name] = 'failed'
+    return data, errors
@@ -0,0 +1,316 @@
+"""
+Live leaderboard updates, pushed to clients as Server-Sent Events.
+
+Events go through a per-process Broker that keeps the most recent
+OCTOFIT_EVENTS_BUFFER of them, already encoded as SSE frames, in one shared
+ring buffer. Publishing encodes and appends once and wakes every waiting
+subscriber: blocked threads through a
+Condition, and coroutines through one future per event loop. The cost of
+an event therefore does not grow with the number of subscribers. Each
+subscriber only remembers the id of the last event it sent. One that falls
+more than a buffer behind gets a `reset` event (re-fetch the leaderboard)
+and continues from the newest event, so a slow client never holds more
+than the buffer.
+
+Events:
+
+- ``entry``: a user's ``user_id``, ``total_calories``, ``total_activities``
+  and ``rank`` after a change;
+- ``shift``: the other entries ranked ``from_rank`` to ``to_rank``
+  (inclusive; null for the end of the board) moved ``by`` places;
+- ``reset``: the board was rebuilt or events were missed; re-fetch it.
+
+leaderboard.py publishes the events of each write. When MongoDB is a
+replica set (a single-node one is enough), it stores them as one document
+in the capped ``leaderboard_events`` collection, and every worker follows
+that collection with a change stream, so every worker sees every write.
+Otherwise they go straight to this process's broker, and each worker only
+sees the writes it made. OCTOFIT_EVENTS_SOURCE forces either source.
+
+The native ASGI stream bypasses Django's middleware, so it sends the CORS
+headers that django-cors-headers would itself.
+"""
+import asyncio
+import logging
+import re
+import threading
+import time
+import uuid
+from collections import deque
+
+from corsheaders.conf import conf as cors
+from django.conf import settings
+from pymongo.errors import CollectionInvalid, PyMongoError
+
+from .renderers import FastJSONRenderer
+from .repository import get_database
+
+logger = logging.getLogger(__name__)
+
+# Milliseconds a client waits before reconnecting after a stream ends
+RETRY_MS = 1000
+
+EVENTS_COLLECTION = 'leaderboard_events'
+# Size of the capped collection events are published through; only the
+# time a restarting watcher needs to resume has to fit in it
+EVENTS_COLLECTION_BYTES = 16 * 1024 * 1024
+
+
+def _wake(waiter):
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+class Broker:
+    """Fan-out of published events to any number of subscribers, through a bounded ring buffer"""
+
+    def __init__(self, size):
+        # Event ids restart with the process; the epoch tells a reconnecting
+        # client's Last-Event-ID from another process or run apart
+        self.epoch = uuid.uuid4().hex[:8]
+        self._events = deque(maxlen=size)
+        self._last_id = 0
+        self._condition = threading.Condition()
+        self._waiters = {}
+
+    @property
+    def last_id(self):
+        return self._last_id
+
+    def publish(self, kind, data):
+        with self._condition:
+            self._last_id += 1
+            self._events.append((self._last_id, self.format(self._last_id, kind, data)))
+            self._condition.notify_all()
+            waiters, self._waiters = self._waiters, {}
+        for loop, waiter in waiters.items():
+            loop.call_soon_threadsafe(_wake, waiter)
+
+    def format(self, event_id, kind, data):
+        """One SSE frame"""
+        payload = FastJSONRenderer().render(data).decode('utf-8')
+        return f'id: {self.epoch}-{event_id}\nevent: {kind}\ndata: {payload}\n\n'.encode('utf-8')
+
+    def read(self, after):
+        """((id, frame) of the events after id `after`, whether older unread events were already dropped)"""
+        with self._condition:
+            if after >= self._last_id:
+                return [], False
+            oldest = self._events[0][0]
+            if after < oldest - 1:
+                return [], True
+            # Readers are usually near the end, where deque indexing is cheap
+            return [self._events[index] for index in range(after - oldest + 1, len(self._events))], False
+
+    def wait(self, after, timeout):
+        """Block until an event after id `after` is published; False on timeout"""
+        with self._condition:
+            return self._condition.wait_for(lambda: self._last_id > after, timeout)
+
+    async def wait_async(self, after, timeout):
+        """Coroutine version of wait(); all subscribers on a loop share one future"""
+        loop = asyncio.get_running_loop()
+        with self._condition:
+            if self._last_id > after:
+                return True
+            waiter = self._waiters.get(loop)
+            if waiter is None:
+                waiter = self._waiters[loop] = loop.create_future()
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+
+broker = Broker(settings.OCTOFIT_EVENTS_BUFFER)
+
+_source = None
+_watching = False
+_capped = False
+_lock = threading.Lock()
+
+
+def get_source():
+    """'change_stream' or 'local', detected once per process when OCTOFIT_EVENTS_SOURCE is 'auto'"""
+    global _source
+    if _source is None:
+        source = settings.OCTOFIT_EVENTS_SOURCE
+        if source == 'auto':
+            try:
+                hello = get_database().client.admin.command('isMaster')
+            except PyMongoError:
+                hello = {}
+            source = 'change_stream' if hello.get('setName') else 'local'
+        _source = source
+    return _source
+
+
+def events_collection():
+    """The capped collection events are published through, created on first use"""
+    global _capped
+    database = get_database()
+    if not _capped:
+        with _lock:
+            try:
+                database.create_collection(EVENTS_COLLECTION, capped=True, size=EVENTS_COLLECTION_BYTES)
+            except CollectionInvalid:
+                pass  # already exists
+            _capped = True
+    return database[EVENTS_COLLECTION]
+
+
+def publish(*events):
+    """
+    Publish the (kind, data) events of one leaderboard write: to this
+    process's broker, or with a change stream as one document that every
+    worker's watcher reads.
+    """
+    if get_source() == 'local':
+        for kind, data in events:
+            broker.publish(kind, data)
+    else:
+        events_collection().insert_one({'events': [{'kind': kind, 'data': data} for kind, data in events]})
+
+
+def _watch():
+    """Publish the events stored by every worker, from a change stream, forever"""
+    resume_after = None
+    while True:
+        try:
+            pipeline = [{'$match': {'operationType': {'$in': ['insert', 'drop', 'invalidate']}}}]
+            with events_collection().watch(pipeline, resume_after=resume_after) as stream:
+                for change in stream:
+                    resume_after = change['_id']
+                    if change['operationType'] == 'insert':
+                        for event in change['fullDocument']['events']:
+                            broker.publish(event['kind'], event['data'])
+                    else:
+                        # The collection was dropped: the stream ends here
+                        resume_after = None
+                        broker.publish('reset', {})
+        except PyMongoError:
+            logger.exception('Leaderboard event stream failed; restarting')
+            resume_after = None
+            broker.publish('reset', {})
+            time.sleep(1)
+
+
+def start_source():
+    """Start the change stream watcher for this process if that is the source"""
+    global _watching
+    if get_source() != 'change_stream':
+        return
+    with _lock:
+        if not _watching:
+            threading.Thread(target=_watch, name='octofit-leaderboard-watch', daemon=True).start()
+            _watching = True
+
+
+def parse_last_event_id(value):
+    """Event id to continue after from a Last-Event-ID header; -1 when it is from another process"""
+    if not value:
+        return broker.last_id
+    epoch, _, event_id = value.partition('-')
+    if epoch != broker.epoch or not event_id.isdigit() or int(event_id) > broker.last_id:
+        return -1
+    return int(event_id)
+
+
+def pending_frames(after):
+    """(SSE frames for the events after id `after`, id to continue from)"""
+    events, lagged = broker.read(after) if after >= 0 else ([], True)
+    if lagged:
+        last_id = broker.last_id
+        return [broker.format(last_id, 'reset', {})], last_id
+    return [frame for event_id, frame in events], (events[-1][0] if events else after)
+
+
+def stream(last_event_id=None):
+    """
+    SSE body for a thread-per-connection (WSGI) server.
+
+    Ends after OCTOFIT_EVENTS_MAX_STREAM_SECONDS so the thread is given
+    back; the client reconnects with its Last-Event-ID and misses nothing.
+    """
+    start_source()
+    after = parse_last_event_id(last_event_id)
+    deadline = time.monotonic() + settings.OCTOFIT_EVENTS_MAX_STREAM_SECONDS
+    yield f'retry: {RETRY_MS}\n\n'.encode('utf-8')
+    while time.monotonic() < deadline:
+        frames, after = pending_frames(after)
+        yield from frames
+        if not frames and not broker.wait(after, settings.OCTOFIT_EVENTS_KEEPALIVE_SECONDS):
+            yield b': keepalive\n\n'
+
+
+def cors_headers(origin, preflight=False):
+    """ASGI response headers allowing `origin`, as CorsMiddleware would send them for this stream"""
+    if not origin:
+        return []
+    allowed = cors.CORS_ALLOW_ALL_ORIGINS or origin in cors.CORS_ALLOWED_ORIGINS or any(
+        re.match(pattern, origin) for pattern in cors.CORS_ALLOWED_ORIGIN_REGEXES
+    )
+    if not allowed:
+        return []
+    if cors.CORS_ALLOW_ALL_ORIGINS and not cors.CORS_ALLOW_CREDENTIALS:
+        headers = [(b'access-control-allow-origin', b'*')]
+    else:
+        headers = [(b'access-control-allow-origin', origin.encode('latin-1')), (b'vary', b'origin')]
+    if cors.CORS_ALLOW_CREDENTIALS:
+        headers.append((b'access-control-allow-credentials', b'true'))
+    if preflight:
+        allow_headers = ', '.join([*cors.CORS_ALLOW_HEADERS, 'last-event-id'])
+        headers += [
+            (b'access-control-allow-methods', b'GET, OPTIONS'),
+            (b'access-control-allow-headers', allow_headers.encode('latin-1')),
+            (b'access-control-max-age', str(cors.CORS_PREFLIGHT_MAX_AGE).encode('latin-1')),
+        ]
+    return headers
+
+
+async def asgi_stream(scope, receive, send):
+    """
+    Native ASGI SSE endpoint: one coroutine per client, no thread.
+
+    Django 4.1 cannot stream from async views, so asgi.py routes the
+    stream path here directly.
+    """
+    headers = dict(scope.get('headers', []))
+    origin = headers.get(b'origin', b'').decode('latin-1')
+    if scope['method'] == 'OPTIONS':
+        await send({'type': 'http.response.start', 'status': 200, 'headers': cors_headers(origin, preflight=True)})
+        await send({'type': 'http.response.body', 'body': b''})
+        return
+    start_source()
+    after = parse_last_event_id(headers.get(b'last-event-id', b'').decode('latin-1'))
+    await send({
+        'type': 'http.response.start',
+        'status': 200,
+        'headers': [
+            (b'content-type', b'text/event-stream'),
+            (b'cache-control', b'no-cache'),
+            (b'x-accel-buffering', b'no'),
+            *cors_headers(origin),
+        ],
+    })
+    disconnected = asyncio.ensure_future(_until_disconnected(receive))
+    try:
+        await _send_body(send, f'retry: {RETRY_MS}\n\n'.encode('utf-8'))
+        while not disconnected.done():
+            frames, after = pending_frames(after)
+            if frames:
+                await _send_body(send, b''.join(frames))
+            elif not await broker.wait_async(after, settings.OCTOFIT_EVENTS_KEEPALIVE_SECONDS):
+                await _send_body(send, b': keepalive\n\n')
+    finally:
+        disconnected.cancel()
+
+
+async def _until_disconnected(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+async def _send_body(send, body):
+    await send({'type': 'http.response.body', 'body': body, 'more_body': True})
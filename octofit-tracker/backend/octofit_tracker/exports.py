@@ -0,0 +1,58 @@
+"""
+Streaming exports.
+
+Documents are read from a batched MongoDB cursor and encoded as they
+arrive, so memory use does not grow with the size of the export.
+"""
+import csv
+
+from .renderers import FastJSONRenderer
+
+# Rows encoded per chunk handed to the response
+CHUNK_ROWS = 500
+
+
+class Echo:
+    """File-like object whose write() returns the written value, for csv.writer"""
+
+    def write(self, value):
+        return value
+
+
+def _close_when_done(chunks, cursor):
+    try:
+        yield from chunks
+    finally:
+        cursor.close()
+
+
+def iter_ndjson(cursor, serializer):
+    """Encode documents as newline-delimited JSON, one API-formatted object per line"""
+    def chunks():
+        renderer = FastJSONRenderer()
+        lines = []
+        for document in cursor:
+            lines.append(renderer.render(serializer.to_representation(document)))
+            if len(lines) >= CHUNK_ROWS:
+                yield b'\n'.join(lines) + b'\n'
+                lines = []
+        if lines:
+            yield b'\n'.join(lines) + b'\n'
+    return _close_when_done(chunks(), cursor)
+
+
+def iter_csv(cursor, serializer):
+    """Encode documents as CSV with a header row of the serializer's output fields"""
+    def chunks():
+        writer = csv.writer(Echo())
+        yield writer.writerow([name for name, convert in serializer.output_converters])
+        rows = []
+        for document in cursor:
+            row = serializer.to_representation(document)
+            rows.append(writer.writerow(['' if value is None else value for value in row.values()]))
+            if len(rows) >= CHUNK_ROWS:
+                yield ''.join(rows)
+                rows = []
+        if rows:
+            yield ''.join(rows)
+    return _close_when_done(chunks(), cursor)
@@ -0,0 +1,76 @@
+"""
+Precomputed distinct values for the admin's list filters.
+
+A list filter on a plain field normally runs SELECT DISTINCT over the whole
+collection on every changelist load. Instead, the values of each field in
+FILTER_FIELDS are kept in one small document per field and grown with
+$addToSet as documents are written. Each process remembers the values it
+has already stored, so a write only costs an extra update the first time
+it introduces a new value. Values are never removed on delete; a stale
+choice just filters to an empty list until the next refresh. A document
+grown by writes before any full scan is not marked complete, so the first
+read still computes it.
+"""
+import threading
+
+from .models import Activity, User, Workout
+from .pagination import get_value
+from .repository import Repository, get_database
+
+COLLECTION = 'filter_choices'
+
+# Fields whose admin list filters read precomputed values
+FILTER_FIELDS = {
+    Activity: ('activity_type',),
+    User: ('team_id',),
+    Workout: ('difficulty_level', 'exercise_type'),
+}
+
+_known = {}
+_lock = threading.Lock()
+
+
+def _choices():
+    return get_database()[COLLECTION]
+
+
+def choices_key(model, field):
+    return f'{model._meta.db_table}.{field}'
+
+
+def refresh_choices(model, field):
+    """Recompute a field's values with one distinct scan and store them"""
+    values = [value for value in Repository(model).collection.distinct(field) if value is not None]
+    key = choices_key(model, field)
+    _choices().replace_one({'_id': key}, {'_id': key, 'values': values, 'complete': True}, upsert=True)
+    with _lock:
+        _known[key] = set(values)
+    return values
+
+
+def refresh_all_choices():
+    for model, fields in FILTER_FIELDS.items():
+        for field in fields:
+            refresh_choices(model, field)
+
+
+def get_choices(model, field):
+    """Sorted stored values of a field; computed on first use"""
+    key = choices_key(model, field)
+    document = _choices().find_one({'_id': key})
+    if document is None or not document.get('complete'):
+        return sorted(refresh_choices(model, field))
+    return sorted(document['values'])
+
+
+def note_values(model, items):
+    """Add the filter field values of written documents or instances to the stored choices"""
+    for field in FILTER_FIELDS.get(model, ()):
+        key = choices_key(model, field)
+        values = {get_value(item, field) for item in items} - {None}
+        with _lock:
+            new = values - _known.setdefault(key, set())
+        if new:
+            _choices().update_one({'_id': key}, {'$addToSet': {'values': {'$each': sorted(new)}}}, upsert=True)
+            with _lock:
+                _known[key] |= new
@@ -0,0 +1,231 @@
+"""
+Batched activity writes.
+
+Activities are inserted with a single unordered ``insert_many`` and the
+leaderboard receives one increment per user in the batch instead of one
+per activity; daily rollups get one per user and day.
+
+apply_activity_change applies a single create, update or delete, whether
+it went through the ORM (signals) or the repository (views).
+
+With OCTOFIT_WRITE_BEHIND on, single creates are not written by the
+request at all: they go into the bounded write_behind queue, and one
+background thread per process writes them with insert_activities in
+batches of up to OCTOFIT_WRITE_BEHIND_BATCH_SIZE, or whatever arrived
+within OCTOFIT_WRITE_BEHIND_FLUSH_MS of the first one. A full queue
+rejects new activities instead of growing. At exit the queue stops
+accepting activities and is drained.
+"""
+import atexit
+import logging
+import queue
+import threading
+import time
+from collections import defaultdict
+
+from bson import ObjectId
+from django.conf import settings
+from django.utils import timezone
+from pymongo.errors import BulkWriteError, PyMongoError
+
+from .filter_choices import note_values
+from .leaderboard import apply_activity_delta
+from .models import Activity
+from .pagination import get_value
+from .repository import activities
+from .rollups import apply_rollup_deltas
+
+logger = logging.getLogger(__name__)
+
+# Longest the flusher blocks on the queue before checking for a drain
+POLL_SECONDS = 0.05
+
+# Longest wait between attempts to write a batch while MongoDB is unavailable
+MAX_RETRY_SECONDS = 30
+
+
+def activity_document(validated_data):
+    """Build the stored document for validated ActivitySerializer data"""
+    return {
+        '_id': ObjectId(),
+        'user_id': validated_data['user_id'],
+        'activity_type': validated_data['activity_type'],
+        'duration': validated_data['duration'],
+        'distance': validated_data.get('distance'),
+        'calories': validated_data['calories'],
+        'date': validated_data['date'],
+        'created_at': timezone.now(),
+    }
+
+
+def apply_to_leaderboard(documents):
+    """Add inserted activity documents to the leaderboard, one update per user"""
+    totals = defaultdict(lambda: [0, 0])
+    for document in documents:
+        totals[document['user_id']][0] += document['calories']
+        totals[document['user_id']][1] += 1
+    for user_id, (calories, activities) in totals.items():
+        apply_activity_delta(user_id, calories, activities)
+
+
+def apply_activity_change(before=None, after=None):
+    """
+    Apply one activity write to the leaderboard and daily rollups.
+
+    `before` is the stored activity (None when it was created) and `after`
+    the written one (None when it was deleted); either may be a document
+    or a model instance.
+    """
+    if before is not None and after is not None and get_value(before, 'user_id') == get_value(after, 'user_id'):
+        calories = get_value(after, 'calories') - get_value(before, 'calories')
+        apply_activity_delta(get_value(after, 'user_id'), calories, 0)
+    else:
+        if before is not None:
+            apply_activity_delta(get_value(before, 'user_id'), -get_value(before, 'calories'), -1)
+        if after is not None:
+            apply_activity_delta(get_value(after, 'user_id'), get_value(after, 'calories'), 1)
+    apply_rollup_deltas(
+        added=[after] if after is not None else [],
+        removed=[before] if before is not None else [],
+    )
+    if after is not None:
+        note_values(Activity, [after])
+
+
+def insert_activities(documents):
+    """
+    Insert activity documents in one unordered bulk write.
+
+    Every document that could be written is kept even if others fail.
+    Returns a dict mapping the index of each failed document to its error.
+    """
+    if not documents:
+        return {}
+    failed = {}
+    try:
+        activities.insert_many(documents, ordered=False)
+    except BulkWriteError as exc:
+        failed = {error['index']: error['errmsg'] for error in exc.details['writeErrors']}
+    inserted = [document for index, document in enumerate(documents) if index not in failed]
+    apply_to_leaderboard(inserted)
+    apply_rollup_deltas(added=inserted)
+    note_values(Activity, inserted)
+    return failed
+
+
+class WriteBehindQueue:
+    """Bounded queue of activity documents written in batches by a background thread"""
+
+    def __init__(self, size, batch_size, flush_ms, write=insert_activities):
+        self.batch_size = batch_size
+        self.interval = flush_ms / 1000
+        self.write = write
+        self._queue = queue.Queue(maxsize=size)
+        self._lock = threading.Lock()
+        self._worker = None
+        self._closed = False
+
+    @property
+    def pending(self):
+        """Documents accepted but not yet written"""
+        return self._queue.unfinished_tasks
+
+    def put(self, document):
+        """Queue a document for writing; raises queue.Full when the queue is full or draining"""
+        with self._lock:
+            if self._closed:
+                raise queue.Full
+            self._start()
+            self._queue.put_nowait(document)
+
+    def join(self):
+        """Block until every queued document has been written"""
+        self._queue.join()
+
+    def drain(self, timeout=None):
+        """Stop accepting documents and wait for the queued ones to be written; False on timeout"""
+        with self._lock:
+            self._closed = True
+            worker = self._worker
+        if worker is None:
+            return True
+        worker.join(timeout)
+        if worker.is_alive():
+            logger.error('Write-behind drain timed out with %d activities not written', self.pending)
+            return False
+        return True
+
+    def _start(self):
+        """Start the flusher thread on first use; called with the lock held"""
+        if self._worker is None:
+            self._worker = threading.Thread(target=self._run, name='octofit-write-behind', daemon=True)
+            self._worker.start()
+            atexit.register(self.drain, settings.OCTOFIT_WRITE_BEHIND_DRAIN_SECONDS)
+
+    def _run(self):
+        while True:
+            batch = self._take()
+            if batch is None:
+                return
+            if batch:
+                self._write(batch)
+
+    def _take(self):
+        """The next batch, [] when none arrived in time, or None once drained"""
+        try:
+            batch = [self._queue.get(timeout=POLL_SECONDS)]
+        except queue.Empty:
+            return None if self._closed else []
+        deadline = time.monotonic() + self.interval
+        while len(batch) < self.batch_size and time.monotonic() < deadline:
+            try:
+                # Waits in short slices so a drain does not wait out the interval
+                batch.append(self._queue.get(timeout=max(min(deadline - time.monotonic(), POLL_SECONDS), 0)))
+            except queue.Empty:
+                if self._closed:
+                    break
+        return batch
+
+    def _write(self, batch):
+        """
+        Write a batch, retrying while MongoDB is unavailable.
+
+        A batch that was inserted before the failure is not retried, since
+        its leaderboard increments may already be partly applied.
+        """
+        delay = self.interval or 0.1
+        failed = {}
+        while True:
+            try:
+                failed = self.write(batch)
+                break
+            except PyMongoError:
+                if self._inserted(batch):
+                    logger.exception(
+                        'Write-behind batch of %d activities was inserted but not fully applied; '
+                        'run manage.py rebuild_leaderboard', len(batch)
+                    )
+                    break
+                logger.exception('Write-behind batch of %d activities failed; retrying in %.1fs', len(batch), delay)
+                time.sleep(delay)
+                delay = min(delay * 2, MAX_RETRY_SECONDS)
+            except Exception:
+                logger.exception('Write-behind batch of %d activities failed and was dropped', len(batch))
+                break
+        for index, error in failed.items():
+            logger.error('Write-behind activity %s was not written: %s', batch[index]['_id'], error)
+        for _ in batch:
+            self._queue.task_done()
+
+    def _inserted(self, batch):
+        try:
+            return activities.find_one({'_id': {'$in': [document['_id'] for document in batch]}}, {'_id': 1}) is not None
+        except PyMongoError:
+            return False
+
+
+write_behind = WriteBehindQueue(
+    settings.OCTOFIT_WRITE_BEHIND_QUEUE_SIZE,
+    settings.OCTOFIT_WRITE_BEHIND_BATCH_SIZE,
+    settings.OCTOFIT_WRITE_BEHIND_FLUSH_MS,
+)
@@ -0,0 +1,324 @@
+"""
+Incremental maintenance of the materialized user leaderboard and team standings.
+
+Every activity write adjusts the owner's totals, and those of the owner's
+team, with an atomic update and then moves only the entries between the old
+and new position. Entries are ordered by ``total_calories`` descending with
+ties broken by ``user_id`` (or ``team_id``) ascending, and ``rank`` is the
+1-based position in that order. Team standings also follow users joining
+and leaving teams.
+
+Shifting ranks takes several writes, so re-ranking is serialised across
+every worker process by a lease document in the ``locks`` collection.
+Only one process at a time holds it; a lease whose holder died expires
+after OCTOFIT_RERANK_LEASE_SECONDS and is then taken over.
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+from bson import ObjectId
+from django.conf import settings
+from django.utils import timezone
+from pymongo import ASCENDING, DESCENDING, ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from .cache import bump_version
+from .events import publish
+from .models import Activity, Leaderboard, MonthlySummary, Team, TeamStanding, User
+from .repository import get_database
+
+# Order that defines ranks; keep sorts elsewhere consistent with it
+RANK_ORDER = [('total_calories', DESCENDING), ('user_id', ASCENDING)]
+TEAM_RANK_ORDER = [('total_calories', DESCENDING), ('team_id', ASCENDING)]
+
+# Calories per member, from a standing's own totals
+TEAM_AVERAGE = {'$cond': [{'$gt': ['$members', 0]}, {'$divide': ['$total_calories', '$members']}, 0.0]}
+
+LOCKS_COLLECTION = 'locks'
+RERANK_LEASE = 'rerank'
+
+# Totals are atomic on their own; re-ranking is serialised by the lease
+# across processes, and by this lock between the threads of one process
+_rerank_lock = threading.Lock()
+
+
+def _take_lease(name, owner, seconds):
+    """Take the lease `name` for `owner` if it is free or expired; return whether it was taken"""
+    # Matches on _id alone, so a free lease is simply inserted; whether it
+    # is taken over is decided inside the update. A new document has no
+    # `expires`, which compares below any date.
+    free = {'$lt': ['$expires', '$$NOW']}
+    try:
+        lease = get_database()[LOCKS_COLLECTION].find_one_and_update(
+            {'_id': name},
+            [{'$set': {
+                'owner': {'$cond': [free, owner, '$owner']},
+                'expires': {'$cond': [free, {'$add': ['$$NOW', int(seconds * 1000)]}, '$expires']},
+            }}],
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+    except DuplicateKeyError:
+        # Another worker inserted it concurrently, so it holds the lease
+        return False
+    return lease['owner'] == owner
+
+
+@contextmanager
+def _reranking(seconds=None):
+    """
+    Hold the re-ranking lease for the duration of the block.
+
+    Waits for the current holder to release it, or for its lease to
+    expire. Expiry uses the server's clock, so workers on different hosts
+    agree on it. `seconds` is how long this holder may keep it.
+    """
+    seconds = seconds or settings.OCTOFIT_RERANK_LEASE_SECONDS
+    owner = ObjectId()
+    with _rerank_lock:
+        delay = 0.005
+        while not _take_lease(RERANK_LEASE, owner, seconds):
+            time.sleep(delay)
+            delay = min(delay * 2, 0.1)
+        try:
+            yield
+        finally:
+            get_database()[LOCKS_COLLECTION].delete_one({'_id': RERANK_LEASE, 'owner': owner})
+
+
+def _ahead_of(key, value, total_calories):
+    """Filter for entries ranked ahead of the entry `key`=`value` with the given total"""
+    return {
+        '$or': [
+            {'total_calories': {'$gt': total_calories}},
+            {'total_calories': total_calories, key: {'$lt': value}},
+        ]
+    }
+
+
+def _increment(user_id, calories, activities):
+    """Atomically add to a user's totals, returning the entry before the update"""
+    update = {
+        '$inc': {'total_calories': calories, 'total_activities': activities},
+        '$set': {'updated_at': timezone.now()},
+    }
+    try:
+        return Leaderboard.objects.mongo_find_one_and_update(
+            {'user_id': user_id}, update, upsert=True, return_document=ReturnDocument.BEFORE
+        )
+    except DuplicateKeyError:
+        # A concurrent writer created the entry first; it exists now
+        return Leaderboard.objects.mongo_find_one_and_update(
+            {'user_id': user_id}, update, return_document=ReturnDocument.BEFORE
+        )
+
+
+def _rerank(model, key, value, total_calories, old_rank):
+    """
+    Move an entry to its new position, shifting only the entries it passed.
+
+    Returns (new rank, shift) where shift is (from_rank, to_rank, by) for
+    the other entries that moved, or None.
+    """
+    manager = model.objects
+    new_rank = manager.mongo_count_documents(_ahead_of(key, value, total_calories)) + 1
+    others = {key: {'$ne': value}}
+    if old_rank is None:
+        manager.mongo_update_many({**others, 'rank': {'$gte': new_rank}}, {'$inc': {'rank': 1}})
+        shift = (new_rank, None, 1)
+    elif new_rank < old_rank:
+        manager.mongo_update_many({**others, 'rank': {'$gte': new_rank, '$lt': old_rank}}, {'$inc': {'rank': 1}})
+        shift = (new_rank, old_rank - 1, 1)
+    elif new_rank > old_rank:
+        manager.mongo_update_many({**others, 'rank': {'$gt': old_rank, '$lte': new_rank}}, {'$inc': {'rank': -1}})
+        shift = (old_rank + 1, new_rank, -1)
+    else:
+        return new_rank, None
+    manager.mongo_update_one({key: value}, {'$set': {'rank': new_rank}})
+    return new_rank, shift
+
+
+def _team_of(user_id):
+    """team_id of the user with the given string id, or None"""
+    if not ObjectId.is_valid(user_id):
+        return None
+    user = User.objects.mongo_find_one({'_id': ObjectId(user_id)}, {'team_id': 1})
+    return (user or {}).get('team_id') or None
+
+
+def _update_team(team_id, calories, activities, members):
+    """
+    Add to a team's totals and member count, then re-rank it.
+
+    Teams without a standing (unknown team ids) are left alone.
+    """
+    if not team_id:
+        return
+    before = TeamStanding.objects.mongo_find_one_and_update(
+        {'team_id': team_id},
+        [
+            {'$set': {
+                'total_calories': {'$add': ['$total_calories', calories]},
+                'total_activities': {'$add': ['$total_activities', activities]},
+                'members': {'$add': ['$members', members]},
+                'updated_at': timezone.now(),
+            }},
+            {'$set': {'avg_calories_per_member': TEAM_AVERAGE}},
+        ],
+        return_document=ReturnDocument.BEFORE,
+    )
+    if before is not None and calories:
+        _rerank(TeamStanding, 'team_id', team_id, before['total_calories'] + calories, before.get('rank'))
+
+
+def apply_activity_delta(user_id, calories, activities):
+    """Add calories and an activity count (either may be negative) to a user's entry"""
+    if not calories and not activities:
+        return
+    team_id = _team_of(user_id)
+    with _reranking():
+        before = _increment(user_id, calories, activities) or {}
+        total_calories = before.get('total_calories', 0) + calories
+        rank, shift = before.get('rank'), None
+        if not before:
+            rank, shift = _rerank(Leaderboard, 'user_id', user_id, calories, None)
+        elif calories:
+            rank, shift = _rerank(Leaderboard, 'user_id', user_id, total_calories, rank)
+        _update_team(team_id, calories, activities, 0)
+        changes = [] if shift is None else [('shift', dict(zip(('from_rank', 'to_rank', 'by'), shift)))]
+        changes.append(('entry', {
+            'user_id': user_id,
+            'total_calories': total_calories,
+            'total_activities': before.get('total_activities', 0) + activities,
+            'rank': rank,
+        }))
+        publish(*changes)
+    bump_version(Leaderboard._meta.db_table, TeamStanding._meta.db_table)
+
+
+def move_member(user_id, old_team_id, new_team_id):
+    """Move a user, with their leaderboard totals, from one team to another (either may be None)"""
+    old_team_id, new_team_id = old_team_id or None, new_team_id or None
+    if old_team_id == new_team_id:
+        return
+    with _reranking():
+        entry = Leaderboard.objects.mongo_find_one({'user_id': user_id}) or {}
+        calories, activities = entry.get('total_calories', 0), entry.get('total_activities', 0)
+        _update_team(old_team_id, -calories, -activities, -1)
+        _update_team(new_team_id, calories, activities, 1)
+    bump_version(TeamStanding._meta.db_table)
+
+
+def sync_team(team_id, team_name):
+    """Create the standing of a new team at its position, or rename an existing one"""
+    with _reranking():
+        before = TeamStanding.objects.mongo_find_one_and_update(
+            {'team_id': team_id},
+            {
+                '$set': {'team_name': team_name, 'updated_at': timezone.now()},
+                '$setOnInsert': {
+                    'members': 0,
+                    'total_calories': 0,
+                    'total_activities': 0,
+                    'avg_calories_per_member': 0.0,
+                },
+            },
+            upsert=True,
+            return_document=ReturnDocument.BEFORE,
+        )
+        if before is None:
+            _rerank(TeamStanding, 'team_id', team_id, 0, None)
+    bump_version(TeamStanding._meta.db_table)
+
+
+def remove_team(team_id):
+    """Drop a deleted team's standing and close the gap in the ranks"""
+    with _reranking():
+        removed = TeamStanding.objects.mongo_find_one_and_delete({'team_id': team_id})
+        if removed is not None and removed.get('rank') is not None:
+            TeamStanding.objects.mongo_update_many({'rank': {'$gt': removed['rank']}}, {'$inc': {'rank': -1}})
+    bump_version(TeamStanding._meta.db_table)
+
+
+def totals_pipeline():
+    """
+    Activities pipeline grouping every user's calories and activity count,
+    archived ones included, as {_id: user_id, total_calories, total_activities}
+    """
+    return [
+        {'$project': {'_id': 0, 'user_id': 1, 'calories': 1, 'count': {'$literal': 1}}},
+        {'$unionWith': {
+            'coll': MonthlySummary._meta.db_table,
+            'pipeline': [{'$project': {'_id': 0, 'user_id': 1, 'calories': 1, 'count': 1}}],
+        }},
+        {'$group': {
+            '_id': '$user_id',
+            'total_calories': {'$sum': '$calories'},
+            'total_activities': {'$sum': '$count'},
+        }},
+    ]
+
+
+def rebuild_leaderboard():
+    """
+    Recompute every entry from the activities collection, then the team
+    standings from the new entries.
+
+    Runs as one server-side aggregation that groups activities, together
+    with the monthly summaries of archived ones, per user, numbers them in
+    RANK_ORDER and replaces the collection with $out.
+    """
+    with _reranking(settings.OCTOFIT_REBUILD_LEASE_SECONDS):
+        Activity.objects.mongo_aggregate(totals_pipeline() + [
+            {'$project': {
+                '_id': 0,
+                'user_id': '$_id',
+                'total_calories': 1,
+                'total_activities': 1,
+                'updated_at': '$$NOW',
+            }},
+            {'$setWindowFields': {
+                'sortBy': dict(RANK_ORDER),
+                'output': {'rank': {'$documentNumber': {}}},
+            }},
+            {'$out': Leaderboard._meta.db_table},
+        ], allowDiskUse=True)
+        _rebuild_team_standings()
+        publish(('reset', {}))
+    bump_version(Leaderboard._meta.db_table, TeamStanding._meta.db_table)
+
+
+def _rebuild_team_standings():
+    """Total every team's members from the leaderboard, number them in TEAM_RANK_ORDER and $out"""
+    Team.objects.mongo_aggregate([
+        {'$project': {'_id': 0, 'team_id': {'$toString': '$_id'}, 'team_name': '$name'}},
+        {'$lookup': {
+            'from': User._meta.db_table,
+            'localField': 'team_id',
+            'foreignField': 'team_id',
+            'pipeline': [{'$project': {'_id': 0, 'user_id': {'$toString': '$_id'}}}],
+            'as': 'users',
+        }},
+        {'$lookup': {
+            'from': Leaderboard._meta.db_table,
+            'localField': 'users.user_id',
+            'foreignField': 'user_id',
+            'pipeline': [{'$project': {'_id': 0, 'total_calories': 1, 'total_activities': 1}}],
+            'as': 'entries',
+        }},
+        {'$project': {
+            'team_id': 1,
+            'team_name': 1,
+            'members': {'$size': '$users'},
+            'total_calories': {'$sum': '$entries.total_calories'},
+            'total_activities': {'$sum': '$entries.total_activities'},
+            'updated_at': '$$NOW',
+        }},
+        {'$set': {'avg_calories_per_member': TEAM_AVERAGE}},
+        {'$setWindowFields': {
+            'sortBy': dict(TEAM_RANK_ORDER),
+            'output': {'rank': {'$documentNumber': {}}},
+        }},
+        {'$out': TeamStanding._meta.db_table},
+    ], allowDiskUse=True)
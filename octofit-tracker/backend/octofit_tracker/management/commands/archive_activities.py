@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from octofit_tracker.archive import archive_activities, archive_cutoff
+
+
+class Command(BaseCommand):
+    help = 'Move old activities into compressed monthly archive chunks and per-user monthly summaries'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=None,
+                            help='Archive activities older than this many days, rounded down to the '
+                                 'first of the month (default: OCTOFIT_ARCHIVE_AFTER_DAYS)')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only report what would be archived')
+
+    def handle(self, *args, **options):
+        cutoff = archive_cutoff(options['days'])
+        self.stdout.write(f'Archiving activities dated before {cutoff:%Y-%m-%d}...')
+        archived, months = archive_activities(cutoff, dry_run=options['dry_run'])
+        verb = 'Would archive' if options['dry_run'] else 'Archived'
+        self.stdout.write(self.style.SUCCESS(f'{verb} {archived} activities in {months} user months'))
@@ -0,0 +1,286 @@
+import http.client
+import json
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone as dt_timezone
+from pathlib import Path
+from urllib.parse import urlencode, urlsplit
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.core.servers.basehttp import ThreadedWSGIServer, WSGIRequestHandler
+from django.core.wsgi import get_wsgi_application
+
+from octofit_tracker.repository import Repository
+from octofit_tracker.urls import router
+
+WORKLOADS = ('read', 'bulk', 'mixed')
+
+# Query parameters an action needs, from the sample documents
+ACTION_PARAMS = {
+    ('users', 'by_team'): lambda samples: {'team_id': samples['users'].get('team_id')},
+    ('activities', 'by_user'): lambda samples: {'user_id': samples['activities'].get('user_id')},
+    ('activities', 'export'): lambda samples: {'format': 'ndjson', 'user_id': samples['activities'].get('user_id')},
+    ('workouts', 'by_difficulty'): lambda samples: {'difficulty': samples['workouts'].get('difficulty_level')},
+    ('workouts', 'by_type'): lambda samples: {'type': samples['workouts'].get('exercise_type')},
+    ('leaderboard', 'rank'): lambda samples: {'user_id': samples['leaderboard'].get('user_id')},
+    ('leaderboard', 'around'): lambda samples: {'user_id': samples['leaderboard'].get('user_id')},
+    ('workouts', 'search'): lambda samples: {'q': samples['workouts'].get('exercise_type')},
+}
+
+# Actions that stream until the client leaves, which a request/response benchmark cannot time
+STREAMING_ACTIONS = {('leaderboard', 'stream')}
+
+# Share of requests in the mixed workload that are writes
+MIXED_WRITE_SHARE = 0.1
+
+DEFAULT_BASELINE = Path(settings.BASE_DIR) / 'benchmarks' / 'baseline.json'
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+def summarize(samples, elapsed):
+    """Throughput and latency percentiles (ms) of (status, seconds) samples over `elapsed` seconds"""
+    latencies = sorted(seconds for status, seconds in samples if 200 <= status < 300)
+    return {
+        'requests': len(samples),
+        'errors': len(samples) - len(latencies),
+        'throughput': round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 2) if latencies else None,
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 2) if latencies else None,
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 2) if latencies else None,
+    }
+
+
+def find_regressions(results, baseline, threshold):
+    """
+    Compare results with a baseline of the same shape.
+
+    An endpoint regresses when its p95 latency grows, or its throughput
+    drops, by more than `threshold` (a fraction) or when it starts failing.
+    Endpoints missing from either side are skipped.
+    """
+    regressions = []
+    for workload, endpoints in results.items():
+        for endpoint, current in endpoints.items():
+            previous = baseline.get(workload, {}).get(endpoint)
+            if previous is None:
+                continue
+            name = f'{workload} {endpoint}'
+            if current['errors'] > previous['errors']:
+                regressions.append(f'{name}: {current["errors"]} errors (baseline {previous["errors"]})')
+            if previous['p95_ms'] and current['p95_ms'] and current['p95_ms'] > previous['p95_ms'] * (1 + threshold):
+                regressions.append(f'{name}: p95 {current["p95_ms"]}ms (baseline {previous["p95_ms"]}ms)')
+            if previous['throughput'] and current['throughput'] < previous['throughput'] * (1 - threshold):
+                regressions.append(f'{name}: {current["throughput"]} req/s (baseline {previous["throughput"]} req/s)')
+    return regressions
+
+
+class Command(BaseCommand):
+    help = 'Load-test every API route with concurrent clients and check the results against a baseline'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default=None,
+                            help='Base URL of a running server; by default an in-process threaded server is started')
+        parser.add_argument('--populate', action='store_true',
+                            help='Re-seed the database first with populate_db (destroys existing data)')
+        parser.add_argument('--users', type=int, default=1000,
+                            help='Users to seed with --populate')
+        parser.add_argument('--activities-per-user', type=int, default=20,
+                            help='Activities per user to seed with --populate')
+        parser.add_argument('--workload', choices=WORKLOADS, action='append',
+                            help='Workload to run (repeatable); all by default')
+        parser.add_argument('--clients', type=int, default=16,
+                            help='Concurrent clients')
+        parser.add_argument('--requests', type=int, default=200,
+                            help='Requests per endpoint (bulk: per workload, mixed: x10)')
+        parser.add_argument('--bulk-size', type=int, default=100,
+                            help='Activities per bulk write')
+        parser.add_argument('--output', default=None,
+                            help='Write the results as JSON to this file')
+        parser.add_argument('--baseline', default=str(DEFAULT_BASELINE),
+                            help='Baseline results to check against')
+        parser.add_argument('--save-baseline', action='store_true',
+                            help='Store these results as the new baseline instead of checking them')
+        parser.add_argument('--threshold', type=float, default=0.2,
+                            help='Allowed p95 latency growth or throughput drop, as a fraction')
+
+    def handle(self, *args, **options):
+        if options['populate']:
+            call_command(
+                'populate_db',
+                users=options['users'],
+                activities_per_user=options['activities_per_user'],
+                seed=1,
+                stdout=self.stdout,
+            )
+
+        server = None
+        base_url = options['url']
+        if base_url is None:
+            server = ThreadedWSGIServer(('127.0.0.1', 0), QuietRequestHandler)
+            server.set_app(get_wsgi_application())
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            base_url = f'http://127.0.0.1:{server.server_address[1]}'
+
+        try:
+            self.base = urlsplit(base_url)
+            self.rng = random.Random(1)
+            samples = self.load_samples()
+            results = {}
+            for workload in options['workload'] or WORKLOADS:
+                self.stdout.write(f'Running {workload} workload...')
+                results[workload] = getattr(self, f'run_{workload}')(samples, options)
+        finally:
+            if server is not None:
+                server.shutdown()
+                server.server_close()
+
+        self.report(results)
+        document = {
+            'meta': {
+                'created': datetime.now(dt_timezone.utc).isoformat(),
+                'clients': options['clients'],
+                'requests': options['requests'],
+                'bulk_size': options['bulk_size'],
+            },
+            'results': results,
+        }
+        if options['output']:
+            Path(options['output']).write_text(json.dumps(document, indent=2))
+
+        baseline_path = Path(options['baseline'])
+        if options['save_baseline']:
+            baseline_path.parent.mkdir(parents=True, exist_ok=True)
+            baseline_path.write_text(json.dumps(document, indent=2))
+            self.stdout.write(self.style.SUCCESS(f'Saved baseline to {baseline_path}'))
+        elif baseline_path.exists():
+            baseline = json.loads(baseline_path.read_text())['results']
+            regressions = find_regressions(results, baseline, options['threshold'])
+            if regressions:
+                raise CommandError('Performance regressions:\n' + '\n'.join(regressions))
+            self.stdout.write(self.style.SUCCESS(f'No regressions against {baseline_path}'))
+        else:
+            self.stdout.write(self.style.WARNING(f'No baseline at {baseline_path}; use --save-baseline'))
+
+    def load_samples(self):
+        """One stored document per registered viewset, to fill in ids and parameters"""
+        samples = {}
+        for prefix, viewset, basename in router.registry:
+            queryset = getattr(viewset, 'queryset', None)
+            if queryset is not None:
+                samples[prefix] = Repository(queryset.model).find_one() or {}
+        if not samples.get('activities'):
+            raise CommandError('The database is empty; run with --populate')
+        return samples
+
+    def read_endpoints(self, samples):
+        """(name, path) of every GET route registered on the router"""
+        endpoints = []
+        for prefix, viewset, basename in router.registry:
+            for route in router.get_routes(viewset):
+                # Extra action mappings override .get(), so index instead
+                action = route.mapping['get'] if 'get' in route.mapping else None
+                if action is None or not hasattr(viewset, action) or (prefix, action) in STREAMING_ACTIONS:
+                    continue
+                sample_id = samples.get(prefix, {}).get('_id')
+                if route.detail and sample_id is None:
+                    continue
+                path = route.url.strip('^$').format(prefix=prefix, lookup=sample_id, trailing_slash='/')
+                params = ACTION_PARAMS.get((prefix, action), lambda samples: {})(samples)
+                query = f'?{urlencode(params)}' if params else ''
+                endpoints.append((f'GET {prefix} {action}', f'/api/{path}{query}'))
+        return endpoints
+
+    def activity(self, samples):
+        return {
+            'user_id': samples['activities']['user_id'],
+            'activity_type': self.rng.choice(['Running', 'Cycling', 'Swimming', 'Yoga']),
+            'duration': self.rng.randint(10, 90),
+            'distance': round(self.rng.uniform(1, 20), 2),
+            'calories': self.rng.randint(50, 900),
+            'date': datetime.now(dt_timezone.utc).isoformat(),
+        }
+
+    def fetch(self, method, path, body=None):
+        """Issue one request on a fresh connection; return (status, seconds)"""
+        connection = http.client.HTTPConnection(self.base.hostname, self.base.port or 80, timeout=60)
+        headers = {'Accept': 'application/json'}
+        if body is not None:
+            body = json.dumps(body)
+            headers['Content-Type'] = 'application/json'
+        started = time.perf_counter()
+        try:
+            connection.request(method, path, body=body, headers=headers)
+            response = connection.getresponse()
+            response.read()
+            return response.status, time.perf_counter() - started
+        except OSError:
+            return 0, time.perf_counter() - started
+        finally:
+            connection.close()
+
+    def run_requests(self, requests, clients):
+        """Send (name, method, path, body) requests from `clients` threads; return {name: summary}"""
+        samples = {}
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=clients) as executor:
+            timings = executor.map(lambda request: self.fetch(*request[1:]), requests)
+            for (name, *_), timing in zip(requests, timings):
+                samples.setdefault(name, []).append(timing)
+        elapsed = time.perf_counter() - started
+        results = {name: summarize(timings, elapsed) for name, timings in samples.items()}
+        if len(results) > 1:
+            results['*'] = summarize([timing for timings in samples.values() for timing in timings], elapsed)
+        return results
+
+    def run_read(self, samples, options):
+        results = {}
+        for name, path in self.read_endpoints(samples):
+            results.update(self.run_requests([(name, 'GET', path, None)] * options['requests'], options['clients']))
+        return results
+
+    def run_bulk(self, samples, options):
+        requests = [
+            ('POST activities bulk', 'POST', '/api/activities/bulk/',
+             [self.activity(samples) for _ in range(options['bulk_size'])])
+            for _ in range(options['requests'])
+        ]
+        return self.run_requests(requests, options['clients'])
+
+    def run_mixed(self, samples, options):
+        reads = self.read_endpoints(samples)
+        requests = []
+        for _ in range(options['requests'] * 10):
+            if self.rng.random() >= MIXED_WRITE_SHARE:
+                name, path = self.rng.choice(reads)
+                requests.append((name, 'GET', path, None))
+            elif self.rng.random() < 0.5:
+                requests.append(('POST activities create', 'POST', '/api/activities/', self.activity(samples)))
+            else:
+                batch = [self.activity(samples) for _ in range(options['bulk_size'])]
+                requests.append(('POST activities bulk', 'POST', '/api/activities/bulk/', batch))
+        return self.run_requests(requests, options['clients'])
+
+    def report(self, results):
+        for workload, endpoints in results.items():
+            self.stdout.write(f'\n{workload}')
+            self.stdout.write(f'  {"endpoint":<40} {"req/s":>9} {"p50 ms":>9} {"p95 ms":>9} {"p99 ms":>9} {"errors":>7}')
+            for endpoint, summary in endpoints.items():
+                self.stdout.write(
+                    f'  {endpoint:<40} {summary["throughput"]:>9} {summary["p50_ms"]!s:>9} '
+                    f'{summary["p95_ms"]!s:>9} {summary["p99_ms"]!s:>9} {summary["errors"]:>7}'
+                )
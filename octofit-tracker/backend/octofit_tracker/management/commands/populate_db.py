@@ -1,22 +1,170 @@
+from django.core.management import call_command
 from django.core.management.base import BaseCommand
-from octofit_tracker.models import User, Team, Activity, Leaderboard, Workout
-from datetime import datetime, timedelta
-from pymongo import MongoClient
+from django.utils import timezone
+from octofit_tracker.cache import bump_version
+from octofit_tracker.filter_choices import refresh_all_choices
+from octofit_tracker.leaderboard import rebuild_leaderboard
+from octofit_tracker.repository import Repository, leaderboard
+from octofit_tracker.rollups import rebuild_rollups
+from octofit_tracker.models import (
+    User, Team, Activity, Leaderboard, TeamStanding, DailyRollup, WindowBoardEntry, MonthlySummary, ActivityArchive,
+    Workout
+)
+from bson import ObjectId
+from datetime import timedelta
 import random
+import struct
+import time
+
+
+# Marvel superheroes
+MARVEL_HEROES = [
+    {'name': 'Iron Man', 'email': 'tony.stark@marvel.com'},
+    {'name': 'Captain America', 'email': 'steve.rogers@marvel.com'},
+    {'name': 'Thor', 'email': 'thor.odinson@marvel.com'},
+    {'name': 'Black Widow', 'email': 'natasha.romanoff@marvel.com'},
+    {'name': 'Hulk', 'email': 'bruce.banner@marvel.com'},
+    {'name': 'Spider-Man', 'email': 'peter.parker@marvel.com'},
+    {'name': 'Black Panther', 'email': 'tchalla@marvel.com'},
+    {'name': 'Doctor Strange', 'email': 'stephen.strange@marvel.com'},
+]
+
+# DC superheroes
+DC_HEROES = [
+    {'name': 'Superman', 'email': 'clark.kent@dc.com'},
+    {'name': 'Batman', 'email': 'bruce.wayne@dc.com'},
+    {'name': 'Wonder Woman', 'email': 'diana.prince@dc.com'},
+    {'name': 'The Flash', 'email': 'barry.allen@dc.com'},
+    {'name': 'Aquaman', 'email': 'arthur.curry@dc.com'},
+    {'name': 'Green Lantern', 'email': 'hal.jordan@dc.com'},
+    {'name': 'Cyborg', 'email': 'victor.stone@dc.com'},
+    {'name': 'Shazam', 'email': 'billy.batson@dc.com'},
+]
+
+# Per activity type: duration range (min), speed range (km/h, None when
+# there is no distance) and calories burned per minute
+ACTIVITY_PROFILES = {
+    'Running': ((20, 90), (8.0, 13.0), (9, 13)),
+    'Cycling': ((30, 150), (15.0, 30.0), (6, 10)),
+    'Swimming': ((20, 60), (2.0, 4.0), (8, 11)),
+    'Weight Training': ((30, 90), None, (5, 8)),
+    'Yoga': ((20, 75), None, (3, 5)),
+    'Boxing': ((20, 60), None, (9, 12)),
+}
+ACTIVITY_TYPES = list(ACTIVITY_PROFILES)
+
+# Superhero-themed workouts
+WORKOUTS = [
+    {
+        'name': 'Super Soldier Strength Training',
+        'description': 'Build strength like Captain America with this intense workout',
+        'difficulty_level': 'Advanced',
+        'duration': 60,
+        'exercise_type': 'Strength'
+    },
+    {
+        'name': 'Stark Industries Cardio Blast',
+        'description': 'High-intensity cardio session inspired by Iron Man',
+        'difficulty_level': 'Intermediate',
+        'duration': 45,
+        'exercise_type': 'Cardio'
+    },
+    {
+        'name': 'Asgardian Warrior Training',
+        'description': 'Train like Thor with this comprehensive full-body workout',
+        'difficulty_level': 'Advanced',
+        'duration': 90,
+        'exercise_type': 'Full Body'
+    },
+    {
+        'name': 'Web-Slinger Agility Drills',
+        'description': 'Improve agility and flexibility like Spider-Man',
+        'difficulty_level': 'Beginner',
+        'duration': 30,
+        'exercise_type': 'Agility'
+    },
+    {
+        'name': 'Bat Cave Core Crusher',
+        'description': 'Batman-inspired core strengthening routine',
+        'difficulty_level': 'Intermediate',
+        'duration': 40,
+        'exercise_type': 'Core'
+    },
+    {
+        'name': 'Kryptonian Power Session',
+        'description': 'Build superhuman power with this Superman-themed workout',
+        'difficulty_level': 'Advanced',
+        'duration': 75,
+        'exercise_type': 'Power'
+    },
+    {
+        'name': 'Amazonian Combat Training',
+        'description': 'Warrior training inspired by Wonder Woman',
+        'difficulty_level': 'Intermediate',
+        'duration': 50,
+        'exercise_type': 'Combat'
+    },
+    {
+        'name': 'Speed Force Sprint Session',
+        'description': 'Flash-inspired high-speed interval training',
+        'difficulty_level': 'Advanced',
+        'duration': 35,
+        'exercise_type': 'Sprints'
+    },
+    {
+        'name': 'Wakandan Mobility Flow',
+        'description': 'Black Panther-inspired mobility and flexibility training',
+        'difficulty_level': 'Beginner',
+        'duration': 25,
+        'exercise_type': 'Mobility'
+    },
+    {
+        'name': 'Mystic Arts Meditation',
+        'description': 'Doctor Strange-inspired mindfulness and meditation session',
+        'difficulty_level': 'Beginner',
+        'duration': 20,
+        'exercise_type': 'Meditation'
+    }
+]
+
+
+def object_id(rng, when):
+    """ObjectId carrying `when` as its timestamp and random bytes from `rng`"""
+    return ObjectId(struct.pack('>I', int(when.timestamp())) + rng.randbytes(8))
 
 
 class Command(BaseCommand):
     help = 'Populate the octofit_db database with test data'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=len(MARVEL_HEROES) + len(DC_HEROES),
+                            help='Number of users; the first 16 are the superheroes')
+        parser.add_argument('--activities-per-user', type=int, default=10,
+                            help='Average number of activities per user; 0 creates users only')
+        parser.add_argument('--days', type=int, default=30,
+                            help='Spread activity dates over this many past days')
+        parser.add_argument('--seed', type=int, default=None,
+                            help='Random seed; the same seed on the same day reproduces the same data')
+        parser.add_argument('--batch-size', type=int, default=10000,
+                            help='Documents per bulk insert')
+
     def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        batch_size = options['batch_size']
+        # Anchor generated dates to midnight so a seed reproduces the same rows
+        now = timezone.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        started = time.monotonic()
+
         self.stdout.write('Deleting existing data...')
         
-        # Delete existing data using Django ORM
-        User.objects.all().delete()
-        Team.objects.all().delete()
-        Activity.objects.all().delete()
-        Leaderboard.objects.all().delete()
-        Workout.objects.all().delete()
+        # Delete existing data directly in MongoDB; an ORM delete would load
+        # every activity and fire a leaderboard update for each one
+        for model in (
+            User, Team, Activity, Leaderboard, TeamStanding, DailyRollup, WindowBoardEntry, MonthlySummary,
+            ActivityArchive, Workout
+        ):
+            Repository(model).delete_many()
+            bump_version(model._meta.db_table)
         
         self.stdout.write('Creating teams...')
         
@@ -24,203 +172,108 @@ class Command(BaseCommand):
         team_marvel = Team.objects.create(
             name='Team Marvel',
             description='Mightiest Heroes of Earth',
-            created_at=datetime.now()
+            created_at=now
         )
         
         team_dc = Team.objects.create(
             name='Team DC',
             description='Justice League Defenders',
-            created_at=datetime.now()
+            created_at=now
         )
+        team_ids = [str(team_marvel._id), str(team_dc._id)]
         
-        self.stdout.write('Creating users...')
-        
-        # Create Marvel superheroes
-        marvel_heroes = [
-            {'name': 'Iron Man', 'email': 'tony.stark@marvel.com'},
-            {'name': 'Captain America', 'email': 'steve.rogers@marvel.com'},
-            {'name': 'Thor', 'email': 'thor.odinson@marvel.com'},
-            {'name': 'Black Widow', 'email': 'natasha.romanoff@marvel.com'},
-            {'name': 'Hulk', 'email': 'bruce.banner@marvel.com'},
-            {'name': 'Spider-Man', 'email': 'peter.parker@marvel.com'},
-            {'name': 'Black Panther', 'email': 'tchalla@marvel.com'},
-            {'name': 'Doctor Strange', 'email': 'stephen.strange@marvel.com'},
-        ]
-        
-        # Create DC superheroes
-        dc_heroes = [
-            {'name': 'Superman', 'email': 'clark.kent@dc.com'},
-            {'name': 'Batman', 'email': 'bruce.wayne@dc.com'},
-            {'name': 'Wonder Woman', 'email': 'diana.prince@dc.com'},
-            {'name': 'The Flash', 'email': 'barry.allen@dc.com'},
-            {'name': 'Aquaman', 'email': 'arthur.curry@dc.com'},
-            {'name': 'Green Lantern', 'email': 'hal.jordan@dc.com'},
-            {'name': 'Cyborg', 'email': 'victor.stone@dc.com'},
-            {'name': 'Shazam', 'email': 'billy.batson@dc.com'},
-        ]
-        
-        marvel_users = []
-        for hero in marvel_heroes:
-            user = User.objects.create(
-                name=hero['name'],
-                email=hero['email'],
-                team_id=str(team_marvel._id),
-                created_at=datetime.now()
-            )
-            marvel_users.append(user)
+        self.stdout.write('Creating users and activities...')
         
-        dc_users = []
-        for hero in dc_heroes:
-            user = User.objects.create(
-                name=hero['name'],
-                email=hero['email'],
-                team_id=str(team_dc._id),
-                created_at=datetime.now()
-            )
-            dc_users.append(user)
+        user_count = 0
+        activity_count = 0
+        users = []
+        activities = []
+        for user in self.generate_users(rng, options['users'], team_ids, now):
+            users.append(user)
+            activities.extend(self.generate_activities(
+                rng, str(user['_id']), options['activities_per_user'], options['days'], now
+            ))
+            if len(users) >= batch_size:
+                user_count += self.insert(User, users)
+            if len(activities) >= batch_size:
+                activity_count += self.insert(Activity, activities)
+        user_count += self.insert(User, users)
+        activity_count += self.insert(Activity, activities)
         
-        all_users = marvel_users + dc_users
+        self.stdout.write('Creating leaderboard, team standings and daily rollups...')
         
-        self.stdout.write('Creating activities...')
-        
-        # Activity types
-        activity_types = ['Running', 'Cycling', 'Swimming', 'Weight Training', 'Yoga', 'Boxing']
-        
-        # Create activities for all users
-        for user in all_users:
-            num_activities = random.randint(5, 15)
-            for i in range(num_activities):
-                activity_type = random.choice(activity_types)
-                duration = random.randint(20, 120)
-                distance = random.uniform(2.0, 15.0) if activity_type in ['Running', 'Cycling', 'Swimming'] else None
-                calories = duration * random.randint(5, 12)
-                
-                Activity.objects.create(
-                    user_id=str(user._id),
-                    activity_type=activity_type,
-                    duration=duration,
-                    distance=distance,
-                    calories=calories,
-                    date=datetime.now() - timedelta(days=random.randint(0, 30)),
-                    created_at=datetime.now()
-                )
-        
-        self.stdout.write('Creating leaderboard...')
-        
-        # Calculate leaderboard data
-        leaderboard_data = []
-        for user in all_users:
-            user_activities = Activity.objects.filter(user_id=str(user._id))
-            total_calories = sum(activity.calories for activity in user_activities)
-            total_activities = user_activities.count()
-            
-            leaderboard_data.append({
-                'user': user,
-                'total_calories': total_calories,
-                'total_activities': total_activities
-            })
-        
-        # Sort by total calories
-        leaderboard_data.sort(key=lambda x: x['total_calories'], reverse=True)
-        
-        # Create leaderboard entries with ranks
-        for rank, data in enumerate(leaderboard_data, start=1):
-            Leaderboard.objects.create(
-                user_id=str(data['user']._id),
-                total_calories=data['total_calories'],
-                total_activities=data['total_activities'],
-                rank=rank,
-                updated_at=datetime.now()
-            )
+        # Bulk inserts bypass the User and Activity signals, so rank everyone in one aggregation
+        rebuild_leaderboard()
+        rebuild_rollups()
         
         self.stdout.write('Creating workouts...')
         
-        # Create superhero-themed workouts
-        workouts = [
-            {
-                'name': 'Super Soldier Strength Training',
-                'description': 'Build strength like Captain America with this intense workout',
-                'difficulty_level': 'Advanced',
-                'duration': 60,
-                'exercise_type': 'Strength'
-            },
-            {
-                'name': 'Stark Industries Cardio Blast',
-                'description': 'High-intensity cardio session inspired by Iron Man',
-                'difficulty_level': 'Intermediate',
-                'duration': 45,
-                'exercise_type': 'Cardio'
-            },
-            {
-                'name': 'Asgardian Warrior Training',
-                'description': 'Train like Thor with this comprehensive full-body workout',
-                'difficulty_level': 'Advanced',
-                'duration': 90,
-                'exercise_type': 'Full Body'
-            },
-            {
-                'name': 'Web-Slinger Agility Drills',
-                'description': 'Improve agility and flexibility like Spider-Man',
-                'difficulty_level': 'Beginner',
-                'duration': 30,
-                'exercise_type': 'Agility'
-            },
-            {
-                'name': 'Bat Cave Core Crusher',
-                'description': 'Batman-inspired core strengthening routine',
-                'difficulty_level': 'Intermediate',
-                'duration': 40,
-                'exercise_type': 'Core'
-            },
-            {
-                'name': 'Kryptonian Power Session',
-                'description': 'Build superhuman power with this Superman-themed workout',
-                'difficulty_level': 'Advanced',
-                'duration': 75,
-                'exercise_type': 'Power'
-            },
-            {
-                'name': 'Amazonian Combat Training',
-                'description': 'Warrior training inspired by Wonder Woman',
-                'difficulty_level': 'Intermediate',
-                'duration': 50,
-                'exercise_type': 'Combat'
-            },
-            {
-                'name': 'Speed Force Sprint Session',
-                'description': 'Flash-inspired high-speed interval training',
-                'difficulty_level': 'Advanced',
-                'duration': 35,
-                'exercise_type': 'Sprints'
-            },
-            {
-                'name': 'Wakandan Mobility Flow',
-                'description': 'Black Panther-inspired mobility and flexibility training',
-                'difficulty_level': 'Beginner',
-                'duration': 25,
-                'exercise_type': 'Mobility'
-            },
-            {
-                'name': 'Mystic Arts Meditation',
-                'description': 'Doctor Strange-inspired mindfulness and meditation session',
-                'difficulty_level': 'Beginner',
-                'duration': 20,
-                'exercise_type': 'Meditation'
-            }
-        ]
+        for workout_data in WORKOUTS:
+            Workout.objects.create(**workout_data, created_at=now)
         
-        for workout_data in workouts:
-            Workout.objects.create(**workout_data, created_at=datetime.now())
+        # Precompute the admin's list filter choices; bulk inserts skip the write hooks
+        refresh_all_choices()
         
-        # Create unique index on email field using PyMongo
-        self.stdout.write('Creating unique index on email field...')
-        client = MongoClient('localhost', 27017)
-        db = client['octofit_db']
-        db.users.create_index([('email', 1)], unique=True)
+        # Create the indexes declared on the models
+        self.stdout.write('Syncing indexes...')
+        call_command('sync_indexes', stdout=self.stdout)
         
         self.stdout.write(self.style.SUCCESS('Successfully populated database with superhero test data!'))
-        self.stdout.write(f'Created {len(all_users)} users')
-        self.stdout.write(f'Created {Activity.objects.count()} activities')
-        self.stdout.write(f'Created {Leaderboard.objects.count()} leaderboard entries')
-        self.stdout.write(f'Created {Workout.objects.count()} workouts')
+        self.stdout.write(f'Created {user_count} users')
+        self.stdout.write(f'Created {activity_count} activities')
+        self.stdout.write(f'Created {leaderboard.estimated_count()} leaderboard entries')
+        self.stdout.write(f'Created {len(WORKOUTS)} workouts')
         self.stdout.write(f'Created 2 teams: Team Marvel and Team DC')
+        self.stdout.write(f'Finished in {time.monotonic() - started:.1f}s')
+
+    def insert(self, model, documents):
+        """Write a batch with one unordered bulk insert and empty it"""
+        if not documents:
+            return 0
+        Repository(model).insert_many(documents, ordered=False)
+        count = len(documents)
+        documents.clear()
+        return count
+
+    def generate_users(self, rng, count, team_ids, now):
+        """Yield user documents: the superheroes first, then numbered recruits"""
+        heroes = [(hero, team_ids[0]) for hero in MARVEL_HEROES] + [(hero, team_ids[1]) for hero in DC_HEROES]
+        for index in range(count):
+            if index < len(heroes):
+                hero, team_id = heroes[index]
+                name, email = hero['name'], hero['email']
+            else:
+                name, email = f'Recruit {index + 1}', f'recruit{index + 1}@octofit.dev'
+                team_id = team_ids[index % len(team_ids)]
+            joined = now - timedelta(days=rng.randint(0, 365))
+            yield {
+                '_id': object_id(rng, joined),
+                'name': name,
+                'email': email,
+                'team_id': team_id,
+                'created_at': joined,
+            }
+
+    def generate_activities(self, rng, user_id, average, days, now):
+        """Yield one user's activity documents (none when `average` is below 1)"""
+        if average < 1:
+            return
+        # Each user has a fitness level and two favourite activity types
+        fitness = rng.uniform(0.7, 1.3)
+        favourites = rng.sample(ACTIVITY_TYPES, 2)
+        for _ in range(rng.randint(max(average // 2, 1), average + average // 2)):
+            activity_type = rng.choice(favourites) if rng.random() < 0.7 else rng.choice(ACTIVITY_TYPES)
+            durations, speeds, burn = ACTIVITY_PROFILES[activity_type]
+            duration = int(rng.randint(*durations) * fitness)
+            distance = round(rng.uniform(*speeds) * fitness * duration / 60, 2) if speeds else None
+            date = now - timedelta(seconds=rng.randint(0, days * 86400))
+            yield {
+                '_id': object_id(rng, date),
+                'user_id': user_id,
+                'activity_type': activity_type,
+                'duration': duration,
+                'distance': distance,
+                'calories': duration * rng.randint(*burn),
+                'date': date,
+                'created_at': date,
+            }
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from octofit_tracker.leaderboard import rebuild_leaderboard
+from octofit_tracker.rollups import rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = ('Recompute the leaderboard, team standings and daily rollups from the activities, '
+            'e.g. after a write-behind batch was inserted but not fully applied')
+
+    def handle(self, *args, **options):
+        self.stdout.write('Rebuilding the leaderboard and team standings...')
+        rebuild_leaderboard()
+        self.stdout.write('Rebuilding the daily rollups...')
+        rebuild_rollups()
+        self.stdout.write(self.style.SUCCESS('Leaderboard, team standings and rollups rebuilt'))
@@ -0,0 +1,88 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand
+from pymongo import TEXT, IndexModel
+
+
+def index_key(declared):
+    """
+    Key of a declared index as index_information reports it.
+
+    MongoDB stores the text fields of a text index as one `_fts`/`_ftsx`
+    pair in the key, and the fields themselves in `weights`.
+    """
+    key, text_added = [], False
+    for field, kind in declared['key'].items():
+        if kind != TEXT:
+            key.append((field, kind))
+        elif not text_added:
+            key.extend([('_fts', TEXT), ('_ftsx', 1)])
+            text_added = True
+    return key
+
+
+def same_index(declared, existing):
+    """Whether an existing index (from index_information) matches a declared IndexModel document"""
+    if index_key(declared) != [tuple(key) for key in existing['key']]:
+        return False
+    text_fields = [field for field, kind in declared['key'].items() if kind == TEXT]
+    if text_fields:
+        weights = {field: declared.get('weights', {}).get(field, 1) for field in text_fields}
+        if weights != existing.get('weights'):
+            return False
+    if declared.get('unique', False) != existing.get('unique', False):
+        return False
+    declared_collation = declared.get('collation') or {}
+    existing_collation = existing.get('collation') or {}
+    return all(existing_collation.get(option) == value for option, value in declared_collation.items())
+
+
+class Command(BaseCommand):
+    help = 'Create the MongoDB indexes declared on the models and report missing, extra or unused ones'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only report what would change')
+        parser.add_argument('--prune', action='store_true',
+                            help='Also drop indexes that are not declared on the model')
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        for model in apps.get_app_config('octofit_tracker').get_models():
+            declared = {index.document['name']: index.document for index in getattr(model, 'mongo_indexes', [])}
+            collection = model._meta.db_table
+            existing = model.objects.mongo_index_information()
+
+            to_create = []
+            for name, document in declared.items():
+                if name in existing and same_index(document, existing[name]):
+                    continue
+                if name in existing:
+                    self.stdout.write(f'{collection}: {name} changed, rebuilding')
+                    if not dry_run:
+                        model.objects.mongo_drop_index(name)
+                else:
+                    self.stdout.write(f'{collection}: {name} missing')
+                index_options = {option: value for option, value in document.items() if option != 'key'}
+                to_create.append(IndexModel(list(document['key'].items()), background=True, **index_options))
+            if to_create and not dry_run:
+                model.objects.mongo_create_indexes(to_create)
+                self.stdout.write(self.style.SUCCESS(f'{collection}: created {len(to_create)} index(es)'))
+
+            for name in existing:
+                if name == '_id_' or name in declared:
+                    continue
+                if options['prune']:
+                    self.stdout.write(f'{collection}: dropping undeclared index {name}')
+                    if not dry_run:
+                        model.objects.mongo_drop_index(name)
+                else:
+                    self.stdout.write(self.style.WARNING(f'{collection}: undeclared index {name} (use --prune to drop)'))
+
+            self.report_unused(model, collection)
+
+    def report_unused(self, model, collection):
+        """Warn about indexes with no recorded use since the server started"""
+        for stats in model.objects.mongo_aggregate([{'$indexStats': {}}]):
+            if stats['name'] != '_id_' and stats['accesses']['ops'] == 0:
+                since = stats['accesses']['since']
+                self.stdout.write(self.style.WARNING(f'{collection}: index {stats["name"]} unused since {since:%Y-%m-%d %H:%M}'))
@@ -1,4 +1,13 @@
 from djongo import models
+from pymongo import ASCENDING, DESCENDING, TEXT, IndexModel
+from pymongo.collation import Collation
+
+
+# Case-insensitive comparison, matching Django's __iexact lookups
+CASE_INSENSITIVE = Collation(locale='en', strength=2)
+
+# MongoDB indexes are declared on each model as `mongo_indexes` and applied
+# with `python manage.py sync_indexes`
 
 
 class User(models.Model):
@@ -8,6 +17,16 @@ class User(models.Model):
     team_id = models.CharField(max_length=50, null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    objects = models.DjongoManager()
+
+    mongo_indexes = [
+        IndexModel([('email', ASCENDING)], unique=True),
+        # by_team, paged by _id
+        IndexModel([('team_id', ASCENDING), ('_id', ASCENDING)]),
+        # Admin prefix search
+        IndexModel([('name', ASCENDING)]),
+    ]
+
     class Meta:
         db_table = 'users'
 
@@ -21,6 +40,8 @@ class Team(models.Model):
     description = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
 
+    objects = models.DjongoManager()
+
     class Meta:
         db_table = 'teams'
 
@@ -38,6 +59,15 @@ class Activity(models.Model):
     date = models.DateTimeField()
     created_at = models.DateTimeField(auto_now_add=True)
 
+    objects = models.DjongoManager()
+
+    mongo_indexes = [
+        # by_user, newest first and paged by (date, _id)
+        IndexModel([('user_id', ASCENDING), ('date', DESCENDING), ('_id', DESCENDING)]),
+        # list and recent
+        IndexModel([('date', DESCENDING), ('_id', DESCENDING)]),
+    ]
+
     class Meta:
         db_table = 'activities'
 
@@ -53,6 +83,16 @@ class Leaderboard(models.Model):
     rank = models.IntegerField()
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = models.DjongoManager()
+
+    mongo_indexes = [
+        IndexModel([('user_id', ASCENDING)], unique=True),
+        # top and list, paged by (rank, _id)
+        IndexModel([('rank', ASCENDING), ('_id', ASCENDING)]),
+        # Rank order used by incremental re-ranking
+        IndexModel([('total_calories', DESCENDING), ('user_id', ASCENDING)]),
+    ]
+
     class Meta:
         db_table = 'leaderboard'
         ordering = ['rank']
@@ -61,6 +101,145 @@ class Leaderboard(models.Model):
         return f"Rank {self.rank}"
 
 
+class TeamStanding(models.Model):
+    """Materialized per-team totals, kept current by leaderboard.py"""
+    _id = models.ObjectIdField(db_column='_id', primary_key=True)
+    team_id = models.CharField(max_length=50)
+    team_name = models.CharField(max_length=100)
+    members = models.IntegerField()
+    total_calories = models.IntegerField()
+    total_activities = models.IntegerField()
+    avg_calories_per_member = models.FloatField()
+    rank = models.IntegerField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = models.DjongoManager()
+
+    mongo_indexes = [
+        IndexModel([('team_id', ASCENDING)], unique=True),
+        # list, paged by (rank, _id)
+        IndexModel([('rank', ASCENDING), ('_id', ASCENDING)]),
+        # Rank order used by incremental re-ranking
+        IndexModel([('total_calories', DESCENDING), ('team_id', ASCENDING)]),
+    ]
+
+    class Meta:
+        db_table = 'team_standings'
+        ordering = ['rank']
+
+    def __str__(self):
+        return f"Rank {self.rank}"
+
+
+class DailyRollup(models.Model):
+    """Per-user activity totals for one UTC day, kept current by rollups.py"""
+    _id = models.ObjectIdField(db_column='_id', primary_key=True)
+    user_id = models.CharField(max_length=50)
+    day = models.DateTimeField()  # midnight UTC
+    calories = models.IntegerField()
+    duration = models.IntegerField()  # in minutes
+    distance = models.FloatField()  # in km
+    count = models.IntegerField()
+
+    objects = models.DjongoManager()
+
+    mongo_indexes = [
+        IndexModel([('user_id', ASCENDING), ('day', ASCENDING)], unique=True),
+        # Windowed leaderboards, which match a range of days
+        IndexModel([('day', ASCENDING), ('user_id', ASCENDING)]),
+    ]
+
+    class Meta:
+        db_table = 'daily_rollups'
+
+    def __str__(self):
+        return f"{self.user_id} - {self.day:%Y-%m-%d}"
+
+
+class WindowBoardEntry(models.Model):
+    """An entry of a materialized day, week or month leaderboard, kept by rollups.py"""
+    _id = models.ObjectIdField(db_column='_id', primary_key=True)
+    start = models.DateTimeField()  # the window's first day, midnight UTC
+    end = models.DateTimeField()  # the day after its last one
+    built_at = models.DateTimeField()  # the build this entry belongs to
+    user_id = models.CharField(max_length=50)
+    total_calories = models.IntegerField()
+    total_activities = models.IntegerField()
+    total_duration = models.IntegerField()  # in minutes
+    total_distance = models.FloatField()  # in km
+    rank = models.IntegerField()
+
+    objects = models.DjongoManager()
+
+    mongo_indexes = [
+        # One build of a board, paged by rank
+        IndexModel([('start', ASCENDING), ('end', ASCENDING), ('built_at', ASCENDING), ('rank', ASCENDING)]),
+    ]
+
+    class Meta:
+        db_table = 'leaderboard_windows'
+
+    def __str__(self):
+        return f"{self.start:%Y-%m-%d} - {self.end:%Y-%m-%d}: rank {self.rank}"
+
+
+class MonthlySummary(models.Model):
+    """Per-user totals of the archived activities of one UTC month, kept by archive.py"""
+    _id = models.ObjectIdField(db_column='_id', primary_key=True)
+    user_id = models.CharField(max_length=50)
+    month = models.DateTimeField()  # midnight UTC on the 1st
+    calories = models.IntegerField()
+    duration = models.IntegerField()  # in minutes
+    distance = models.FloatField()  # in km
+    distance_count = models.IntegerField(default=0)  # activities that have a distance
+    count = models.IntegerField()
+
+    objects = models.DjongoManager()
+
+    mongo_indexes = [
+        IndexModel([('user_id', ASCENDING), ('month', ASCENDING)], unique=True),
+    ]
+
+    class Meta:
+        db_table = 'activity_summaries'
+
+    def __str__(self):
+        return f"{self.user_id} - {self.month:%Y-%m}"
+
+
+class ActivityArchive(models.Model):
+    """A zlib-compressed chunk of one user's archived activities from one UTC month"""
+    _id = models.ObjectIdField(db_column='_id', primary_key=True)
+    user_id = models.CharField(max_length=50)
+    month = models.DateTimeField()  # midnight UTC on the 1st
+    sequence = models.IntegerField(default=0)  # of the chunk within its user and month, newest first
+    first_date = models.DateTimeField()
+    last_date = models.DateTimeField()
+    count = models.IntegerField()
+    calories = models.IntegerField()
+    duration = models.IntegerField()  # in minutes
+    distance = models.FloatField()  # in km
+    distance_count = models.IntegerField(default=0)  # activities that have a distance
+    data = models.BinaryField()
+
+    objects = models.DjongoManager()
+
+    mongo_indexes = [
+        # One chunk per user, month and sequence, so re-archiving a month replaces its chunks
+        IndexModel([('user_id', ASCENDING), ('month', ASCENDING), ('sequence', ASCENDING)], unique=True),
+        # by_user, newest chunk first
+        IndexModel([('user_id', ASCENDING), ('last_date', DESCENDING)]),
+        # by_user paged backwards, oldest chunk first
+        IndexModel([('user_id', ASCENDING), ('first_date', ASCENDING)]),
+    ]
+
+    class Meta:
+        db_table = 'activities_archive'
+
+    def __str__(self):
+        return f"{self.user_id} - {self.month:%Y-%m} ({self.count})"
+
+
 class Workout(models.Model):
     _id = models.ObjectIdField(db_column='_id', primary_key=True)
     name = models.CharField(max_length=100)
@@ -70,6 +249,23 @@ class Workout(models.Model):
     exercise_type = models.CharField(max_length=50)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    objects = models.DjongoManager()
+
+    mongo_indexes = [
+        # by_difficulty and by_type match case-insensitively
+        IndexModel([('difficulty_level', ASCENDING)], collation=CASE_INSENSITIVE),
+        IndexModel([('exercise_type', ASCENDING)], collation=CASE_INSENSITIVE),
+        # search: names weigh most, then the type, then the description
+        IndexModel(
+            [('name', TEXT), ('exercise_type', TEXT), ('description', TEXT)],
+            weights={'name': 10, 'exercise_type': 5, 'description': 1},
+            name='workout_text',
+        ),
+        IndexModel([('duration', ASCENDING)]),
+        # search by name prefix, case-insensitively
+        IndexModel([('name', ASCENDING)], collation=CASE_INSENSITIVE),
+    ]
+
     class Meta:
         db_table = 'workouts'
 
@@ -0,0 +1,216 @@
+"""
+Keyset (cursor) pagination for the API viewsets.
+
+Instead of skipping over earlier rows, each page is fetched with a range
+filter on the view's ordering fields, starting after the last row of the
+previous page. Page cost therefore stays constant however deep a client
+scrolls. The ordering must end with a unique field (``_id``) so that every
+row has a distinct position. Cursors are opaque base64 tokens holding the
+boundary row's sort values and the paging direction.
+"""
+import base64
+import binascii
+import json
+from collections import OrderedDict
+from datetime import datetime
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, _positive_int
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+def encode_value(value):
+    """Make a sort value JSON serializable for a cursor"""
+    if isinstance(value, ObjectId):
+        return {'$oid': str(value)}
+    if isinstance(value, datetime):
+        return {'$date': value.isoformat()}
+    return value
+
+
+def decode_value(value):
+    """Reverse encode_value"""
+    if isinstance(value, dict):
+        if '$oid' in value:
+            return ObjectId(value['$oid'])
+        if '$date' in value:
+            parsed = parse_datetime(value['$date'])
+            if parsed is None:
+                raise ValueError('Invalid date in cursor')
+            return parsed
+        raise ValueError('Unknown cursor value')
+    return value
+
+
+def get_value(item, field):
+    """Read a field from a model instance or a document dict"""
+    if isinstance(item, dict):
+        return item[field]
+    return getattr(item, field)
+
+
+def reverse_ordering(ordering):
+    """Flip the direction of every field in an ordering"""
+    return tuple(field[1:] if field.startswith('-') else f'-{field}' for field in ordering)
+
+
+def keyset_q(ordering, position):
+    """
+    Build a Q matching rows that come after `position` in `ordering`.
+
+    For ('-date', '-_id') this is: date < d OR (date = d AND _id < id).
+    """
+    condition = Q()
+    for index, field in enumerate(ordering):
+        name = field.lstrip('-')
+        lookup = 'lt' if field.startswith('-') else 'gt'
+        equal = [(previous.lstrip('-'), value) for previous, value in zip(ordering[:index], position)]
+        condition |= Q(*equal, (f'{name}__{lookup}', position[index]))
+    return condition
+
+
+def keyset_query(ordering, position):
+    """MongoDB filter equivalent of keyset_q, for raw pymongo queries"""
+    clauses = []
+    for index, field in enumerate(ordering):
+        clause = {previous.lstrip('-'): value for previous, value in zip(ordering[:index], position)}
+        clause[field.lstrip('-')] = {'$lt' if field.startswith('-') else '$gt': position[index]}
+        clauses.append(clause)
+    return {'$or': clauses}
+
+
+def mongo_sort(ordering):
+    """pymongo sort specification for an ordering tuple"""
+    return [(field.lstrip('-'), -1 if field.startswith('-') else 1) for field in ordering]
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination keyed on the view's `ordering` tuple.
+
+    Responses have the same shape as DRF's CursorPagination:
+    ``{"next": url, "previous": url, "results": [...]}``.
+    """
+    page_size = api_settings.PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+    cursor_query_param = 'cursor'
+    ordering = ('_id',)
+    invalid_cursor_message = 'Invalid cursor'
+
+    def get_ordering(self, view):
+        return tuple(getattr(view, 'ordering', None) or self.ordering)
+
+    def get_page_size(self, request):
+        if self.page_size_query_param:
+            try:
+                return _positive_int(
+                    request.query_params[self.page_size_query_param],
+                    strict=True,
+                    cutoff=self.max_page_size
+                )
+            except (KeyError, ValueError):
+                pass
+        return self.page_size
+
+    def encode_cursor(self, item, reverse):
+        values = [encode_value(get_value(item, field.lstrip('-'))) for field in self.ordering]
+        payload = json.dumps({'p': values, 'r': int(reverse)}, separators=(',', ':'))
+        cursor = base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii')
+        return replace_query_param(self.base_url, self.cursor_query_param, cursor)
+
+    def decode_cursor(self, request):
+        """Return (position, reverse) for the requested cursor, or (None, False)"""
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None, False
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')).decode('utf-8'))
+            position = [decode_value(value) for value in payload['p']]
+            reverse = bool(payload.get('r'))
+        except (TypeError, ValueError, KeyError, UnicodeError, binascii.Error, InvalidId):
+            raise NotFound(self.invalid_cursor_message)
+        if len(position) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        return position, reverse
+
+    def start_page(self, request, ordering):
+        """
+        Read the page size and cursor from the request.
+
+        Returns (ordering, position) to query with: the ordering is flipped
+        when paging backwards and position is None on the first page. The
+        caller fetches up to page_size + 1 rows after position and passes
+        them to finish_page. Returns None when pagination is disabled.
+        """
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.ordering = tuple(ordering)
+        self.position, self.reverse = self.decode_cursor(request)
+        return (reverse_ordering(self.ordering) if self.reverse else self.ordering), self.position
+
+    def paginate_queryset(self, queryset, request, view=None):
+        page = self.start_page(request, self.get_ordering(view))
+        if page is None:
+            return None
+
+        ordering, position = page
+        queryset = queryset.order_by(*ordering)
+        if position is not None:
+            queryset = queryset.filter(keyset_q(ordering, position))
+
+        # Fetch one extra row to learn whether another page follows
+        return self.finish_page(list(queryset[:self.page_size + 1]))
+
+    def finish_page(self, results):
+        """Trim the rows fetched for start_page's query into the page"""
+        position, reverse = self.position, self.reverse
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+        if reverse:
+            results.reverse()
+            self.has_next = position is not None
+            self.has_previous = has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = position is not None
+        self.page = results
+        return results
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True},
+                'previous': {'type': 'string', 'nullable': True},
+                'results': schema,
+            },
+        }
@@ -0,0 +1,217 @@
+"""
+Per-request performance breakdown.
+
+For a sampled share of requests (OCTOFIT_PROFILE_SAMPLE_RATE) the
+middleware records:
+
+- db: MongoDB commands issued and their server round-trip time, from a
+  pymongo command listener;
+- sql: time djongo spends translating SQL into MongoDB commands, i.e.
+  time inside cursor.execute() that is not spent waiting on MongoDB;
+- serialize: time spent in the serializers' to_representation;
+- render: time spent rendering the response body.
+
+The breakdown is sent as a Server-Timing header. Sampled requests slower
+than OCTOFIT_SLOW_REQUEST_MS are also logged as one JSON object with the
+shapes (command, collection and filter keys, with values elided) of the
+queries they ran. Requests that are not sampled only pay for one random()
+call and a context variable lookup per MongoDB command.
+"""
+import json
+import logging
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connections
+from django.utils.deprecation import MiddlewareMixin
+from pymongo import monitoring
+
+logger = logging.getLogger(__name__)
+
+# Shapes kept per request for the slow-request log
+MAX_SHAPES = 50
+
+_current = ContextVar('octofit_profile', default=None)
+
+
+class RequestProfile:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.mongo_ops = 0
+        self.mongo_time = 0.0
+        self.sql_time = 0.0
+        self.serialize_time = 0.0
+        self.render_time = 0.0
+        self.render_started = None
+        self.pending = {}
+        self.shapes = {}
+
+    def add_command(self, request_id, seconds):
+        self.mongo_ops += 1
+        self.mongo_time += seconds
+        shape = self.pending.pop(request_id, None)
+        if shape is not None and (shape in self.shapes or len(self.shapes) < MAX_SHAPES):
+            count, total = self.shapes.get(shape, (0, 0.0))
+            self.shapes[shape] = (count + 1, total + seconds)
+
+    def server_timing(self, total):
+        return ', '.join([
+            f'db;desc="{self.mongo_ops} mongo ops";dur={self.mongo_time * 1000:.2f}',
+            f'sql;desc="djongo translation";dur={self.sql_time * 1000:.2f}',
+            f'serialize;dur={self.serialize_time * 1000:.2f}',
+            f'render;dur={self.render_time * 1000:.2f}',
+            f'total;dur={total * 1000:.2f}',
+        ])
+
+
+def _elide(value):
+    """Replace the values in a filter with '?', keeping field names and operators"""
+    if isinstance(value, dict):
+        return {key: _elide(item) for key, item in value.items()}
+    if isinstance(value, list) and value and isinstance(value[0], dict):
+        return [_elide(item) for item in value]
+    return '?'
+
+
+def query_shape(command_name, command):
+    """Stable, value-free description of a MongoDB command"""
+    collection = command.get(command_name)
+    if command_name == 'find':
+        detail = {'filter': _elide(command.get('filter', {})), 'sort': list(command.get('sort', {}))}
+    elif command_name == 'aggregate':
+        detail = [next(iter(stage)) for stage in command.get('pipeline', [])]
+    elif command_name in ('update', 'delete'):
+        statements = command.get('updates' if command_name == 'update' else 'deletes') or [{}]
+        detail = {'filter': _elide(statements[0].get('q', {})), 'statements': len(statements)}
+    elif command_name in ('count', 'distinct'):
+        detail = {'filter': _elide(command.get('query', {}))}
+    elif command_name == 'findAndModify':
+        detail = {'filter': _elide(command.get('query', {}))}
+    else:
+        detail = None
+    return json.dumps([command_name, collection, detail], sort_keys=True, default=str)
+
+
+class CommandTimer(monitoring.CommandListener):
+    """Adds every MongoDB command to the profile of the request that issued it"""
+
+    def started(self, event):
+        profile = _current.get()
+        if profile is not None:
+            profile.pending[event.request_id] = query_shape(event.command_name, event.command)
+
+    def succeeded(self, event):
+        profile = _current.get()
+        if profile is not None:
+            profile.add_command(event.request_id, event.duration_micros / 1e6)
+
+    def failed(self, event):
+        self.succeeded(event)
+
+
+def install():
+    """Register the command listener; must run before djongo creates its MongoClient"""
+    monitoring.register(CommandTimer())
+
+
+@contextmanager
+def timed(attribute):
+    """Add the time spent in the block to an attribute of the current profile, if any"""
+    profile = _current.get()
+    if profile is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        setattr(profile, attribute, getattr(profile, attribute) + time.perf_counter() - started)
+
+
+def _sql_timer(execute, sql, params, many, context):
+    """execute_wrapper counting time not spent in MongoDB as djongo translation"""
+    profile = _current.get()
+    started, mongo_before = time.perf_counter(), profile.mongo_time
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        profile.sql_time += max(0.0, time.perf_counter() - started - (profile.mongo_time - mongo_before))
+
+
+class ProfilingMiddleware(MiddlewareMixin):
+    """
+    Adds a Server-Timing header to a sample of requests and logs slow ones.
+
+    Keep it last in MIDDLEWARE so that rendering happens inside it. It is
+    async capable, so under ASGI the async views under /api/async/ stay on
+    the event loop.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __call__(self, request):
+        if self._is_coroutine:
+            return self.__acall__(request)
+        if random.random() >= settings.OCTOFIT_PROFILE_SAMPLE_RATE:
+            return self.get_response(request)
+
+        profile = RequestProfile()
+        token = _current.set(profile)
+        try:
+            with connections['default'].execute_wrapper(_sql_timer):
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, profile)
+
+    async def __acall__(self, request):
+        if random.random() >= settings.OCTOFIT_PROFILE_SAMPLE_RATE:
+            return await self.get_response(request)
+
+        profile = RequestProfile()
+        token = _current.set(profile)
+        try:
+            with connections['default'].execute_wrapper(_sql_timer):
+                response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, profile)
+
+    def finish(self, request, response, profile):
+        """Add the Server-Timing header, and log the request if it was slow"""
+        finished = time.perf_counter()
+        total = finished - profile.started
+        if profile.render_started is not None:
+            profile.render_time = finished - profile.render_started
+        response['Server-Timing'] = profile.server_timing(total)
+        if total * 1000 >= settings.OCTOFIT_SLOW_REQUEST_MS:
+            self.log_slow_request(request, response, profile, total)
+        return response
+
+    def process_template_response(self, request, response):
+        profile = _current.get()
+        if profile is not None:
+            profile.render_started = time.perf_counter()
+        return response
+
+    def log_slow_request(self, request, response, profile, total):
+        logger.warning(json.dumps({
+            'event': 'slow_request',
+            'method': request.method,
+            'path': request.get_full_path(),
+            'status': response.status_code,
+            'total_ms': round(total * 1000, 2),
+            'mongo_ops': profile.mongo_ops,
+            'mongo_ms': round(profile.mongo_time * 1000, 2),
+            'sql_ms': round(profile.sql_time * 1000, 2),
+            'serialize_ms': round(profile.serialize_time * 1000, 2),
+            'render_ms': round(profile.render_time * 1000, 2),
+            'queries': [
+                {'shape': json.loads(shape), 'count': count, 'ms': round(seconds * 1000, 2)}
+                for shape, (count, seconds) in sorted(profile.shapes.items(), key=lambda item: -item[1][1])
+            ],
+        }))
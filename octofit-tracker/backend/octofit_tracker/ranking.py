@@ -0,0 +1,147 @@
+"""
+In-memory distribution of leaderboard totals over a compact NumPy array.
+
+A RankingEngine holds every user's total calories, sorted, in one int32
+array (int64 when a total needs it): 4 bytes per user, about 12 MB for
+three million users. It answers questions the materialized leaderboard
+cannot without a full scan: percentiles, histograms of totals, ties, and
+where a total falls among them. A total's `tied_rank` is its competition
+rank: one more than the number of users with strictly more calories.
+Lookups are binary searches.
+
+Users' ranks are not served from here. The leaderboard collection answers
+top and rank with indexed reads and is always current, while an engine is
+a snapshot.
+
+get_engine() keeps one engine per process, read from the totals stored in
+the leaderboard collection. Once it is older than
+OCTOFIT_RANKING_MAX_AGE_SECONDS, a background thread checks whether the
+leaderboard has changed and, if so, builds a replacement while requests
+keep using the current engine. Answers may lag the leaderboard by that
+long plus the time a build takes.
+"""
+import logging
+import threading
+import time
+
+import numpy as np
+from django.conf import settings
+from pymongo.errors import PyMongoError
+
+from .cache import get_versions
+from .models import Leaderboard
+from .repository import leaderboard
+
+logger = logging.getLogger(__name__)
+
+INT32 = np.iinfo(np.int32)
+
+
+class RankingEngine:
+    """Every user's total calories, sorted ascending in a typed array"""
+
+    def __init__(self, calories):
+        """`calories` is every user's total, in any order"""
+        self.calories = np.sort(np.asarray(calories))
+
+    def __len__(self):
+        return len(self.calories)
+
+    def tied_rank(self, calories):
+        """One more than the number of users with more calories than `calories`"""
+        return len(self) - int(np.searchsorted(self.calories, calories, side='right')) + 1
+
+    def percentile_of(self, calories):
+        """Share of users, in percent, with fewer calories than `calories`"""
+        if not len(self):
+            return 0.0
+        return 100.0 * int(np.searchsorted(self.calories, calories, side='left')) / len(self)
+
+    def percentiles(self, percents):
+        """{percent: calories at that percentile}, interpolated"""
+        if not len(self):
+            return {percent: None for percent in percents}
+        values = np.percentile(self.calories, percents)
+        return {percent: float(value) for percent, value in zip(percents, values)}
+
+    def histogram(self, bins=20):
+        """Counts of users per equal-width range of calories"""
+        if not len(self):
+            return {'edges': [], 'counts': []}
+        counts, edges = np.histogram(self.calories, bins=bins)
+        return {'edges': edges.tolist(), 'counts': counts.tolist()}
+
+    def ties(self):
+        """How many users share their total with someone else, and the largest such group"""
+        if not len(self):
+            return {'tied_users': 0, 'largest_tie': 0}
+        counts = np.unique(self.calories, return_counts=True)[1]
+        shared = counts[counts > 1]
+        return {'tied_users': int(shared.sum()), 'largest_tie': int(shared.max()) if len(shared) else 0}
+
+    @classmethod
+    def from_database(cls):
+        """
+        Build from the totals stored in the leaderboard collection, read
+        from the cursor straight into a preallocated int32 array. It grows
+        when the estimated count falls short and widens to int64 when a
+        total does not fit.
+        """
+        calories = np.empty(max(leaderboard.estimated_count(), 1), dtype=np.int32)
+        count = 0
+        for row in leaderboard.cursor(projection={'_id': 0, 'total_calories': 1}):
+            total = row['total_calories']
+            if count == len(calories):
+                calories = np.resize(calories, 2 * count)
+            if calories.dtype == np.int32 and not INT32.min <= total <= INT32.max:
+                calories = calories.astype(np.int64)
+            calories[count] = total
+            count += 1
+        return cls(calories[:count])
+
+
+_engine = None
+# (monotonic time of the last check, leaderboard version the engine was built from)
+_built = (0.0, None)
+_refreshing = False
+_lock = threading.Lock()
+
+
+def _refresh(version):
+    """Replace the engine if the leaderboard changed since `version`; runs in a background thread"""
+    global _engine, _built, _refreshing
+    engine = None
+    try:
+        current = get_versions([Leaderboard._meta.db_table])
+        if current != version:
+            engine = RankingEngine.from_database()
+    except PyMongoError:
+        logger.exception('Rebuilding the ranking engine failed; keeping the previous one')
+        current = version
+    with _lock:
+        if engine is not None:
+            _engine = engine
+        _built = (time.monotonic(), current)
+        _refreshing = False
+
+
+def get_engine():
+    """
+    This process's engine. The first call builds it. Later calls return it
+    at once, and start a background refresh when it is older than
+    OCTOFIT_RANKING_MAX_AGE_SECONDS.
+    """
+    global _engine, _built, _refreshing
+    with _lock:
+        if _engine is None:
+            version = get_versions([Leaderboard._meta.db_table])
+            _engine = RankingEngine.from_database()
+            _built = (time.monotonic(), version)
+            return _engine
+        engine = _engine
+        built_at, version = _built
+        if _refreshing or time.monotonic() - built_at < settings.OCTOFIT_RANKING_MAX_AGE_SECONDS:
+            return engine
+        _refreshing = True
+    threading.Thread(target=_refresh, args=(version,), name='octofit-ranking', daemon=True).start()
+    return engine
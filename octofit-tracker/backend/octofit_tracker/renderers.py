@@ -0,0 +1,105 @@
+import csv
+import io
+import re
+
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+
+try:
+    import orjson
+except ImportError:  # optional; fall back to the stdlib encoder
+    orjson = None
+
+
+# Floats that Python writes in exponent form (below 1e-4 or from 1e16 up)
+# come out of orjson in a different notation. Numbers in compact JSON always
+# follow one of ':,[' so this only looks at number positions; a false
+# positive inside a string merely takes the stdlib path.
+EXPONENT_FLOAT = re.compile(rb'(?:^|[:,\[])-?(?:\d+(?:\.\d+)?e|0\.0000)')
+
+LINE_SEPARATOR = '\u2028'.encode('utf-8')
+PARAGRAPH_SEPARATOR = '\u2029'.encode('utf-8')
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer that encodes with orjson when it is installed.
+
+    Output is byte-for-byte what JSONRenderer produces: types orjson does not
+    handle natively go through DRF's encoder, and indented output, non-default
+    JSON settings, oversized integers and exponent-form floats are rendered by
+    the stdlib encoder. NaN and infinity render as null instead of failing.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or data is None or self.ensure_ascii or not self.compact:
+            return super().render(data, accepted_media_type, renderer_context)
+        if self.get_indent(accepted_media_type, renderer_context or {}) is not None:
+            return super().render(data, accepted_media_type, renderer_context)
+
+        try:
+            ret = orjson.dumps(
+                data,
+                default=self.encoder_class().default,
+                option=orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS,
+            )
+        except orjson.JSONEncodeError:
+            return super().render(data, accepted_media_type, renderer_context)
+        if EXPONENT_FLOAT.search(ret):
+            return super().render(data, accepted_media_type, renderer_context)
+
+        # Escape U+2028 and U+2029 like JSONRenderer does
+        if LINE_SEPARATOR in ret or PARAGRAPH_SEPARATOR in ret:
+            ret = ret.replace(LINE_SEPARATOR, b'\\u2028').replace(PARAGRAPH_SEPARATOR, b'\\u2029')
+        return ret
+
+
+class NDJSONRenderer(BaseRenderer):
+    """
+    Newline-delimited JSON. Streaming views write their own body; this
+    renders anything else (such as errors) as a single line.
+    """
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return FastJSONRenderer().render(data) + b'\n'
+
+
+class CSVRenderer(BaseRenderer):
+    """
+    CSV. Streaming views write their own body; this renders anything else
+    (such as errors) as a header row of keys and one row of values.
+    """
+    media_type = 'text/csv'
+    format = 'csv'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        if isinstance(data, dict):
+            writer.writerow(data.keys())
+            writer.writerow(data.values())
+        else:
+            writer.writerow([data])
+        return buffer.getvalue().encode(self.charset)
+
+
+class EventStreamRenderer(BaseRenderer):
+    """
+    Server-Sent Events. Streaming views write their own body; this renders
+    anything else (such as errors) as a single `error` event.
+    """
+    media_type = 'text/event-stream'
+    format = 'event-stream'
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return b'event: error\ndata: ' + FastJSONRenderer().render(data) + b'\n\n'
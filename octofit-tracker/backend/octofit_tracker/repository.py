@@ -0,0 +1,117 @@
+"""
+Direct pymongo access to the collections behind the hot API paths.
+
+Calls through ``Model.objects.mongo_*`` open a djongo cursor on every call,
+and reads through the ORM go through djongo's SQL translation. A
+Repository issues the same queries on the shared MongoClient instead.
+
+The client is the one djongo itself connects with: it is created once per
+process from ``settings.DATABASES['default']`` (including the pool options
+under ``CLIENT``) and reused by every thread. With ``CONN_MAX_AGE = None``,
+djongo no longer closes it at the end of each request, so the pool's
+connections stay open. The database name is read from the live connection
+settings, so tests use the test database.
+
+Reads return the same documents the ORM's ``.values()`` rows hold, in the
+same order, so the document serializers render identical output.
+"""
+from collections import OrderedDict
+
+from bson import ObjectId
+from django.db import connections
+from djongo import database
+
+from .models import Activity, Leaderboard, User, Workout
+from .pagination import keyset_query, mongo_sort
+
+
+def get_database(alias='default'):
+    """The pymongo Database for a connection alias, on djongo's shared MongoClient"""
+    settings_dict = connections[alias].settings_dict
+    client = database.connect(
+        db=settings_dict['NAME'], document_class=OrderedDict, **settings_dict.get('CLIENT', {})
+    )
+    return client[settings_dict['NAME']]
+
+
+def object_id(value):
+    """ObjectId for a primary key value, or None when it is not a valid id"""
+    if isinstance(value, ObjectId):
+        return value
+    if isinstance(value, str) and ObjectId.is_valid(value):
+        return ObjectId(value)
+    return None
+
+
+class Repository:
+    """Queries and writes on the collection of one model"""
+
+    def __init__(self, model):
+        self.model = model
+
+    @property
+    def collection(self):
+        return get_database()[self.model._meta.db_table]
+
+    def cursor(self, query=None, projection=None, ordering=None, position=None, limit=0, collation=None,
+               **options):
+        """
+        Cursor over documents matching `query`, sorted by an ordering tuple
+        such as ('-date', '-_id') and starting after a keyset `position`.
+        Other keyword arguments are passed to Collection.find.
+        """
+        query = query or {}
+        if position is not None:
+            query = {'$and': [query, keyset_query(ordering, position)]} if query else keyset_query(ordering, position)
+        cursor = self.collection.find(query, projection, **options)
+        if ordering:
+            cursor = cursor.sort(mongo_sort(ordering))
+        if limit:
+            cursor = cursor.limit(limit)
+        if collation is not None:
+            cursor = cursor.collation(collation)
+        return cursor
+
+    def find(self, query=None, projection=None, ordering=None, position=None, limit=0, collation=None):
+        """List of the documents cursor() would return"""
+        return list(self.cursor(query, projection, ordering, position, limit, collation))
+
+    def find_one(self, query=None, projection=None):
+        return self.collection.find_one(query or {}, projection)
+
+    def get(self, pk, projection=None):
+        """Document with primary key `pk`, or None if missing or not a valid id"""
+        pk = object_id(pk)
+        if pk is None:
+            return None
+        return self.collection.find_one({'_id': pk}, projection)
+
+    def insert_one(self, document):
+        self.collection.insert_one(document)
+        return document
+
+    def insert_many(self, documents, ordered=False):
+        return self.collection.insert_many(documents, ordered=ordered)
+
+    def replace(self, document):
+        """Store `document` over the one with the same _id"""
+        return self.collection.replace_one({'_id': document['_id']}, document)
+
+    def delete(self, pk, projection=None):
+        """Delete the document with primary key `pk`; return it, or None if it did not exist"""
+        pk = object_id(pk)
+        if pk is None:
+            return None
+        return self.collection.find_one_and_delete({'_id': pk}, projection)
+
+    def delete_many(self, query=None):
+        return self.collection.delete_many(query or {})
+
+    def estimated_count(self):
+        return self.collection.estimated_document_count()
+
+
+users = Repository(User)
+activities = Repository(Activity)
+leaderboard = Repository(Leaderboard)
+workouts = Repository(Workout)
@@ -0,0 +1,241 @@
+"""
+Daily per-user activity rollups and the time-windowed leaderboards built on them.
+
+Every activity write adds its calories, duration, distance and a count of
+one to the rollup for its owner and UTC day. A windowed board then sums at
+most one rollup per user per day in the window instead of scanning raw
+activities, and numbers the users in the same order as the all-time board.
+
+The boards of the current day, week and month are materialized into
+``leaderboard_windows`` so that a page of one costs an indexed range read,
+as on the all-time board. A board is rebuilt by the first request that
+finds it older than OCTOFIT_WINDOW_BOARD_MAX_AGE_SECONDS, and so lags the
+rollups by at most that long. Each build is stored under its own
+`built_at`; a marker document in ``leaderboard_window_builds`` names the
+current one, and the build before it is kept for readers still paging it.
+Custom windows are aggregated on every request.
+"""
+from collections import defaultdict
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.utils import timezone
+from pymongo import DeleteOne, ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+from .archive import archive_horizon
+from .cache import bump_version
+from .leaderboard import RANK_ORDER
+from .models import Activity, DailyRollup, WindowBoardEntry
+from .pagination import get_value
+from .repository import Repository, get_database
+
+WINDOWS = ('day', 'week', 'month', 'custom')
+# Windows whose boards are materialized
+MATERIALIZED_WINDOWS = ('day', 'week', 'month')
+
+WINDOW_BUILDS_COLLECTION = 'leaderboard_window_builds'
+
+boards = Repository(WindowBoardEntry)
+
+
+def day_of(date):
+    """Midnight UTC, as stored by pymongo, of the day a datetime falls on"""
+    if timezone.is_aware(date):
+        date = date.astimezone(dt_timezone.utc)
+    return datetime.combine(date.date(), time.min)
+
+
+def apply_rollup_deltas(added=(), removed=()):
+    """
+    Add activities (documents or instances) to their daily rollups and
+    subtract removed ones, with one update per user and day.
+
+    Rollups left without activities are deleted.
+    """
+    totals = defaultdict(lambda: {'calories': 0, 'duration': 0, 'distance': 0.0, 'count': 0})
+    for activities, sign in ((added, 1), (removed, -1)):
+        for activity in activities:
+            delta = totals[(get_value(activity, 'user_id'), day_of(get_value(activity, 'date')))]
+            delta['calories'] += sign * get_value(activity, 'calories')
+            delta['duration'] += sign * get_value(activity, 'duration')
+            delta['distance'] += sign * (get_value(activity, 'distance') or 0)
+            delta['count'] += sign
+    operations = []
+    for (user_id, day), delta in totals.items():
+        key = {'user_id': user_id, 'day': day}
+        operations.append(UpdateOne(key, {'$inc': delta}, upsert=True))
+        if delta['count'] < 0:
+            operations.append(DeleteOne({**key, 'count': {'$lte': 0}}))
+    if operations:
+        DailyRollup.objects.mongo_bulk_write(operations)
+        bump_version(DailyRollup._meta.db_table)
+
+
+def rebuild_rollups():
+    """
+    Recompute the rollups from the activities collection with one aggregation.
+
+    Once activities have been archived, only the days from the archive
+    horizon on are recomputed; earlier rollups also count archived
+    activities and are kept.
+    """
+    horizon = archive_horizon()
+    pipeline = [
+        {'$group': {
+            '_id': {'user_id': '$user_id', 'day': {'$dateTrunc': {'date': '$date', 'unit': 'day'}}},
+            'calories': {'$sum': '$calories'},
+            'duration': {'$sum': '$duration'},
+            'distance': {'$sum': {'$ifNull': ['$distance', 0.0]}},
+            'count': {'$sum': 1},
+        }},
+        {'$project': {
+            '_id': 0,
+            'user_id': '$_id.user_id',
+            'day': '$_id.day',
+            'calories': 1,
+            'duration': 1,
+            'distance': 1,
+            'count': 1,
+        }},
+    ]
+    if horizon is None:
+        pipeline.append({'$out': DailyRollup._meta.db_table})
+    else:
+        DailyRollup.objects.mongo_delete_many({'day': {'$gte': horizon}})
+        pipeline.insert(0, {'$match': {'date': {'$gte': horizon}}})
+        pipeline.append({'$merge': {
+            'into': DailyRollup._meta.db_table,
+            'on': ['user_id', 'day'],
+            'whenMatched': 'replace',
+            'whenNotMatched': 'insert',
+        }})
+    Activity.objects.mongo_aggregate(pipeline, allowDiskUse=True)
+    bump_version(DailyRollup._meta.db_table)
+    expire_boards()
+
+
+def window_range(window, start=None, end=None, now=None):
+    """
+    [start, end) of a named window, in whole UTC days.
+
+    `day`, `week` (from Monday) and `month` are the current calendar
+    periods; `custom` widens `start` and `end` to whole days and may span at
+    most OCTOFIT_LEADERBOARD_MAX_WINDOW_DAYS. Raises ValueError otherwise.
+    """
+    today = day_of(now or timezone.now())
+    if window == 'day':
+        return today, today + timedelta(days=1)
+    if window == 'week':
+        monday = today - timedelta(days=today.weekday())
+        return monday, monday + timedelta(days=7)
+    if window == 'month':
+        first = today.replace(day=1)
+        return first, (first + timedelta(days=32)).replace(day=1)
+    if window == 'custom':
+        if start is None or end is None:
+            raise ValueError('start and end are required for a custom window')
+        start, end = day_of(start), day_of(end - timedelta(microseconds=1)) + timedelta(days=1)
+        if end <= start:
+            raise ValueError('end must be after start')
+        if (end - start).days > settings.OCTOFIT_LEADERBOARD_MAX_WINDOW_DAYS:
+            raise ValueError(f'A custom window spans at most {settings.OCTOFIT_LEADERBOARD_MAX_WINDOW_DAYS} days')
+        return start, end
+    raise ValueError(f'window must be one of {", ".join(WINDOWS)}')
+
+
+def window_pipeline(start, end):
+    """Leaderboard entries, numbered in RANK_ORDER, for the rollups of days in [start, end)"""
+    return [
+        {'$match': {'day': {'$gte': start, '$lt': end}}},
+        {'$group': {
+            '_id': '$user_id',
+            'total_calories': {'$sum': '$calories'},
+            'total_activities': {'$sum': '$count'},
+            'total_duration': {'$sum': '$duration'},
+            'total_distance': {'$sum': '$distance'},
+        }},
+        {'$project': {
+            '_id': 0,
+            'user_id': '$_id',
+            'total_calories': 1,
+            'total_activities': 1,
+            'total_duration': 1,
+            'total_distance': 1,
+        }},
+        {'$setWindowFields': {
+            'sortBy': dict(RANK_ORDER),
+            'output': {'rank': {'$documentNumber': {}}},
+        }},
+    ]
+
+
+def _builds():
+    return get_database()[WINDOW_BUILDS_COLLECTION]
+
+
+def expire_boards():
+    """Have every materialized board rebuilt by its next request"""
+    _builds().update_many({}, {'$set': {'claimed_at': datetime(1970, 1, 1)}})
+
+
+def _build_board(start, end, built_at):
+    """Materialize the board for [start, end) under `built_at`"""
+    DailyRollup.objects.mongo_aggregate(window_pipeline(start, end) + [
+        {'$set': {'start': start, 'end': end, 'built_at': built_at}},
+        {'$merge': {'into': WindowBoardEntry._meta.db_table, 'whenMatched': 'fail', 'whenNotMatched': 'insert'}},
+    ], allowDiskUse=True)
+
+
+def current_board(start, end):
+    """
+    `built_at` of the materialized board for [start, end), building it
+    first when it is older than OCTOFIT_WINDOW_BOARD_MAX_AGE_SECONDS.
+
+    Of several processes finding it stale at once, only the one that
+    claims the marker rebuilds it; the others read the previous build.
+    """
+    key = f'{start:%Y-%m-%d}/{end:%Y-%m-%d}'
+    # Naive UTC with milliseconds, as pymongo returns stored dates
+    now = datetime.now(dt_timezone.utc).replace(tzinfo=None)
+    now = now.replace(microsecond=now.microsecond // 1000 * 1000)
+    stale = now - timedelta(seconds=settings.OCTOFIT_WINDOW_BOARD_MAX_AGE_SECONDS)
+    marker = _builds().find_one({'_id': key})
+    if marker is not None and marker.get('built_at') and marker['claimed_at'] > stale:
+        return marker['built_at']
+    try:
+        marker = _builds().find_one_and_update(
+            {'_id': key, 'claimed_at': {'$lte': stale}},
+            {'$set': {'claimed_at': now, 'start': start, 'end': end}},
+            upsert=True,
+            return_document=ReturnDocument.BEFORE,
+        )
+    except DuplicateKeyError:
+        # Another process claimed it since; its previous build is still current
+        marker = _builds().find_one({'_id': key}) or {}
+        if marker.get('built_at'):
+            return marker['built_at']
+        marker = None
+    _build_board(start, end, now)
+    _builds().update_one({'_id': key}, {'$max': {'built_at': now}}, upsert=True)
+    previous = (marker or {}).get('built_at')
+    if previous is not None:
+        boards.delete_many({'start': start, 'end': end, 'built_at': {'$lt': previous}})
+    # Boards of windows that have ended are no longer requested
+    boards.delete_many({'end': {'$lte': start}})
+    _builds().delete_many({'end': {'$lte': start}})
+    return now
+
+
+def find_board(start, end, projection=None, ordering=('rank',), position=None, limit=0):
+    """Entries of the current materialized board for [start, end), like Repository.find"""
+    built_at = current_board(start, end)
+    projection = {'_id': 0, **(projection or {name: 1 for name in (
+        'user_id', 'total_calories', 'total_activities', 'total_duration', 'total_distance', 'rank'
+    )})}
+    return boards.find({'start': start, 'end': end, 'built_at': built_at}, projection, ordering, position, limit)
+
+
+def aggregate(pipeline):
+    """Run a pipeline on the rollups collection"""
+    return list(DailyRollup.objects.mongo_aggregate(pipeline, allowDiskUse=True))
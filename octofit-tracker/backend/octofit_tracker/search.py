@@ -0,0 +1,104 @@
+"""
+Workout search: matching workouts and their facet counts in one query.
+
+Whole words (?q=) are matched through the workout_text index. A name
+prefix (?prefix=, for search-as-you-type, which $text cannot do) is a
+case-insensitive range on the name collation index. The filters shared by
+every part of the response (text or prefix, and duration range) run once
+in the first $match; $facet then splits the matched workouts into the
+page of results and the counts per difficulty level and exercise type.
+Each facet applies every filter except its own, so the counts show how
+many workouts picking another value of that facet would return.
+
+Facet values match case-insensitively, like by_difficulty and by_type:
+each is first resolved to its stored spellings through the field's
+collation index, and the facets then compare exactly.
+"""
+from .models import CASE_INSENSITIVE, Workout
+from .repository import Repository
+
+workouts = Repository(Workout)
+
+# Facet name: document field
+FACETS = {
+    'difficulty': 'difficulty_level',
+    'type': 'exercise_type',
+}
+
+
+# Sorts after every other character under the CLDR collations
+LAST_CHARACTER = '\uffff'
+
+
+def spellings(field, value):
+    """Stored values of `field` equal to `value` ignoring case, read through its collation index"""
+    return workouts.collection.distinct(field, {field: value}, collation=CASE_INSENSITIVE)
+
+
+def _counts(field):
+    return [
+        {'$group': {'_id': f'${field}', 'count': {'$sum': 1}}},
+        {'$sort': {'count': -1, '_id': 1}},
+        {'$project': {'_id': 0, 'value': '$_id', 'count': 1}},
+    ]
+
+
+def search_pipeline(q=None, prefix=None, filters=None, min_duration=None, max_duration=None, projection=None,
+                    limit=20):
+    """
+    Pipeline returning one document with `count`, `results` and a list of
+    {value, count} per facet. `filters` maps facet names to the stored
+    values to filter on. A `prefix` search must run with the
+    CASE_INSENSITIVE collation.
+    """
+    filters = {name: values for name, values in (filters or {}).items() if values is not None}
+    match = {}
+    if q:
+        match['$text'] = {'$search': q}
+    elif prefix:
+        match['name'] = {'$gte': prefix, '$lt': prefix + LAST_CHARACTER}
+    duration = {}
+    if min_duration is not None:
+        duration['$gte'] = min_duration
+    if max_duration is not None:
+        duration['$lte'] = max_duration
+    if duration:
+        match['duration'] = duration
+
+    def facet_match(excluded=None):
+        query = {FACETS[name]: {'$in': values} for name, values in filters.items() if name != excluded}
+        return [{'$match': query}] if query else []
+
+    ordering = {'score': -1, 'name': 1, '_id': 1} if q else {'name': 1, '_id': 1}
+    results = facet_match() + [{'$sort': ordering}, {'$limit': limit}]
+    if projection:
+        results.append({'$project': projection})
+    else:
+        results.append({'$project': {'score': 0}})
+
+    pipeline = [{'$match': match}] if match else []
+    if q:
+        pipeline.append({'$addFields': {'score': {'$meta': 'textScore'}}})
+    pipeline.append({'$facet': {
+        'count': facet_match() + [{'$count': 'count'}],
+        'results': results,
+        **{name: facet_match(name) + _counts(field) for name, field in FACETS.items()},
+    }})
+    return pipeline
+
+
+def search_workouts(filters=None, **kwargs):
+    """
+    Total matches, a page of results and the facet counts of a search;
+    see search_pipeline. `filters` maps facet names to a value to match
+    case-insensitively.
+    """
+    filters = {name: spellings(FACETS[name], value) for name, value in (filters or {}).items() if value}
+    collation = CASE_INSENSITIVE if kwargs.get('prefix') and not kwargs.get('q') else None
+    document = next(workouts.collection.aggregate(search_pipeline(filters=filters, **kwargs), collation=collation))
+    count = document['count'][0]['count'] if document['count'] else 0
+    return {
+        'count': count,
+        'results': document['results'],
+        'facets': {name: document[name] for name in FACETS},
+    }
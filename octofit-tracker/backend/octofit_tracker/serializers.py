@@ -1,37 +1,254 @@
+from datetime import timezone as dt_timezone
+
+from bson import ObjectId
+from django.utils import timezone
+from django.utils.functional import cached_property
+from djongo import models
 from rest_framework import serializers
-from .models import User, Team, Activity, Leaderboard, Workout
+from .models import User, Team, Activity, Leaderboard, TeamStanding, Workout
+from .pagination import get_value
+from .profiling import timed
+from .repository import Repository
+
+
+class SparseFieldsMixin:
+    """Output only the fields named in the `fields` serializer context entry, when present"""
+
+    def to_representation(self, instance):
+        if self.parent is not None:
+            return super().to_representation(instance)
+        with timed('serialize_time'):
+            return super().to_representation(instance)
+
+    def get_fields(self):
+        fields = super().get_fields()
+        requested = self.context.get('fields')
+        if requested is not None:
+            fields = type(fields)((name, field) for name, field in fields.items() if name in requested)
+        return fields
+
+
+def documents_by_id(model, serializer_class, ids):
+    """Serialized `model` documents with the given string ids, keyed by id, from one $in query"""
+    object_ids = list({ObjectId(value) for value in ids if value and ObjectId.is_valid(value)})
+    if not object_ids:
+        return {}
+    serializer = serializer_class()
+    projection = {name: 1 for name in serializer_class.field_names}
+    return {
+        str(document['_id']): serializer.to_representation(document)
+        for document in Repository(model).find({'_id': {'$in': object_ids}}, projection)
+    }
+
+
+def expand_choices(serializer_class):
+    """Relations ?expand= may name for a serializer's rows"""
+    meta = serializer_class.Meta
+    if getattr(meta, 'expand_user_field', None):
+        return ('user', 'team')
+    if getattr(meta, 'expand_team_field', None):
+        return ('team',)
+    return ()
+
+
+def expand_rows(items, rows, expand, user_field=None, team_field=None):
+    """
+    Embed the related `user` and/or `team` of each item in its output row.
+
+    Items reference a user through `user_field` (their team is then the
+    user's) or a team directly through `team_field`. Each related
+    collection is read with a single $in query for the whole list.
+    """
+    users = {}
+    if user_field:
+        user_ids = [get_value(item, user_field) for item in items]
+        users = documents_by_id(User, UserDocumentSerializer, user_ids)
+        team_ids = [(users.get(user_id) or {}).get('team_id') for user_id in user_ids]
+    else:
+        user_ids = [None] * len(items)
+        team_ids = [get_value(item, team_field) for item in items]
+    teams = documents_by_id(Team, TeamDocumentSerializer, team_ids) if 'team' in expand else {}
+    for row, user_id, team_id in zip(rows, user_ids, team_ids):
+        if 'user' in expand:
+            row['user'] = users.get(user_id)
+        if 'team' in expand:
+            row['team'] = teams.get(team_id)
+    return rows
+
 
+class ExpandListSerializer(serializers.ListSerializer):
+    """
+    List serializer used by every serializer here: it times serialization
+    for profiling and embeds the relations named in the `expand` context entry.
+    """
 
-class UserSerializer(serializers.ModelSerializer):
+    def to_representation(self, data):
+        items = list(data.all() if isinstance(data, models.Manager) else data)
+        with timed('serialize_time'):
+            rows = super().to_representation(items)
+        expand = self.context.get('expand')
+        if expand:
+            meta = getattr(self.child.Meta, 'serializer', type(self.child)).Meta
+            expand_rows(
+                items, rows, expand,
+                user_field=getattr(meta, 'expand_user_field', None),
+                team_field=getattr(meta, 'expand_team_field', None),
+            )
+        return rows
+
+
+class UserSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = User
         fields = ['_id', 'name', 'email', 'team_id', 'created_at']
         read_only_fields = ['_id', 'created_at']
+        list_serializer_class = ExpandListSerializer
+        expand_team_field = 'team_id'
 
 
-class TeamSerializer(serializers.ModelSerializer):
+class TeamSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Team
         fields = ['_id', 'name', 'description', 'created_at']
         read_only_fields = ['_id', 'created_at']
+        list_serializer_class = ExpandListSerializer
 
 
-class ActivitySerializer(serializers.ModelSerializer):
+class ActivitySerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Activity
         fields = ['_id', 'user_id', 'activity_type', 'duration', 'distance', 'calories', 'date', 'created_at']
         read_only_fields = ['_id', 'created_at']
+        list_serializer_class = ExpandListSerializer
+        expand_user_field = 'user_id'
 
 
-class LeaderboardSerializer(serializers.ModelSerializer):
+class LeaderboardSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Leaderboard
         fields = ['_id', 'user_id', 'total_calories', 'total_activities', 'rank', 'updated_at']
         read_only_fields = ['_id', 'updated_at']
+        list_serializer_class = ExpandListSerializer
+        expand_user_field = 'user_id'
+
+
+class TeamStandingSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    class Meta:
+        model = TeamStanding
+        fields = [
+            '_id', 'team_id', 'team_name', 'members', 'total_calories', 'total_activities',
+            'avg_calories_per_member', 'rank', 'updated_at'
+        ]
+        read_only_fields = fields
+        list_serializer_class = ExpandListSerializer
 
 
-class WorkoutSerializer(serializers.ModelSerializer):
+class WorkoutSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Workout
         fields = ['_id', 'name', 'description', 'difficulty_level', 'duration', 'exercise_type', 'created_at']
         read_only_fields = ['_id', 'created_at']
+        list_serializer_class = ExpandListSerializer
+
+
+def format_datetime(value):
+    """Format a datetime exactly like DRF's DateTimeField (ISO 8601, UTC as 'Z')"""
+    if value is None:
+        return None
+    if timezone.is_naive(value):
+        # pymongo returns naive datetimes in UTC
+        value = value.replace(tzinfo=dt_timezone.utc)
+    value = value.astimezone(timezone.get_current_timezone()).isoformat()
+    if value.endswith('+00:00'):
+        value = value[:-6] + 'Z'
+    return value
+
+
+def format_object_id(value):
+    return None if value is None else str(value)
+
+
+def format_float(value):
+    return None if value is None else float(value)
+
+
+def document_converter(model_field):
+    """Output conversion for a stored value of `model_field`, or None to copy it as is"""
+    if isinstance(model_field, models.ObjectIdField):
+        return format_object_id
+    if isinstance(model_field, models.DateTimeField):
+        return format_datetime
+    if isinstance(model_field, models.FloatField):
+        return format_float
+    return None
+
+
+class DocumentSerializer(serializers.BaseSerializer):
+    """
+    Read-only serializer that builds output straight from MongoDB documents
+    (or `.values()` rows) instead of model instances.
+
+    Subclasses name the ModelSerializer they mirror in `Meta.serializer`; the
+    output has the same fields, order and formatting as that serializer,
+    trimmed to the `fields` context entry when present.
+    """
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        model_serializer = cls.Meta.serializer
+        model = model_serializer.Meta.model
+        cls.field_names = tuple(model_serializer.Meta.fields)
+        cls.converters = tuple(
+            (name, document_converter(model._meta.get_field(name))) for name in cls.field_names
+        )
+
+    @cached_property
+    def output_converters(self):
+        """(name, converter) of each field to output"""
+        requested = self.context.get('fields')
+        if requested is None:
+            return self.converters
+        return tuple((name, convert) for name, convert in self.converters if name in requested)
+
+    def to_representation(self, document):
+        get = document.get
+        return {
+            name: convert(get(name)) if convert else get(name)
+            for name, convert in self.output_converters
+        }
+
+
+class UserDocumentSerializer(DocumentSerializer):
+    class Meta:
+        serializer = UserSerializer
+        list_serializer_class = ExpandListSerializer
+
+
+class TeamDocumentSerializer(DocumentSerializer):
+    class Meta:
+        serializer = TeamSerializer
+        list_serializer_class = ExpandListSerializer
+
+
+class ActivityDocumentSerializer(DocumentSerializer):
+    class Meta:
+        serializer = ActivitySerializer
+        list_serializer_class = ExpandListSerializer
+
+
+class LeaderboardDocumentSerializer(DocumentSerializer):
+    class Meta:
+        serializer = LeaderboardSerializer
+        list_serializer_class = ExpandListSerializer
+
+
+class TeamStandingDocumentSerializer(DocumentSerializer):
+    class Meta:
+        serializer = TeamStandingSerializer
+        list_serializer_class = ExpandListSerializer
+
+
+class WorkoutDocumentSerializer(DocumentSerializer):
+    class Meta:
+        serializer = WorkoutSerializer
+        list_serializer_class = ExpandListSerializer
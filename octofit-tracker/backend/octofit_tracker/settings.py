@@ -63,6 +63,8 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    # Last, so that response rendering is timed
+    'octofit_tracker.profiling.ProfilingMiddleware',
 ]
 
 ROOT_URLCONF = 'octofit_tracker.urls'
@@ -89,18 +91,49 @@ WSGI_APPLICATION = 'octofit_tracker.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/4.1/ref/settings/#databases
 
+# djongo and octofit_tracker.repository share one MongoClient built from
+# CLIENT; keep it open across requests so its connection pool is reused.
 DATABASES = {
     'default': {
         'ENGINE': 'djongo',
         'NAME': 'octofit_db',
+        'CONN_MAX_AGE': None,
         'CLIENT': {
             'host': 'localhost',
             'port': 27017,
+            # Enough connections for the WSGI threads plus OCTOFIT_ASYNC_DB_THREADS
+            'maxPoolSize': 100,
+            'minPoolSize': 10,
+            'maxIdleTimeMS': 300000,
+            # Fail a request instead of queueing forever when the pool is exhausted
+            'waitQueueTimeoutMS': 5000,
         }
     }
 }
 
 
+# Caches
+# https://docs.djangoproject.com/en/4.1/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # Response data for cached endpoints (see octofit_tracker/cache.py);
+    # LocMemCache evicts the least recently used entries past MAX_ENTRIES
+    'responses': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'octofit-responses',
+        'TIMEOUT': 300,
+        'OPTIONS': {
+            'MAX_ENTRIES': 1000,
+        },
+    },
+}
+
+OCTOFIT_RESPONSE_CACHE = 'responses'
+
+
 # Password validation
 # https://docs.djangoproject.com/en/4.1/ref/settings/#auth-password-validators
 
@@ -142,6 +175,97 @@ STATIC_URL = 'static/'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Django REST framework
+# Every list endpoint uses keyset pagination (see octofit_tracker/pagination.py)
+
+REST_FRAMEWORK = {
+    'DEFAULT_PAGINATION_CLASS': 'octofit_tracker.pagination.KeysetPagination',
+    'PAGE_SIZE': 100,
+    'DEFAULT_RENDERER_CLASSES': [
+        'octofit_tracker.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+}
+
+# Seconds a worker may hold the leaderboard re-ranking lease before another
+# may take it over (see leaderboard.py), and the longer lease of a full rebuild
+OCTOFIT_RERANK_LEASE_SECONDS = 10
+OCTOFIT_REBUILD_LEASE_SECONDS = 600
+
+# Largest ?limit= of the recent activities and top leaderboard endpoints, and
+# largest row count of a dashboard section
+OCTOFIT_MAX_LIMIT = 100
+
+# Largest JSON array accepted by POST /api/activities/bulk/
+OCTOFIT_BULK_MAX_ACTIVITIES = 1000
+
+# Documents fetched per cursor batch by GET /api/activities/export/
+OCTOFIT_EXPORT_BATCH_SIZE = 1000
+
+# Longest ?window=custom range, in days, accepted by the leaderboard
+OCTOFIT_LEADERBOARD_MAX_WINDOW_DAYS = 31
+
+# Seconds a materialized day, week or month leaderboard is served before the
+# next request rebuilds it from the rollups (see rollups.py)
+OCTOFIT_WINDOW_BOARD_MAX_AGE_SECONDS = 10
+
+# Share of requests that get a Server-Timing breakdown (0 to 1)
+OCTOFIT_PROFILE_SAMPLE_RATE = 1.0 if DEBUG else 0.01
+
+# Sampled requests slower than this are logged with their query shapes
+OCTOFIT_SLOW_REQUEST_MS = 500
+
+# Threads running MongoDB queries for the async endpoints under /api/async/
+OCTOFIT_ASYNC_DB_THREADS = 32
+
+# Threads running the concurrent sections of GET /api/dashboard/
+OCTOFIT_DASHBOARD_THREADS = 16
+
+# Time budget of each dashboard section; slower sections are left out
+OCTOFIT_DASHBOARD_SECTION_TIMEOUT_MS = 500
+
+# Live leaderboard events (see events.py): 'auto' uses a change stream when
+# MongoDB is a replica set and in-process publishing otherwise; or force
+# 'change_stream' or 'local'
+OCTOFIT_EVENTS_SOURCE = 'auto'
+
+# Recent events kept per process; a client further behind gets a reset
+OCTOFIT_EVENTS_BUFFER = 1000
+
+# Idle seconds between keepalive comments on an event stream
+OCTOFIT_EVENTS_KEEPALIVE_SECONDS = 15
+
+# Seconds after which a WSGI event stream ends and the client reconnects
+OCTOFIT_EVENTS_MAX_STREAM_SECONDS = 300
+
+# Write-behind ingest (see ingest.py): POST /api/activities/ queues the
+# activity, answers 202 Accepted and a background thread writes it
+OCTOFIT_WRITE_BEHIND = False
+
+# Activities the write-behind queue holds; beyond that POSTs get a 503
+OCTOFIT_WRITE_BEHIND_QUEUE_SIZE = 10000
+
+# Most activities written per batch
+OCTOFIT_WRITE_BEHIND_BATCH_SIZE = 500
+
+# Longest an activity waits for its batch to fill before it is written
+OCTOFIT_WRITE_BEHIND_FLUSH_MS = 200
+
+# Seconds a process exit waits for queued activities to be written
+OCTOFIT_WRITE_BEHIND_DRAIN_SECONDS = 30
+
+# Seconds the in-memory ranking engine behind /api/leaderboard/distribution/
+# is used before a background rebuild from the leaderboard, if it changed
+# (see ranking.py)
+OCTOFIT_RANKING_MAX_AGE_SECONDS = 30
+
+# Age in days after which archive_activities moves activities to the
+# archive, rounded down to whole months (see archive.py)
+OCTOFIT_ARCHIVE_AFTER_DAYS = 90
+
+# Most activities per compressed archive chunk
+OCTOFIT_ARCHIVE_CHUNK_SIZE = 500
+
 # CORS settings
 CORS_ALLOW_ALL_ORIGINS = True
 CORS_ALLOW_METHODS = [
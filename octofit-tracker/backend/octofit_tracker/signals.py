@@ -0,0 +1,80 @@
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+
+from .cache import bump_version
+from .filter_choices import note_values
+from .ingest import apply_activity_change
+from .leaderboard import move_member, remove_team, sync_team
+from .models import Activity, Leaderboard, Team, User, Workout
+from .repository import activities, users
+
+
+@receiver(pre_save, sender=Activity)
+def remember_stored_activity(sender, instance, **kwargs):
+    """Keep the stored activity so an update can be applied as a delta"""
+    instance._stored = None
+    if not instance._state.adding:
+        instance._stored = activities.get(
+            instance.pk, {'user_id': 1, 'calories': 1, 'duration': 1, 'distance': 1, 'date': 1}
+        )
+
+
+@receiver(post_save, sender=Activity)
+def update_totals_on_save(sender, instance, created, **kwargs):
+    """Apply a created or updated activity to the leaderboard and daily rollups"""
+    apply_activity_change(None if created else getattr(instance, '_stored', None), instance)
+
+
+@receiver(post_delete, sender=Activity)
+def update_totals_on_delete(sender, instance, **kwargs):
+    """Remove a deleted activity from the leaderboard and daily rollups"""
+    apply_activity_change(instance, None)
+
+
+@receiver(pre_save, sender=User)
+def remember_stored_team(sender, instance, **kwargs):
+    """Keep the stored team_id so a team change can move the user's totals"""
+    instance._stored = None
+    if not instance._state.adding:
+        instance._stored = users.get(instance.pk, {'team_id': 1})
+
+
+@receiver(post_save, sender=User)
+def update_team_standings_on_save(sender, instance, created, **kwargs):
+    """Apply a user joining, leaving or switching teams to the team standings"""
+    stored = getattr(instance, '_stored', None)
+    move_member(str(instance.pk), stored.get('team_id') if stored else None, instance.team_id)
+
+
+@receiver(post_delete, sender=User)
+def update_team_standings_on_delete(sender, instance, **kwargs):
+    """Remove a deleted user from their team's standing"""
+    move_member(str(instance.pk), instance.team_id, None)
+
+
+@receiver(post_save, sender=Team)
+def add_team_standing(sender, instance, **kwargs):
+    """Create or rename the team's standing"""
+    sync_team(str(instance.pk), instance.name)
+
+
+@receiver(post_delete, sender=Team)
+def remove_team_standing(sender, instance, **kwargs):
+    """Drop the deleted team's standing"""
+    remove_team(str(instance.pk))
+
+
+@receiver([post_save, post_delete], sender=User)
+@receiver([post_save, post_delete], sender=Team)
+@receiver([post_save, post_delete], sender=Workout)
+@receiver([post_save, post_delete], sender=Leaderboard)
+def invalidate_cached_responses(sender, **kwargs):
+    """Expire cached responses built from the written collection"""
+    bump_version(sender._meta.db_table)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_save, sender=Workout)
+def note_filter_choices(sender, instance, **kwargs):
+    """Add new list filter values of a saved user or workout to the admin's choices"""
+    note_values(sender, [instance])
@@ -0,0 +1,202 @@
+"""
+Activity statistics computed server-side with MongoDB aggregation pipelines.
+
+Each pipeline runs as a single `aggregate` on the activities collection,
+bypassing djongo's SQL translation, and returns one row per group with the
+count, totals and averages of duration, distance and calories.
+
+Archived activities (see archive.py) are only kept as monthly totals per
+user. The per-user, per-team and overall pipelines add those totals for a
+date range that covers whole archived months (archive_scope() is
+'months'). Totals per activity type, and ranges that split an archived
+month, only count the activities still in the hot collection.
+"""
+from datetime import timezone as dt_timezone
+
+from django.utils import timezone
+
+from .archive import archive_horizon, month_of
+from .models import Activity, MonthlySummary, Team, User
+
+# Accumulators shared by every grouping; averages are derived from these
+# so partial groups (e.g. per user within a team) can be re-summed exactly
+SUMS = {
+    'count': {'$sum': 1},
+    'total_duration': {'$sum': '$duration'},
+    'total_distance': {'$sum': '$distance'},
+    'distance_count': {'$sum': {'$cond': [{'$isNumber': '$distance'}, 1, 0]}},
+    'total_calories': {'$sum': '$calories'},
+}
+
+
+def _resum(fields):
+    """Accumulators that add up previously grouped SUMS"""
+    return {field: {'$sum': f'${field}'} for field in fields}
+
+
+def _averages():
+    """Projection computing averages from SUMS (distance only counts activities that have one)"""
+    return {
+        'count': 1,
+        'total_duration': 1,
+        'avg_duration': {'$divide': ['$total_duration', '$count']},
+        'total_distance': 1,
+        'avg_distance': {
+            '$cond': [
+                {'$gt': ['$distance_count', 0]},
+                {'$divide': ['$total_distance', '$distance_count']},
+                None,
+            ]
+        },
+        'total_calories': 1,
+        'avg_calories': {'$divide': ['$total_calories', '$count']},
+    }
+
+
+def date_filter(start=None, end=None):
+    """Condition on `date` for an optional [start, end) range, or None"""
+    date = {}
+    if start is not None:
+        date['$gte'] = start
+    if end is not None:
+        date['$lt'] = end
+    return date or None
+
+
+def _match_dates(start=None, end=None):
+    """Leading $match stage for an optional [start, end) date range"""
+    date = date_filter(start, end)
+    return [{'$match': {'date': date}}] if date else []
+
+
+def _naive_utc(date):
+    if date is not None and timezone.is_aware(date):
+        return date.astimezone(dt_timezone.utc).replace(tzinfo=None)
+    return date
+
+
+def archive_scope(start=None, end=None):
+    """
+    How archived activities relate to the range [start, end): None when
+    the range holds none, 'months' when it covers whole archived months,
+    and 'partial' when it splits one, so their totals cannot be added.
+    """
+    horizon = archive_horizon()
+    start, end = _naive_utc(start), _naive_utc(end)
+    if horizon is None or (start is not None and start >= horizon):
+        return None
+
+    def splits(date):
+        return date is not None and date < horizon and date != month_of(date)
+    return 'partial' if splits(start) or splits(end) else 'months'
+
+
+def _with_archived(start=None, end=None):
+    """
+    Stages that add the monthly summaries of archived activities in
+    [start, end) to rows already grouped by user with SUMS, and re-group
+    them per user. Only exact when archive_scope(start, end) is 'months'.
+    """
+    months = date_filter(start, end)
+    return [
+        {'$unionWith': {
+            'coll': MonthlySummary._meta.db_table,
+            'pipeline': ([{'$match': {'month': months}}] if months else []) + [
+                {'$project': {
+                    '_id': '$user_id',
+                    'count': 1,
+                    'total_duration': '$duration',
+                    'total_distance': '$distance',
+                    'distance_count': {'$ifNull': ['$distance_count', '$count']},
+                    'total_calories': '$calories',
+                }},
+            ],
+        }},
+        {'$group': {'_id': '$_id', **_resum(SUMS)}},
+    ]
+
+
+def _by_user(start=None, end=None, archived=False):
+    """Rows of SUMS per user (as _id), archived months included when `archived`"""
+    pipeline = _match_dates(start, end) + [{'$group': {'_id': '$user_id', **SUMS}}]
+    if archived:
+        pipeline += _with_archived(start, end)
+    return pipeline
+
+
+def _to_object_id(field):
+    """Convert a string reference to an ObjectId, or null when it is not one"""
+    return {'$convert': {'input': field, 'to': 'objectId', 'onError': None, 'onNull': None}}
+
+
+def overall_pipeline(start=None, end=None, archived=False):
+    if archived:
+        pipeline = _by_user(start, end, archived) + [{'$group': {'_id': None, **_resum(SUMS)}}]
+    else:
+        pipeline = _match_dates(start, end) + [{'$group': {'_id': None, **SUMS}}]
+    return pipeline + [{'$project': {'_id': 0, **_averages()}}]
+
+
+def by_user_pipeline(start=None, end=None, limit=None, archived=False):
+    pipeline = _by_user(start, end, archived) + [
+        {'$sort': {'total_calories': -1, '_id': 1}},
+    ]
+    if limit:
+        pipeline.append({'$limit': limit})
+    pipeline.append({'$project': {'_id': 0, 'user_id': '$_id', **_averages()}})
+    return pipeline
+
+
+def by_activity_type_pipeline(start=None, end=None):
+    return _match_dates(start, end) + [
+        {'$group': {'_id': '$activity_type', **SUMS}},
+        {'$sort': {'total_calories': -1, '_id': 1}},
+        {'$project': {'_id': 0, 'activity_type': '$_id', **_averages()}},
+    ]
+
+
+def by_team_pipeline(start=None, end=None, archived=False):
+    """
+    Totals per team, joined through User.team_id.
+
+    Activities are first reduced to one row per user so the join against
+    users runs once per active user rather than once per activity.
+    """
+    return _by_user(start, end, archived) + [
+        {'$lookup': {
+            'from': User._meta.db_table,
+            'let': {'user_oid': _to_object_id('$_id')},
+            'pipeline': [
+                {'$match': {'$expr': {'$eq': ['$_id', '$$user_oid']}}},
+                {'$project': {'_id': 0, 'team_id': 1}},
+            ],
+            'as': 'user',
+        }},
+        {'$group': {
+            '_id': {'$ifNull': [{'$first': '$user.team_id'}, None]},
+            'members': {'$sum': 1},
+            **_resum(SUMS),
+        }},
+        {'$lookup': {
+            'from': Team._meta.db_table,
+            'let': {'team_oid': _to_object_id('$_id')},
+            'pipeline': [
+                {'$match': {'$expr': {'$eq': ['$_id', '$$team_oid']}}},
+                {'$project': {'_id': 0, 'name': 1}},
+            ],
+            'as': 'team',
+        }},
+        {'$sort': {'total_calories': -1, '_id': 1}},
+        {'$project': {
+            '_id': 0,
+            'team_id': '$_id',
+            'team_name': {'$ifNull': [{'$first': '$team.name'}, None]},
+            'members': 1,
+            **_averages(),
+        }},
+    ]
+
+
+def aggregate(pipeline):
+    """Run a pipeline on the activities collection"""
+    return list(Activity.objects.mongo_aggregate(pipeline, allowDiskUse=True))
@@ -1,8 +1,45 @@
-from django.test import TestCase
+from django.test import SimpleTestCase, TestCase
 from rest_framework.test import APITestCase, APIClient
 from rest_framework import status
-from .models import User, Team, Activity, Leaderboard, Workout
-from datetime import datetime
+from .models import (
+    User, Team, Activity, Leaderboard, TeamStanding, DailyRollup, MonthlySummary, ActivityArchive, Workout
+)
+from .pagination import decode_value, encode_value, keyset_q, keyset_query, mongo_sort
+from .stats import archive_scope, by_user_pipeline
+from .rollups import day_of, expire_boards, window_range
+from .views import parse_count, parse_date_param, parse_limit
+from .management.commands.populate_db import Command as PopulateCommand
+from .management.commands.sync_indexes import same_index
+from .management.commands.benchmark import find_regressions, summarize
+from .profiling import query_shape
+from .repository import activities, get_database, object_id
+from .archive import archive_activities, archive_cutoff, chunk_document, decompress
+from .leaderboard import LOCKS_COLLECTION, RERANK_LEASE, _take_lease, rebuild_leaderboard
+from .ingest import WriteBehindQueue, write_behind
+from . import ranking
+from .ranking import RankingEngine
+from .filter_choices import get_choices
+from .dashboard import build_dashboard
+from . import events
+from .events import Broker
+from django.contrib import admin
+from django.contrib.auth.models import User as AuthUser
+from django.core.handlers.asgi import ASGIHandler
+from django.core.management import call_command
+from django.test import override_settings
+from rest_framework.renderers import JSONRenderer
+from .renderers import FastJSONRenderer
+from .serializers import ActivitySerializer, ActivityDocumentSerializer, TeamSerializer, TeamDocumentSerializer
+from io import StringIO
+from unittest import mock
+from bson import ObjectId
+from datetime import datetime, timedelta, timezone
+import asyncio
+import json
+import queue
+import random
+import threading
+import time
 
 
 class TeamModelTest(TestCase):
@@ -176,6 +213,72 @@ class WorkoutAPITest(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
         self.assertEqual(response.data['name'], 'Cardio Blast')
 
+    
+    def test_by_difficulty_ignores_case(self):
+        """Test that difficulty matching is case-insensitive"""
+        response = self.client.get('/api/workouts/by_difficulty/?difficulty=advanced')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([workout['name'] for workout in response.data], ['Super Strength'])
+
+
+class WorkoutSearchTest(APITestCase):
+    """Test workout search and its facet counts"""
+    
+    def setUp(self):
+        self.client = APIClient()
+        call_command('sync_indexes', stdout=StringIO())
+        for name, difficulty, duration, exercise_type in [
+            ('Morning Yoga', 'Beginner', 20, 'Flexibility'),
+            ('Power Yoga', 'Advanced', 45, 'Flexibility'),
+            ('Yoga Strength', 'Intermediate', 30, 'Strength'),
+            ('Hill Sprints', 'Advanced', 25, 'Cardio'),
+        ]:
+            Workout.objects.create(
+                name=name, description='A workout', difficulty_level=difficulty,
+                duration=duration, exercise_type=exercise_type
+            )
+    
+    def test_search_matches_text(self):
+        """Test that only workouts matching the text are returned"""
+        response = self.client.get('/api/workouts/search/?q=yoga')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['count'], 3)
+        self.assertEqual(
+            sorted(workout['name'] for workout in response.data['results']),
+            ['Morning Yoga', 'Power Yoga', 'Yoga Strength']
+        )
+    
+    def test_facets_ignore_their_own_filter(self):
+        """Test that each facet counts with every filter but its own"""
+        response = self.client.get('/api/workouts/search/?q=yoga&difficulty=advanced')
+        self.assertEqual([workout['name'] for workout in response.data['results']], ['Power Yoga'])
+        self.assertEqual(
+            {row['value']: row['count'] for row in response.data['facets']['difficulty']},
+            {'Beginner': 1, 'Advanced': 1, 'Intermediate': 1}
+        )
+        self.assertEqual(response.data['facets']['type'], [{'value': 'Flexibility', 'count': 1}])
+    
+    def test_prefix_search(self):
+        """Test that a name prefix matches case-insensitively, as typed so far"""
+        response = self.client.get('/api/workouts/search/?prefix=yo&type=strength')
+        self.assertEqual([workout['name'] for workout in response.data['results']], ['Yoga Strength'])
+        self.assertEqual(response.data['facets']['type'], [{'value': 'Strength', 'count': 1}])
+        response = self.client.get('/api/workouts/search/?prefix=y&q=yoga')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+    
+    def test_duration_range(self):
+        """Test filtering by a duration range without text"""
+        response = self.client.get('/api/workouts/search/?min_duration=25&max_duration=30')
+        self.assertEqual(
+            [workout['name'] for workout in response.data['results']],
+            ['Hill Sprints', 'Yoga Strength']
+        )
+    
+    def test_invalid_duration(self):
+        """Test that a non-numeric duration is rejected"""
+        response = self.client.get('/api/workouts/search/?min_duration=long')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
 
 class LeaderboardAPITest(APITestCase):
     """Test Leaderboard API endpoints"""
@@ -205,5 +308,1446 @@ class LeaderboardAPITest(APITestCase):
         """Test leaderboard is ordered by rank"""
         response = self.client.get('/api/leaderboard/')
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        if len(response.data) > 0:
-            self.assertEqual(response.data[0]['rank'], 1)
+        if len(response.data['results']) > 0:
+            self.assertEqual(response.data['results'][0]['rank'], 1)
+
+
+class LeaderboardMaintenanceTest(APITestCase):
+    """Test leaderboard updates driven by Activity writes"""
+    
+    def setUp(self):
+        self.client = APIClient()
+        self.first = User.objects.create(name='Flash', email='flash@dc.com')
+        self.second = User.objects.create(name='Batman', email='batman@dc.com')
+    
+    def post_activity(self, user, calories):
+        data = {
+            'user_id': str(user._id),
+            'activity_type': 'Running',
+            'duration': 30,
+            'calories': calories,
+            'date': datetime.now().isoformat()
+        }
+        return self.client.post('/api/activities/', data, format='json')
+    
+    def test_create_activity_updates_totals(self):
+        """Test that posting an activity creates and increments the user's entry"""
+        self.post_activity(self.first, 300)
+        self.post_activity(self.first, 200)
+        entry = Leaderboard.objects.get(user_id=str(self.first._id))
+        self.assertEqual(entry.total_calories, 500)
+        self.assertEqual(entry.total_activities, 2)
+        self.assertEqual(entry.rank, 1)
+    
+    def test_rebuild_command_repairs_totals_and_rollups(self):
+        """Test that rebuild_leaderboard recomputes entries and rollups lost by a partial write"""
+        self.post_activity(self.first, 300)
+        Leaderboard.objects.all().delete()
+        DailyRollup.objects.all().delete()
+        call_command('rebuild_leaderboard', stdout=StringIO())
+        self.assertEqual(Leaderboard.objects.get(user_id=str(self.first._id)).total_calories, 300)
+        self.assertEqual(DailyRollup.objects.get(user_id=str(self.first._id)).calories, 300)
+    
+    def test_overtaking_reranks_entries(self):
+        """Test that a user passing another swaps their ranks"""
+        self.post_activity(self.first, 300)
+        response = self.post_activity(self.second, 200)
+        self.assertEqual(Leaderboard.objects.get(user_id=str(self.second._id)).rank, 2)
+        self.client.patch(f"/api/activities/{response.data['_id']}/", {'calories': 400}, format='json')
+        self.assertEqual(Leaderboard.objects.get(user_id=str(self.second._id)).rank, 1)
+        self.assertEqual(Leaderboard.objects.get(user_id=str(self.first._id)).rank, 2)
+    
+    def test_delete_activity_decrements_totals(self):
+        """Test that deleting an activity removes it from the user's totals"""
+        response = self.post_activity(self.first, 300)
+        self.client.delete(f"/api/activities/{response.data['_id']}/")
+        entry = Leaderboard.objects.get(user_id=str(self.first._id))
+        self.assertEqual(entry.total_calories, 0)
+        self.assertEqual(entry.total_activities, 0)
+    
+    def test_rerank_lease_is_exclusive(self):
+        """Test that a held lease cannot be taken until it is released or expires"""
+        first, second = ObjectId(), ObjectId()
+        self.assertTrue(_take_lease('test', first, 60))
+        self.assertFalse(_take_lease('test', second, 60))
+        get_database()[LOCKS_COLLECTION].update_one({'_id': 'test'}, {'$set': {'expires': datetime(2000, 1, 1)}})
+        self.assertTrue(_take_lease('test', second, 60))
+    
+    def test_rerank_releases_the_lease(self):
+        """Test that writes leave the re-ranking lease free"""
+        self.post_activity(self.first, 300)
+        self.assertIsNone(get_database()[LOCKS_COLLECTION].find_one({'_id': RERANK_LEASE}))
+
+
+class LeaderboardRankTest(APITestCase):
+    """Test the rank and around lookups"""
+    
+    def setUp(self):
+        self.client = APIClient()
+        self.users = [User.objects.create(name=f'Hero {index}', email=f'hero{index}@test.com') for index in range(6)]
+        for index, user in enumerate(self.users):
+            Activity.objects.create(
+                user_id=str(user._id), activity_type='Running', duration=30,
+                calories=100 * (index + 1), date=datetime.now()
+            )
+    
+    def test_rank_matches_top(self):
+        """Test that every user's rank is their position in top"""
+        top = self.client.get('/api/leaderboard/top/?limit=10').data
+        for position, entry in enumerate(top, start=1):
+            response = self.client.get(f"/api/leaderboard/rank/?user_id={entry['user_id']}")
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response.data['rank'], position)
+    
+    def test_around_returns_neighbours(self):
+        """Test that around returns the entries within radius, in rank order"""
+        user_id = str(self.users[3]._id)
+        response = self.client.get(f'/api/leaderboard/around/?user_id={user_id}&radius=1')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([entry['rank'] for entry in response.data], [2, 3, 4])
+        self.assertEqual(response.data[1]['user_id'], user_id)
+    
+    def test_around_is_clipped_at_the_top(self):
+        """Test that the leader's neighbourhood starts at rank 1"""
+        response = self.client.get(f'/api/leaderboard/around/?user_id={self.users[5]._id}&radius=2')
+        self.assertEqual([entry['rank'] for entry in response.data], [1, 2, 3])
+    
+    def test_unknown_user(self):
+        """Test that a user without an entry is a 404 and a missing user_id a 400"""
+        response = self.client.get(f'/api/leaderboard/rank/?user_id={ObjectId()}')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        response = self.client.get('/api/leaderboard/around/')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+    
+    def test_around_unranked_entry(self):
+        """Test that an entry whose re-ranking has not finished is a 404, not an error"""
+        user_id = str(ObjectId())
+        Leaderboard.objects.mongo_insert_one({'user_id': user_id, 'total_calories': 50, 'total_activities': 1})
+        response = self.client.get(f'/api/leaderboard/around/?user_id={user_id}')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class RankingEngineTest(SimpleTestCase):
+    """Test the array-backed ranking engine"""
+    
+    def setUp(self):
+        self.engine = RankingEngine([300, 500, 300, 100, 500, 0])
+    
+    def test_ties_share_a_competition_rank(self):
+        """Test that equal totals get the same tied_rank and are counted as ties"""
+        self.assertEqual([self.engine.tied_rank(calories) for calories in (500, 300, 100, 0)], [1, 3, 5, 6])
+        self.assertEqual(self.engine.tied_rank(1000), 1)
+        self.assertEqual(self.engine.ties(), {'tied_users': 4, 'largest_tie': 2})
+    
+    def test_percentile(self):
+        """Test the share of users below a total"""
+        self.assertAlmostEqual(self.engine.percentile_of(100), 100 / 6)
+        self.assertEqual(self.engine.percentile_of(0), 0.0)
+        self.assertEqual(RankingEngine([]).percentile_of(100), 0.0)
+    
+    def test_distribution(self):
+        """Test percentiles and the histogram"""
+        self.assertEqual(self.engine.percentiles([0, 100]), {0: 0.0, 100: 500.0})
+        histogram = self.engine.histogram(5)
+        self.assertEqual(sum(histogram['counts']), 6)
+        self.assertEqual(histogram['edges'][0], 0.0)
+    
+    def test_from_database_grows_and_widens(self):
+        """Test that totals beyond the estimated count and int32 are all kept"""
+        rows = [{'total_calories': calories} for calories in (5, 2 ** 40, 7)]
+        with mock.patch.object(ranking.leaderboard, 'estimated_count', return_value=1), \
+                mock.patch.object(ranking.leaderboard, 'cursor', return_value=iter(rows)):
+            engine = RankingEngine.from_database()
+        self.assertEqual(engine.calories.tolist(), [5, 7, 2 ** 40])
+    
+    def test_stale_engine_is_rebuilt_in_background(self):
+        """Test that requests keep the current engine while its replacement is built"""
+        old, new = RankingEngine([1]), RankingEngine([1, 2])
+        building = threading.Event()
+        builds = iter([lambda: old, lambda: building.wait(5) and new])
+        versions = iter([[1]])
+        with mock.patch.object(ranking, '_engine', None), mock.patch.object(ranking, '_built', (0.0, None)), \
+                mock.patch.object(RankingEngine, 'from_database', side_effect=lambda: next(builds)()), \
+                mock.patch.object(ranking, 'get_versions', side_effect=lambda tables: next(versions, [2])), \
+                override_settings(OCTOFIT_RANKING_MAX_AGE_SECONDS=0):
+            self.assertIs(ranking.get_engine(), old)
+            self.assertIs(ranking.get_engine(), old)
+            self.assertIs(ranking.get_engine(), old)
+            building.set()
+            for _ in range(500):
+                if not ranking._refreshing:
+                    break
+                time.sleep(0.01)
+            self.assertIs(ranking._engine, new)
+
+
+class DistributionAPITest(APITestCase):
+    """Test the leaderboard distribution endpoint"""
+    
+    def setUp(self):
+        self.client = APIClient()
+        self.users = [User.objects.create(name=f'Hero {index}', email=f'hero{index}@test.com') for index in range(4)]
+        for index, user in enumerate(self.users):
+            Activity.objects.create(
+                user_id=str(user._id), activity_type='Running', duration=30,
+                calories=100 * (index + 1), date=datetime.now()
+            )
+        # Build this test's engine on the first request rather than reuse an earlier test's
+        patcher = mock.patch.object(ranking, '_engine', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+    
+    def test_distribution_agrees_with_leaderboard(self):
+        """Test that the user's entry is the leaderboard's and placed in the distribution"""
+        user_id = str(self.users[1]._id)
+        response = self.client.get(f'/api/leaderboard/distribution/?user_id={user_id}&percentiles=50&bins=4')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['users'], 4)
+        self.assertEqual(response.data['user']['rank'], Leaderboard.objects.get(user_id=user_id).rank)
+        self.assertEqual(response.data['user']['tied_rank'], 3)
+        self.assertEqual(response.data['user']['percentile'], 25.0)
+        self.assertEqual(response.data['percentiles'], {'50': 250.0})
+        self.assertEqual(sum(response.data['histogram']['counts']), 4)
+    
+    def test_invalid_parameters(self):
+        """Test that out of range percentiles are rejected"""
+        response = self.client.get('/api/leaderboard/distribution/?percentiles=150')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class TeamStandingTest(APITestCase):
+    """Test team standings driven by Activity, User and Team writes"""
+    
+    def setUp(self):
+        self.client = APIClient()
+        self.marvel = Team.objects.create(name='Team Marvel', description='Marvel superheroes')
+        self.dc = Team.objects.create(name='Team DC', description='DC superheroes')
+        self.hulk = User.objects.create(name='Hulk', email='hulk@marvel.com', team_id=str(self.marvel._id))
+        self.thor = User.objects.create(name='Thor', email='thor@marvel.com', team_id=str(self.marvel._id))
+        self.flash = User.objects.create(name='Flash', email='flash@dc.com', team_id=str(self.dc._id))
+    
+    def add_activity(self, user, calories):
+        return Activity.objects.create(
+            user_id=str(user._id),
+            activity_type='Running',
+            duration=30,
+            calories=calories,
+            date=datetime.now()
+        )
+    
+    def standing(self, team):
+        return TeamStanding.objects.get(team_id=str(team._id))
+    
+    def test_activities_update_team_totals(self):
+        """Test that activities add to their owner's team and rank it"""
+        self.add_activity(self.hulk, 300)
+        self.add_activity(self.thor, 100)
+        self.add_activity(self.flash, 350)
+        marvel = self.standing(self.marvel)
+        self.assertEqual(marvel.members, 2)
+        self.assertEqual(marvel.total_calories, 400)
+        self.assertEqual(marvel.total_activities, 2)
+        self.assertEqual(marvel.avg_calories_per_member, 200.0)
+        self.assertEqual(marvel.rank, 1)
+        self.assertEqual(self.standing(self.dc).rank, 2)
+    
+    def test_changing_team_moves_totals(self):
+        """Test that switching teams moves the user's totals and re-ranks"""
+        self.add_activity(self.hulk, 300)
+        self.add_activity(self.flash, 200)
+        self.hulk.team_id = str(self.dc._id)
+        self.hulk.save()
+        self.assertEqual(self.standing(self.marvel).members, 1)
+        self.assertEqual(self.standing(self.marvel).total_calories, 0)
+        self.assertEqual(self.standing(self.dc).members, 2)
+        self.assertEqual(self.standing(self.dc).total_calories, 500)
+        self.assertEqual(self.standing(self.dc).rank, 1)
+    
+    def test_deleting_team_closes_ranks(self):
+        """Test that deleting a team removes its standing and shifts the rest up"""
+        self.add_activity(self.hulk, 300)
+        self.marvel.delete()
+        self.assertFalse(TeamStanding.objects.filter(team_id=str(self.marvel._id)).exists())
+        self.assertEqual(self.standing(self.dc).rank, 1)
+    
+    def test_list_endpoint(self):
+        """Test retrieving team standings in rank order"""
+        self.add_activity(self.flash, 500)
+        response = self.client.get('/api/team_standings/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([row['team_name'] for row in response.data['results']], ['Team DC', 'Team Marvel'])
+
+
+class LeaderboardWindowTest(SimpleTestCase):
+    """Test the day ranges of leaderboard windows"""
+    
+    now = datetime(2024, 5, 15, 18, 30, tzinfo=timezone.utc)
+    
+    def test_calendar_windows(self):
+        """Test that day, week and month cover the current calendar period"""
+        self.assertEqual(window_range('day', now=self.now), (datetime(2024, 5, 15), datetime(2024, 5, 16)))
+        self.assertEqual(window_range('week', now=self.now), (datetime(2024, 5, 13), datetime(2024, 5, 20)))
+        self.assertEqual(window_range('month', now=self.now), (datetime(2024, 5, 1), datetime(2024, 6, 1)))
+    
+    def test_custom_window_covers_whole_days(self):
+        """Test that a custom window widens to whole UTC days"""
+        start = datetime(2024, 5, 1, 9, tzinfo=timezone.utc)
+        end = datetime(2024, 5, 3, 12, tzinfo=timezone.utc)
+        self.assertEqual(window_range('custom', start, end), (datetime(2024, 5, 1), datetime(2024, 5, 4)))
+        self.assertEqual(day_of(end), datetime(2024, 5, 3))
+    
+    @override_settings(OCTOFIT_LEADERBOARD_MAX_WINDOW_DAYS=31)
+    def test_invalid_windows(self):
+        """Test that unknown and overlong windows are rejected"""
+        with self.assertRaises(ValueError):
+            window_range('year', now=self.now)
+        with self.assertRaises(ValueError):
+            window_range('custom', datetime(2024, 1, 1), datetime(2024, 3, 1))
+
+
+class WindowedLeaderboardAPITest(APITestCase):
+    """Test windowed leaderboards backed by daily rollups"""
+    
+    def setUp(self):
+        self.client = APIClient()
+        self.first = User.objects.create(name='Flash', email='flash@dc.com')
+        self.second = User.objects.create(name='Batman', email='batman@dc.com')
+        now = datetime.now(timezone.utc)
+        # Batman leads all-time with an old activity, Flash leads today
+        self.add_activity(self.second, 1000, now - timedelta(days=60))
+        self.add_activity(self.second, 100, now)
+        self.add_activity(self.first, 200, now)
+        self.add_activity(self.first, 150, now)
+        # Builds of earlier tests may still be current
+        expire_boards()
+    
+    def add_activity(self, user, calories, date):
+        return Activity.objects.create(
+            user_id=str(user._id),
+            activity_type='Running',
+            duration=30,
+            distance=5.0,
+            calories=calories,
+            date=date
+        )
+    
+    def test_cached_day_window_rolls_over(self):
+        """Test that a cached day board is not served once the day is over"""
+        today = self.client.get('/api/leaderboard/top/?window=day')
+        tomorrow = datetime.now(timezone.utc) + timedelta(days=1)
+        with mock.patch('octofit_tracker.rollups.timezone.now', return_value=tomorrow):
+            response = self.client.get('/api/leaderboard/top/?window=day', HTTP_IF_NONE_MATCH=today['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], today['ETag'])
+        self.assertEqual(response.data, [])
+    
+    def test_rollups_follow_activity_writes(self):
+        """Test that activities on the same day share one rollup"""
+        rollup = DailyRollup.objects.get(user_id=str(self.first._id))
+        self.assertEqual(rollup.calories, 350)
+        self.assertEqual(rollup.count, 2)
+        self.assertEqual(rollup.distance, 10.0)
+    
+    def test_day_window_ranks_by_rollups(self):
+        """Test that the day window only counts today's activities"""
+        response = self.client.get('/api/leaderboard/top/?window=day')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [(row['user_id'], row['total_calories'], row['rank']) for row in response.data],
+            [(str(self.first._id), 350, 1), (str(self.second._id), 100, 2)]
+        )
+    
+    def test_day_board_is_materialized(self):
+        """Test that the day board is served from its build until it expires"""
+        self.client.get('/api/leaderboard/?window=day')
+        self.add_activity(self.second, 1000, datetime.now(timezone.utc))
+        response = self.client.get('/api/leaderboard/?window=day')
+        self.assertEqual(response.data['results'][0]['user_id'], str(self.first._id))
+        expire_boards()
+        response = self.client.get('/api/leaderboard/?window=day')
+        self.assertEqual(response.data['results'][0]['user_id'], str(self.second._id))
+    
+    def test_custom_window_is_aggregated(self):
+        """Test that a custom window ranks by the rollups directly"""
+        today = datetime.now(timezone.utc).date().isoformat()
+        response = self.client.get(f'/api/leaderboard/top/?window=custom&start={today}&end={today}')
+        self.assertEqual([row['total_calories'] for row in response.data], [350, 100])
+    
+    def test_windowed_list_is_paginated(self):
+        """Test that a windowed list pages by rank"""
+        response = self.client.get('/api/leaderboard/?window=week&page_size=1')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['results'][0]['rank'], 1)
+        response = self.client.get(response.data['next'])
+        self.assertEqual(response.data['results'][0]['rank'], 2)
+    
+    def test_invalid_window(self):
+        """Test that an unknown window is rejected"""
+        response = self.client.get('/api/leaderboard/top/?window=decade')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class KeysetCursorTest(SimpleTestCase):
+    """Test keyset cursor helpers"""
+    
+    def test_cursor_values_round_trip(self):
+        """Test that ObjectId and datetime sort values survive encoding"""
+        oid = ObjectId()
+        date = datetime(2024, 5, 1, 7, 30, tzinfo=timezone.utc)
+        for value in (oid, date, 42, 'Running'):
+            self.assertEqual(decode_value(encode_value(value)), value)
+    
+    def test_keyset_filter_is_lexicographic(self):
+        """Test the filter for a descending two-field ordering"""
+        condition = keyset_q(('-date', '-_id'), ['d', 'i'])
+        self.assertEqual(str(condition), "(OR: ('date__lt', 'd'), (AND: ('date', 'd'), ('_id__lt', 'i')))")
+    
+    def test_mongo_keyset_filter_matches_ordering(self):
+        """Test the raw MongoDB filter and sort for the same ordering"""
+        self.assertEqual(keyset_query(('-date', '-_id'), ['d', 'i']), {
+            '$or': [{'date': {'$lt': 'd'}}, {'date': 'd', '_id': {'$lt': 'i'}}]
+        })
+        self.assertEqual(mongo_sort(('rank', '-_id')), [('rank', 1), ('_id', -1)])
+
+
+class ActivityPaginationTest(APITestCase):
+    """Test keyset pagination of activity lists"""
+    
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create(name='Hulk', email='hulk@marvel.com')
+        start = datetime.now()
+        for day in range(5):
+            Activity.objects.create(
+                user_id=str(self.user._id),
+                activity_type='Boxing',
+                duration=30,
+                calories=300,
+                date=start - timedelta(days=day)
+            )
+    
+    def test_pages_follow_next_cursor(self):
+        """Test that following next links walks every activity once, newest first"""
+        url = '/api/activities/?page_size=2'
+        seen = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertLessEqual(len(response.data['results']), 2)
+            seen.extend(response.data['results'])
+            url = response.data['next']
+        self.assertEqual(len(seen), 5)
+        dates = [activity['date'] for activity in seen]
+        self.assertEqual(dates, sorted(dates, reverse=True))
+    
+    def test_by_user_is_paginated(self):
+        """Test that by_user returns a cursor page"""
+        response = self.client.get(f'/api/activities/by_user/?user_id={self.user._id}&page_size=3')
+        self.assertEqual(len(response.data['results']), 3)
+        self.assertIsNotNone(response.data['next'])
+        previous = self.client.get(self.client.get(response.data['next']).data['previous'])
+        self.assertEqual(previous.data['results'], response.data['results'])
+    
+    def test_invalid_cursor(self):
+        """Test that a malformed cursor is rejected"""
+        response = self.client.get('/api/activities/?cursor=not-a-cursor')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class ActivityArchiveTest(APITestCase):
+    """Test archiving old activities into compressed chunks and monthly summaries"""
+    
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create(name='Thor', email='thor@marvel.com')
+        now = datetime.now(timezone.utc)
+        # Two months of old activities and three recent ones
+        dates = [now - timedelta(days=days) for days in (400, 401, 430, 1, 2, 3)]
+        for index, date in enumerate(dates):
+            Activity.objects.create(
+                user_id=str(self.user._id),
+                activity_type='Running',
+                duration=30,
+                calories=100 * (index + 1),
+                date=date
+            )
+        self.entry = Leaderboard.objects.get(user_id=str(self.user._id))
+    
+    def test_archive_moves_old_activities(self):
+        """Test that only activities before the cutoff leave the hot collection"""
+        call_command('archive_activities', days=180, stdout=StringIO())
+        self.assertEqual(Activity.objects.count(), 3)
+        self.assertEqual(sum(chunk.count for chunk in ActivityArchive.objects.all()), 3)
+        self.assertEqual(sum(summary.calories for summary in MonthlySummary.objects.all()), 600)
+    
+    def test_archive_is_idempotent(self):
+        """Test that a second run archives nothing and keeps the summaries"""
+        call_command('archive_activities', days=180, stdout=StringIO())
+        self.assertEqual(archive_activities(archive_cutoff(180)), (0, 0))
+        self.assertEqual(sum(summary.count for summary in MonthlySummary.objects.all()), 3)
+    
+    def test_rerun_after_interruption_counts_once(self):
+        """Test that re-archiving a month with copies left in the hot tier and a backdated activity stays exact"""
+        call_command('archive_activities', days=180, stdout=StringIO())
+        chunk = ActivityArchive.objects.mongo_find_one({})
+        copy = decompress(chunk['data'])[0]
+        # As left by a run interrupted before deleting, plus a new activity in the same month
+        activities.insert_many([copy, {**copy, '_id': ObjectId(), 'calories': 50}])
+        call_command('archive_activities', days=180, stdout=StringIO())
+        self.assertEqual(Activity.objects.count(), 3)
+        self.assertEqual(sum(chunk.count for chunk in ActivityArchive.objects.all()), 4)
+        self.assertEqual(sum(summary.count for summary in MonthlySummary.objects.all()), 4)
+        self.assertEqual(sum(summary.calories for summary in MonthlySummary.objects.all()), 650)
+    
+    def test_leaderboard_totals_stay_exact(self):
+        """Test that archiving and then rebuilding keeps the user's totals"""
+        call_command('archive_activities', days=180, stdout=StringIO())
+        rebuild_leaderboard()
+        entry = Leaderboard.objects.get(user_id=str(self.user._id))
+        self.assertEqual(entry.total_calories, self.entry.total_calories)
+        self.assertEqual(entry.total_activities, 6)
+    
+    def test_by_user_reads_both_tiers(self):
+        """Test that by_user pages through hot and archived activities, newest first"""
+        call_command('archive_activities', days=180, stdout=StringIO())
+        url = f'/api/activities/by_user/?user_id={self.user._id}&page_size=2'
+        seen = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            seen.extend(response.data['results'])
+            url = response.data['next']
+        self.assertEqual([activity['calories'] for activity in seen], [400, 500, 600, 100, 200, 300])
+        previous = self.client.get(response.data['previous'])
+        self.assertEqual([activity['calories'] for activity in previous.data['results']], [600, 100])
+    
+    def test_full_hot_page_skips_the_archive(self):
+        """Test that a by_user page filled by newer hot activities decompresses no chunk"""
+        call_command('archive_activities', days=180, stdout=StringIO())
+        with mock.patch('octofit_tracker.archive.decompress', wraps=decompress) as decompressed:
+            response = self.client.get(f'/api/activities/by_user/?user_id={self.user._id}&page_size=3')
+        self.assertEqual([activity['calories'] for activity in response.data['results']], [400, 500, 600])
+        decompressed.assert_not_called()
+    
+    def test_export_includes_archived_activities(self):
+        """Test that the export streams archived activities after the hot ones"""
+        call_command('archive_activities', days=180, stdout=StringIO())
+        response = self.client.get(f'/api/activities/export/?format=ndjson&user_id={self.user._id}')
+        self.assertEqual(response['X-Archived-Activities'], 'included')
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual([row['calories'] for row in rows], [400, 500, 600, 100, 200, 300])
+    
+    def test_stats_include_archived_months(self):
+        """Test that per-user stats over whole months match the leaderboard after archiving"""
+        call_command('archive_activities', days=180, stdout=StringIO())
+        response = self.client.get('/api/stats/by_user/')
+        self.assertEqual(response['X-Archived-Activities'], 'included')
+        self.assertEqual(response.data[0]['total_calories'], self.entry.total_calories)
+        self.assertEqual(response.data[0]['count'], 6)
+        response = self.client.get('/api/stats/by_activity_type/')
+        self.assertEqual(response['X-Archived-Activities'], 'excluded')
+        self.assertEqual(response.data[0]['count'], 3)
+    
+    def test_chunks_round_trip(self):
+        """Test that a chunk decompresses to the activities it was built from"""
+        documents = activities.find({}, ordering=('-date', '-_id'))[3:]
+        chunk = chunk_document(documents)
+        self.assertEqual(decompress(chunk['data']), documents)
+        self.assertEqual(chunk['calories'], 600)
+
+
+class StatsPipelineTest(SimpleTestCase):
+    """Test stats query parsing and pipeline construction"""
+    
+    def test_end_date_includes_whole_day(self):
+        """Test that a bare end date covers that day"""
+        self.assertEqual(parse_date_param('2024-05-01', end=True), datetime(2024, 5, 2, tzinfo=timezone.utc))
+        self.assertEqual(parse_date_param('2024-05-01'), datetime(2024, 5, 1, tzinfo=timezone.utc))
+        self.assertIsNone(parse_date_param(None))
+        with self.assertRaises(ValueError):
+            parse_date_param('yesterday')
+    
+    def test_count_param(self):
+        """Test that counts must be integers from 1 to the maximum"""
+        self.assertEqual(parse_count(None, 10, 100), 10)
+        self.assertEqual(parse_count('100', 10, 100), 100)
+        for value in ('0', '-1', '101', 'ten'):
+            with self.assertRaises(ValueError):
+                parse_count(value, 10, 100)
+    
+    @override_settings(OCTOFIT_MAX_LIMIT=100)
+    def test_limit_param(self):
+        """Test that limits are clamped to 1..OCTOFIT_MAX_LIMIT and must be integers"""
+        self.assertEqual(parse_limit(None), 10)
+        self.assertEqual(parse_limit('0'), 1)
+        self.assertEqual(parse_limit('-5'), 1)
+        self.assertEqual(parse_limit('1000'), 100)
+        with self.assertRaises(ValueError):
+            parse_limit('ten')
+    
+    @mock.patch('octofit_tracker.stats.archive_horizon', return_value=datetime(2024, 5, 1))
+    def test_archive_scope(self, horizon):
+        """Test that only ranges splitting an archived month are partial"""
+        self.assertEqual(archive_scope(), 'months')
+        self.assertEqual(archive_scope(datetime(2024, 3, 1, tzinfo=timezone.utc)), 'months')
+        self.assertEqual(archive_scope(end=datetime(2024, 4, 15, tzinfo=timezone.utc)), 'partial')
+        self.assertEqual(archive_scope(datetime(2024, 3, 2, tzinfo=timezone.utc)), 'partial')
+        self.assertEqual(archive_scope(end=datetime(2024, 5, 20, tzinfo=timezone.utc)), 'months')
+        self.assertIsNone(archive_scope(datetime(2024, 5, 2, tzinfo=timezone.utc)))
+        horizon.return_value = None
+        self.assertIsNone(archive_scope())
+    
+    def test_archived_months_are_unioned(self):
+        """Test that archived summaries are added to the per-user totals"""
+        pipeline = by_user_pipeline(archived=True)
+        self.assertEqual(pipeline[1]['$unionWith']['coll'], MonthlySummary._meta.db_table)
+        self.assertNotIn('$unionWith', str(by_user_pipeline()))
+    
+    def test_date_range_is_first_stage(self):
+        """Test that the date filter runs before grouping"""
+        start = datetime(2024, 5, 1, tzinfo=timezone.utc)
+        pipeline = by_user_pipeline(start=start, limit=5)
+        self.assertEqual(pipeline[0], {'$match': {'date': {'$gte': start}}})
+        self.assertIn({'$limit': 5}, pipeline)
+
+
+class PopulateGeneratorTest(SimpleTestCase):
+    """Test the synthetic data generator used by populate_db"""
+    
+    def generate(self, seed):
+        rng = random.Random(seed)
+        now = datetime(2024, 5, 1, tzinfo=timezone.utc)
+        command = PopulateCommand()
+        users = list(command.generate_users(rng, 20, ['marvel', 'dc'], now))
+        activities = [
+            activity
+            for user in users
+            for activity in command.generate_activities(rng, str(user['_id']), 10, 30, now)
+        ]
+        return users, activities
+    
+    def test_same_seed_reproduces_data(self):
+        """Test that a seed yields identical documents, ids included"""
+        self.assertEqual(self.generate(7), self.generate(7))
+        self.assertNotEqual(self.generate(7), self.generate(8))
+    
+    def test_generated_users(self):
+        """Test that the superheroes come first and recruits get unique emails"""
+        users, activities = self.generate(1)
+        self.assertEqual(users[0]['name'], 'Iron Man')
+        self.assertEqual(users[8]['team_id'], 'dc')
+        self.assertEqual(len({user['email'] for user in users}), 20)
+        self.assertTrue(all(5 <= activity['duration'] for activity in activities))
+    
+    def test_no_activities(self):
+        """Test that an average of zero activities generates none"""
+        now = datetime(2024, 5, 1, tzinfo=timezone.utc)
+        activities = PopulateCommand().generate_activities(random.Random(1), str(ObjectId()), 0, 30, now)
+        self.assertEqual(list(activities), [])
+
+
+class StatsAPITest(APITestCase):
+    """Test aggregation stats endpoints"""
+    
+    def setUp(self):
+        self.client = APIClient()
+        self.team = Team.objects.create(name='Avengers', description='Test')
+        self.user = User.objects.create(name='Thor', email='thor@marvel.com', team_id=str(self.team._id))
+        for activity_type, calories, distance in [('Running', 300, 5.0), ('Running', 500, None), ('Yoga', 100, None)]:
+            Activity.objects.create(
+                user_id=str(self.user._id),
+                activity_type=activity_type,
+                duration=40,
+                distance=distance,
+                calories=calories,
+                date=datetime.now()
+            )
+    
+    def test_stats_by_activity_type(self):
+        """Test totals and averages per activity type"""
+        response = self.client.get('/api/stats/by_activity_type/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        running = response.data[0]
+        self.assertEqual(running['activity_type'], 'Running')
+        self.assertEqual(running['count'], 2)
+        self.assertEqual(running['total_calories'], 800)
+        self.assertEqual(running['avg_calories'], 400)
+        self.assertEqual(running['avg_distance'], 5.0)
+    
+    def test_stats_by_team(self):
+        """Test totals per team joined through the user's team_id"""
+        response = self.client.get('/api/stats/by_team/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data[0]['team_id'], str(self.team._id))
+        self.assertEqual(response.data[0]['team_name'], 'Avengers')
+        self.assertEqual(response.data[0]['total_calories'], 900)
+    
+    def test_stats_date_filter(self):
+        """Test that a date range outside the activities returns nothing"""
+        response = self.client.get('/api/stats/by_user/?end=2000-01-01')
+        self.assertEqual(response.data, [])
+        response = self.client.get('/api/stats/?start=not-a-date')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+    
+    def test_stats_by_user_limit(self):
+        """Test that an invalid ?limit= is rejected"""
+        for limit in ('0', 'all'):
+            response = self.client.get(f'/api/stats/by_user/?limit={limit}')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class ActivityBulkAPITest(APITestCase):
+    """Test bulk activity ingestion"""
+    
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create(name='Aquaman', email='arthur.curry@dc.com')
+    
+    def activity(self, **overrides):
+        data = {
+            'user_id': str(self.user._id),
+            'activity_type': 'Swimming',
+            'duration': 60,
+            'distance': 2.5,
+            'calories': 500,
+            'date': datetime.now().isoformat()
+        }
+        data.update(overrides)
+        return data
+    
+    def test_bulk_create(self):
+        """Test that a whole batch is inserted and counted on the leaderboard"""
+        response = self.client.post('/api/activities/bulk/', [self.activity(), self.activity(calories=250)], format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['created'], 2)
+        self.assertEqual(Activity.objects.filter(user_id=str(self.user._id)).count(), 2)
+        entry = Leaderboard.objects.get(user_id=str(self.user._id))
+        self.assertEqual(entry.total_calories, 750)
+        self.assertEqual(entry.total_activities, 2)
+    
+    def test_bulk_partial_failure(self):
+        """Test that invalid items are reported per index while valid ones are written"""
+        batch = [self.activity(), self.activity(calories='lots'), self.activity()]
+        response = self.client.post('/api/activities/bulk/', batch, format='json')
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        self.assertEqual([result['status'] for result in response.data['results']], ['created', 'invalid', 'created'])
+        self.assertIn('calories', response.data['results'][1]['errors'])
+        self.assertEqual(Activity.objects.filter(user_id=str(self.user._id)).count(), 2)
+    
+    def test_bulk_requires_array(self):
+        """Test that a single object is rejected"""
+        response = self.client.post('/api/activities/bulk/', self.activity(), format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class WriteBehindQueueTest(SimpleTestCase):
+    """Test batching, backpressure and draining of the write-behind queue"""
+    
+    def setUp(self):
+        self.batches = []
+    
+    def make_queue(self, size=100, batch_size=3, flush_ms=50):
+        def write(batch):
+            self.batches.append([document['_id'] for document in batch])
+            return {}
+        return WriteBehindQueue(size, batch_size, flush_ms, write=write)
+    
+    def test_batches_by_size(self):
+        """Test that a full batch is written without waiting for the interval"""
+        write_behind = self.make_queue(flush_ms=10000)
+        for index in range(3):
+            write_behind.put({'_id': index})
+        write_behind.join()
+        self.assertEqual(self.batches, [[0, 1, 2]])
+    
+    def test_batches_by_time(self):
+        """Test that a partial batch is written once the interval passes"""
+        write_behind = self.make_queue(batch_size=100)
+        write_behind.put({'_id': 0})
+        write_behind.put({'_id': 1})
+        write_behind.join()
+        self.assertEqual(self.batches, [[0, 1]])
+        self.assertEqual(write_behind.pending, 0)
+    
+    def test_full_queue_rejects(self):
+        """Test that puts beyond the queue size are rejected"""
+        release = threading.Event()
+        write_behind = WriteBehindQueue(1, 1, 10, write=lambda batch: release.wait(5) and {})
+        write_behind.put({'_id': 0})
+        while write_behind._queue.qsize():
+            time.sleep(0.01)
+        write_behind.put({'_id': 1})
+        with self.assertRaises(queue.Full):
+            write_behind.put({'_id': 2})
+        release.set()
+        self.assertTrue(write_behind.drain(5))
+    
+    def test_drain_writes_everything(self):
+        """Test that draining writes every queued document and then refuses new ones"""
+        write_behind = self.make_queue(flush_ms=10000)
+        for index in range(5):
+            write_behind.put({'_id': index})
+        self.assertTrue(write_behind.drain(5))
+        self.assertEqual(sum(self.batches, []), [0, 1, 2, 3, 4])
+        with self.assertRaises(queue.Full):
+            write_behind.put({'_id': 5})
+
+
+@override_settings(OCTOFIT_WRITE_BEHIND=True)
+class WriteBehindAPITest(APITestCase):
+    """Test activity creation through the write-behind queue"""
+    
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create(name='Cyborg', email='victor.stone@dc.com')
+    
+    def post_activity(self, calories):
+        data = {
+            'user_id': str(self.user._id),
+            'activity_type': 'Running',
+            'duration': 30,
+            'calories': calories,
+            'date': datetime.now().isoformat()
+        }
+        return self.client.post('/api/activities/', data, format='json')
+    
+    def test_create_is_accepted_then_written(self):
+        """Test that a queued activity is answered with 202 and later written and counted"""
+        response = self.post_activity(300)
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.post_activity(200)
+        write_behind.join()
+        self.assertTrue(Activity.objects.filter(_id=ObjectId(response.data['_id'])).exists())
+        entry = Leaderboard.objects.get(user_id=str(self.user._id))
+        self.assertEqual(entry.total_calories, 500)
+        self.assertEqual(entry.total_activities, 2)
+    
+    def test_full_queue_returns_503(self):
+        """Test that a full queue sheds load with 503 and Retry-After"""
+        with mock.patch.object(write_behind, 'put', side_effect=queue.Full):
+            response = self.post_activity(300)
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertIn('Retry-After', response)
+
+
+class AdminSearchTest(SimpleTestCase):
+    """Test the performance mode admin's indexable search"""
+    
+    def test_search_uses_prefix_and_exact_lookups(self):
+        """Test ^ fields match by case-sensitive prefix and = fields exactly"""
+        user_admin = admin.site._registry[User]
+        queryset, may_have_duplicates = user_admin.get_search_results(None, User.objects.all(), ' Bru ')
+        lookups = [(child.lhs.target.name, child.lookup_name) for child in queryset.query.where.children[0].children]
+        self.assertEqual(lookups, [('name', 'startswith'), ('email', 'startswith')])
+        self.assertFalse(may_have_duplicates)
+        activity_admin = admin.site._registry[Activity]
+        queryset, _ = activity_admin.get_search_results(None, Activity.objects.all(), 'abc')
+        lookup = queryset.query.where.children[0]
+        self.assertEqual((lookup.lhs.target.name, lookup.lookup_name, lookup.rhs), ('user_id', 'exact', 'abc'))
+
+
+class AdminPerformanceTest(TestCase):
+    """Test cursor paging and precomputed filter choices in the admin"""
+    
+    def setUp(self):
+        self.client.force_login(AuthUser.objects.create_superuser('admin', 'admin@octofit.dev', 'password'))
+        activity_admin = admin.site._registry[Activity]
+        self.addCleanup(setattr, activity_admin, 'list_per_page', activity_admin.list_per_page)
+        activity_admin.list_per_page = 2
+        for day, activity_type in enumerate(['Running', 'Cycling', 'Running']):
+            Activity.objects.create(
+                user_id='user',
+                activity_type=activity_type,
+                duration=30,
+                calories=300,
+                date=datetime(2024, 5, 1 + day)
+            )
+    
+    def test_changelist_pages_by_cursor(self):
+        """Test the changelist follows next links without counting"""
+        response = self.client.get('/admin/octofit_tracker/activity/')
+        self.assertEqual(response.status_code, 200)
+        changelist = response.context['cl']
+        self.assertEqual(len(changelist.result_list), 2)
+        self.assertIsNone(changelist.full_result_count)
+        response = self.client.get(changelist.next_link)
+        self.assertEqual(len(response.context['cl'].result_list), 1)
+        self.assertIsNone(response.context['cl'].next_link)
+    
+    def test_filter_choices_are_precomputed(self):
+        """Test list filter choices come from the stored distinct values"""
+        self.assertEqual(get_choices(Activity, 'activity_type'), ['Cycling', 'Running'])
+        response = self.client.get('/admin/octofit_tracker/activity/?activity_type=Cycling')
+        self.assertEqual(len(response.context['cl'].result_list), 1)
+
+
+class IndexSyncTest(TestCase):
+    """Test the sync_indexes management command"""
+    
+    def test_sync_creates_declared_indexes(self):
+        """Test that declared indexes are created and a second run changes nothing"""
+        call_command('sync_indexes', stdout=StringIO())
+        self.assertIn('user_id_1_date_-1__id_-1', Activity.objects.mongo_index_information())
+        output = StringIO()
+        call_command('sync_indexes', stdout=output)
+        self.assertNotIn('missing', output.getvalue())
+        self.assertNotIn('changed', output.getvalue())
+    
+    def test_same_index_compares_options(self):
+        """Test that uniqueness and collation are part of an index's identity"""
+        declared = User.mongo_indexes[0].document
+        self.assertTrue(same_index(declared, {'key': [('email', 1)], 'unique': True}))
+        self.assertFalse(same_index(declared, {'key': [('email', 1)]}))
+        declared = Workout.mongo_indexes[0].document
+        self.assertFalse(same_index(declared, {'key': [('difficulty_level', 1)]}))
+    
+    def test_same_index_compares_text_weights(self):
+        """Test that a text index is compared by its fields and weights"""
+        declared = next(index.document for index in Workout.mongo_indexes if index.document['name'] == 'workout_text')
+        existing = {
+            'key': [('_fts', 'text'), ('_ftsx', 1)],
+            'weights': {'name': 10, 'exercise_type': 5, 'description': 1},
+        }
+        self.assertTrue(same_index(declared, existing))
+        existing['weights'] = {'name': 1, 'exercise_type': 1, 'description': 1}
+        self.assertFalse(same_index(declared, existing))
+
+
+class ResponseCacheTest(APITestCase):
+    """Test cached responses, ETags and write invalidation"""
+    
+    def setUp(self):
+        self.client = APIClient()
+        Team.objects.create(name='Justice League', description='Test')
+    
+    def test_unchanged_data_returns_not_modified(self):
+        """Test that a matching If-None-Match gets a 304"""
+        response = self.client.get('/api/teams/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        etag = response['ETag']
+        response = self.client.get('/api/teams/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+    
+    def test_write_invalidates_cached_response(self):
+        """Test that creating a team changes the ETag and the cached list"""
+        first = self.client.get('/api/teams/')
+        self.client.post('/api/teams/', {'name': 'Avengers', 'description': 'Test'}, format='json')
+        second = self.client.get('/api/teams/', HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(second.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(second['ETag'], first['ETag'])
+        self.assertEqual(len(second.data['results']), len(first.data['results']) + 1)
+
+
+class DocumentSerializerTest(SimpleTestCase):
+    """Test that the document read path matches the model serializers byte for byte"""
+    
+    def test_activity_output_matches_model_serializer(self):
+        """Test an activity rendered from a raw document against the ModelSerializer"""
+        date = datetime(2024, 5, 1, 7, 30, 15, 123000, tzinfo=timezone.utc)
+        activity = Activity(
+            _id=ObjectId(),
+            user_id='64a1f0c2e4b0a1b2c3d4e5f6',
+            activity_type='Running',
+            duration=42,
+            distance=7.25,
+            calories=480,
+            date=date,
+            created_at=date
+        )
+        # pymongo hands back naive UTC datetimes
+        document = {
+            '_id': activity._id,
+            'user_id': activity.user_id,
+            'activity_type': 'Running',
+            'duration': 42,
+            'distance': 7.25,
+            'calories': 480,
+            'date': date.replace(tzinfo=None),
+            'created_at': date.replace(tzinfo=None),
+        }
+        expected = JSONRenderer().render(ActivitySerializer([activity], many=True).data)
+        rendered = FastJSONRenderer().render(ActivityDocumentSerializer([document], many=True).data)
+        self.assertEqual(rendered, expected)
+    
+    def test_renderer_matches_stdlib_output(self):
+        """Test awkward values render exactly like JSONRenderer"""
+        data = {'tiny': 1e-7, 'huge': 1e16, 'plain': 0.5, 'text': 'line\u2028break é', 'nested': [1, None, True]}
+        self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+
+
+class SparseFieldsTest(SimpleTestCase):
+    """Test that ?fields= trims serializer output"""
+    
+    def test_serializers_output_requested_fields(self):
+        """Test both team serializers drop fields that were not requested"""
+        team = Team(_id=ObjectId(), name='Team DC', description='Justice League Defenders')
+        document = {'_id': team._id, 'name': 'Team DC'}
+        context = {'fields': ('name', '_id')}
+        self.assertEqual(list(TeamSerializer(team, context=context).data), ['_id', 'name'])
+        self.assertEqual(TeamDocumentSerializer(document, context=context).data, {'_id': str(team._id), 'name': 'Team DC'})
+        self.assertEqual(len(TeamSerializer(team).data), 4)
+
+
+class SparseFieldsAPITest(APITestCase):
+    """Test ?fields= on the API"""
+    
+    def setUp(self):
+        self.client = APIClient()
+        Team.objects.create(name='Team Marvel', description='Marvel superheroes')
+    
+    def test_list_returns_requested_fields(self):
+        """Test that a list only returns the requested fields"""
+        response = self.client.get('/api/teams/?fields=_id,name')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(set(response.data['results'][0]), {'_id', 'name'})
+    
+    def test_unknown_field_is_rejected(self):
+        """Test that an unknown field name is a 400"""
+        response = self.client.get('/api/teams/?fields=name,secret')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class ExpandAPITest(APITestCase):
+    """Test ?expand= embedding of related users and teams"""
+    
+    def setUp(self):
+        self.client = APIClient()
+        self.team = Team.objects.create(name='Team Marvel', description='Marvel superheroes')
+        self.user = User.objects.create(name='Hulk', email='hulk@marvel.com', team_id=str(self.team._id))
+        Activity.objects.create(
+            user_id=str(self.user._id),
+            activity_type='Boxing',
+            duration=30,
+            calories=300,
+            date=datetime.now()
+        )
+    
+    def test_leaderboard_embeds_user_and_team(self):
+        """Test that leaderboard rows embed their user and the user's team"""
+        response = self.client.get('/api/leaderboard/?expand=user,team')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        row = response.data['results'][0]
+        self.assertEqual(row['user']['name'], 'Hulk')
+        self.assertEqual(row['team']['name'], 'Team Marvel')
+    
+    def test_users_embed_team(self):
+        """Test that user rows embed their team, with sparse fields"""
+        response = self.client.get('/api/users/?expand=team&fields=name')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['results'][0], {
+            'name': 'Hulk',
+            'team': {
+                '_id': str(self.team._id),
+                'name': 'Team Marvel',
+                'description': 'Marvel superheroes',
+                'created_at': response.data['results'][0]['team']['created_at'],
+            },
+        })
+    
+    def test_unknown_expansion_is_rejected(self):
+        """Test that users cannot expand a user"""
+        response = self.client.get('/api/users/?expand=user')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class ActivityExportTest(APITestCase):
+    """Test streaming activity exports"""
+    
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create(name='Cyborg', email='victor.stone@dc.com')
+        for calories in (100, 200, 300):
+            Activity.objects.create(
+                user_id=str(self.user._id),
+                activity_type='Cycling',
+                duration=30,
+                distance=12.5,
+                calories=calories,
+                date=datetime.now()
+            )
+    
+    def test_export_ndjson(self):
+        """Test that NDJSON streams one activity per line"""
+        response = self.client.get(f'/api/activities/export/?format=ndjson&user_id={self.user._id}')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        lines = b''.join(response.streaming_content).splitlines()
+        self.assertEqual(len(lines), 3)
+        self.assertEqual(json.loads(lines[0])['user_id'], str(self.user._id))
+    
+    def test_export_csv(self):
+        """Test that CSV starts with a header row"""
+        response = self.client.get('/api/activities/export/?format=csv')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        rows = b''.join(response.streaming_content).decode('utf-8').splitlines()
+        self.assertEqual(rows[0], '_id,user_id,activity_type,duration,distance,calories,date,created_at')
+        self.assertEqual(len(rows), 4)
+    
+    def test_export_rejects_bad_dates(self):
+        """Test that a malformed date is a 400"""
+        response = self.client.get('/api/activities/export/?format=csv&start=soon')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class AsyncReadPathTest(APITestCase):
+    """Test that the async read endpoints match the synchronous ones"""
+    
+    def setUp(self):
+        self.client = APIClient()
+        team = Team.objects.create(name='Team Marvel', description='Marvel superheroes')
+        self.user = User.objects.create(name='Thor', email='thor@marvel.com', team_id=str(team._id))
+        self.team_id = str(team._id)
+        start = datetime(2024, 5, 1, 7, 30)
+        for day in range(3):
+            Activity.objects.create(
+                user_id=str(self.user._id),
+                activity_type='Running',
+                duration=30,
+                distance=5.0,
+                calories=300,
+                date=start + timedelta(days=day)
+            )
+    
+    def test_responses_are_identical(self):
+        """Test each async endpoint returns the same bytes as its sync counterpart"""
+        user_id = str(self.user._id)
+        for sync_url, async_url in [
+            ('/api/activities/recent/?limit=2', '/api/async/activities/recent/?limit=2'),
+            (f'/api/activities/by_user/?user_id={user_id}&page_size=2',
+             f'/api/async/activities/by_user/?user_id={user_id}&page_size=2'),
+            ('/api/leaderboard/top/?limit=5', '/api/async/leaderboard/top/?limit=5'),
+            ('/api/activities/recent/?limit=0', '/api/async/activities/recent/?limit=0'),
+            ('/api/leaderboard/top/?limit=ten', '/api/async/leaderboard/top/?limit=ten'),
+            (f'/api/users/by_team/?team_id={self.team_id}', f'/api/async/users/by_team/?team_id={self.team_id}'),
+        ]:
+            sync_response = self.client.get(sync_url, HTTP_ACCEPT='application/json')
+            async_response = self.client.get(async_url)
+            self.assertEqual(async_response.status_code, sync_response.status_code)
+            self.assertEqual(
+                async_response.content.replace(b'/api/async/', b'/api/'), sync_response.content
+            )
+    
+    def test_missing_parameter(self):
+        """Test the async by_user endpoint requires user_id"""
+        response = self.client.get('/api/async/activities/by_user/')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class RepositoryTest(APITestCase):
+    """Test that repository reads and writes match the ORM"""
+    
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create(name='Hulk', email='bruce.banner@marvel.com')
+        self.activity = Activity.objects.create(
+            user_id=str(self.user._id),
+            activity_type='Strength',
+            duration=40,
+            distance=None,
+            calories=500,
+            date=datetime(2024, 5, 1, 7, 30)
+        )
+    
+    def test_documents_match_orm_values(self):
+        """Test repository documents hold the same values as ORM .values() rows"""
+        fields = ActivityDocumentSerializer.field_names
+        orm_rows = list(Activity.objects.values(*fields).order_by('-date', '-_id'))
+        documents = activities.find({}, {name: 1 for name in fields}, ('-date', '-_id'))
+        self.assertEqual(
+            ActivityDocumentSerializer(documents, many=True).data,
+            ActivityDocumentSerializer(orm_rows, many=True).data
+        )
+        self.assertEqual(activities.get(str(self.activity._id))['calories'], 500)
+    
+    def test_retrieve_matches_model_serializer(self):
+        """Test a single activity read from the repository renders like the ORM instance"""
+        response = self.client.get(f'/api/activities/{self.activity._id}/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, ActivitySerializer(Activity.objects.get(_id=self.activity._id)).data)
+    
+    def test_retrieve_unknown_id(self):
+        """Test missing and malformed ids return 404"""
+        self.assertEqual(self.client.get(f'/api/activities/{ObjectId()}/').status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.client.get('/api/activities/not-an-id/').status_code, status.HTTP_404_NOT_FOUND)
+    
+    def test_update_moves_totals(self):
+        """Test a repository update is stored and applied to the leaderboard and rollups"""
+        response = self.client.patch(f'/api/activities/{self.activity._id}/', {'calories': 650}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['calories'], 650)
+        self.assertEqual(Activity.objects.get(_id=self.activity._id).activity_type, 'Strength')
+        self.assertEqual(Leaderboard.objects.get(user_id=str(self.user._id)).total_calories, 650)
+        self.assertEqual(DailyRollup.objects.get(user_id=str(self.user._id)).calories, 650)
+    
+    def test_invalid_object_ids(self):
+        """Test object_id accepts ObjectIds and their strings only"""
+        value = ObjectId()
+        self.assertEqual(object_id(value), value)
+        self.assertEqual(object_id(str(value)), value)
+        self.assertIsNone(object_id('not-an-id'))
+        self.assertIsNone(object_id(None))
+
+
+class DashboardTest(SimpleTestCase):
+    """Test concurrent dashboard sections and their time budgets"""
+    
+    def test_sections_run_concurrently(self):
+        """Test the dashboard takes about as long as its slowest section"""
+        def section(limit, budget_ms):
+            time.sleep(0.2)
+            return list(range(limit))
+        sections = {name: (section, name, 1) for name in ('a', 'b', 'c')}
+        started = time.perf_counter()
+        data, errors = build_dashboard({'a': 1, 'b': 2, 'c': 3}, budget_ms=2000, sections=sections)
+        self.assertLess(time.perf_counter() - started, 0.5)
+        self.assertEqual(data, {'a': [0], 'b': [0, 1], 'c': [0, 1, 2]})
+        self.assertEqual(errors, {})
+    
+    def test_partial_results(self):
+        """Test slow and failing sections are reported while the others are returned"""
+        def fast(limit, budget_ms):
+            return 'ok'
+        
+        def slow(limit, budget_ms):
+            time.sleep(1)
+        
+        def broken(limit, budget_ms):
+            raise ValueError('boom')
+        sections = {'fast': (fast, 'f', 1), 'slow': (slow, 's', 1), 'broken': (broken, 'b', 1)}
+        with self.assertLogs('octofit_tracker.dashboard', 'ERROR'):
+            data, errors = build_dashboard({'fast': 1, 'slow': 1, 'broken': 1}, budget_ms=100, sections=sections)
+        self.assertEqual(data, {'fast': 'ok'})
+        self.assertEqual(errors, {'slow': 'timed out', 'broken': 'failed'})
+    
+    def test_unknown_section(self):
+        """Test unknown section names are rejected"""
+        response = self.client.get('/api/dashboard/?sections=leaderboard,nope')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class DashboardAPITest(APITestCase):
+    """Test the composite dashboard endpoint"""
+    
+    def setUp(self):
+        self.client = APIClient()
+        user = User.objects.create(name='Wonder Woman', email='diana.prince@dc.com')
+        for day in range(3):
+            Activity.objects.create(
+                user_id=str(user._id),
+                activity_type='Running',
+                duration=30,
+                calories=300,
+                date=datetime(2024, 5, 1 + day)
+            )
+        Workout.objects.create(name='Lasso Drills', description='Agility', difficulty_level='Medium',
+                               duration=20, exercise_type='Agility')
+    
+    def test_dashboard_sections(self):
+        """Test each section matches its own endpoint"""
+        response = self.client.get('/api/dashboard/?top=5&recent=2')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['errors'], {})
+        self.assertEqual(response.data['leaderboard'], self.client.get('/api/leaderboard/top/?limit=5').data)
+        self.assertEqual(response.data['recent_activities'], self.client.get('/api/activities/recent/?limit=2').data)
+        self.assertEqual(len(response.data['workouts']), 1)
+    
+    def test_selected_sections(self):
+        """Test ?sections= limits the response to the named sections"""
+        response = self.client.get('/api/dashboard/?sections=teams')
+        self.assertEqual(set(response.data), {'teams', 'errors'})
+    
+    def test_invalid_counts(self):
+        """Test that section counts outside 1..OCTOFIT_MAX_LIMIT are rejected"""
+        for query in ('recent=0', 'top=-1', 'workouts=0', 'teams=many', 'top=100000'):
+            response = self.client.get(f'/api/dashboard/?{query}')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class EventBrokerTest(SimpleTestCase):
+    """Test the live leaderboard event fan-out"""
+    
+    def test_subscribers_read_from_shared_buffer(self):
+        """Test every subscriber reads the same encoded frames from its own position"""
+        broker = Broker(10)
+        for rank in (1, 2, 3):
+            broker.publish('entry', {'user_id': 'u', 'rank': rank})
+        self.assertEqual(len(broker.read(0)[0]), 3)
+        events, lagged = broker.read(2)
+        self.assertFalse(lagged)
+        self.assertEqual(
+            events, [(3, f'id: {broker.epoch}-3\nevent: entry\ndata: {{"user_id":"u","rank":3}}\n\n'.encode())]
+        )
+        self.assertEqual(broker.read(3), ([], False))
+    
+    def test_slow_consumer_is_reset(self):
+        """Test a subscriber more than a buffer behind gets a reset instead of the lost events"""
+        with mock.patch.object(events, 'broker', Broker(2)):
+            for rank in range(5):
+                events.broker.publish('entry', {'rank': rank})
+            frames, after = events.pending_frames(1)
+            self.assertEqual(after, 5)
+            self.assertIn(b'event: reset', frames[0])
+            self.assertEqual(events.pending_frames(after), ([], 5))
+    
+    def test_last_event_id_from_another_process(self):
+        """Test ids from another process or run are treated as missed events"""
+        self.assertEqual(events.parse_last_event_id(f'{events.broker.epoch}-0'), 0)
+        self.assertEqual(events.parse_last_event_id('0000-1'), -1)
+        self.assertEqual(events.parse_last_event_id(None), events.broker.last_id)
+    
+    def test_async_subscribers_wake_on_publish(self):
+        """Test one publish from another thread wakes every waiting coroutine"""
+        broker = Broker(10)
+        
+        async def subscribers():
+            waits = [asyncio.ensure_future(broker.wait_async(0, 5)) for _ in range(1000)]
+            await asyncio.sleep(0)
+            threading.Thread(target=broker.publish, args=('reset', {})).start()
+            return await asyncio.gather(*waits)
+        
+        self.assertTrue(all(asyncio.run(subscribers())))
+        self.assertFalse(asyncio.run(broker.wait_async(1, 0.01)))
+    
+    @override_settings(OCTOFIT_EVENTS_KEEPALIVE_SECONDS=0.05)
+    def test_asgi_stream(self):
+        """Test the ASGI endpoint streams published events until the client disconnects"""
+        sent = []
+        
+        async def client():
+            disconnect = asyncio.Event()
+            
+            async def receive():
+                if not sent:
+                    return {'type': 'http.request', 'body': b'', 'more_body': False}
+                await disconnect.wait()
+                return {'type': 'http.disconnect'}
+            
+            async def send(message):
+                sent.append(message)
+                if len(sent) == 2:
+                    events.broker.publish('entry', {'rank': 1})
+                elif b'event: entry' in message.get('body', b''):
+                    disconnect.set()
+            
+            scope = {'type': 'http', 'method': 'GET', 'headers': [(b'origin', b'http://localhost:3000')]}
+            await asyncio.wait_for(events.asgi_stream(scope, receive, send), 5)
+        
+        with mock.patch.object(events, 'broker', Broker(10)), mock.patch.object(events, '_source', 'local'):
+            asyncio.run(client())
+        self.assertEqual(sent[0]['status'], 200)
+        self.assertIn((b'content-type', b'text/event-stream'), sent[0]['headers'])
+        self.assertIn((b'access-control-allow-origin', b'*'), sent[0]['headers'])
+        self.assertTrue(any(b'data: {"rank":1}' in message.get('body', b'') for message in sent))
+
+
+    def test_asgi_stream_preflight(self):
+        """Test the ASGI endpoint answers CORS preflight requests itself"""
+        sent = []
+        
+        async def send(message):
+            sent.append(message)
+        
+        scope = {'type': 'http', 'method': 'OPTIONS', 'headers': [(b'origin', b'http://localhost:3000')]}
+        asyncio.run(events.asgi_stream(scope, None, send))
+        headers = dict(sent[0]['headers'])
+        self.assertEqual(headers[b'access-control-allow-origin'], b'*')
+        self.assertIn(b'last-event-id', headers[b'access-control-allow-headers'])
+    
+    def test_change_stream_source_stores_one_document_per_write(self):
+        """Test that with a change stream the events of a write are stored together"""
+        collection = mock.Mock()
+        with mock.patch.object(events, '_source', 'change_stream'), \
+                mock.patch.object(events, 'events_collection', return_value=collection):
+            events.publish(('shift', {'from_rank': 1, 'to_rank': None, 'by': 1}), ('entry', {'rank': 1}))
+        collection.insert_one.assert_called_once_with({'events': [
+            {'kind': 'shift', 'data': {'from_rank': 1, 'to_rank': None, 'by': 1}},
+            {'kind': 'entry', 'data': {'rank': 1}},
+        ]})
+
+
+class LeaderboardEventsTest(APITestCase):
+    """Test that leaderboard writes publish events in-process"""
+    
+    def test_activity_publishes_entry(self):
+        """Test a new activity publishes the user's entry and the shift of those it passed"""
+        first = User.objects.create(name='Flash', email='flash@dc.com')
+        second = User.objects.create(name='Batman', email='batman@dc.com')
+        with mock.patch.object(events, '_source', 'local'):
+            for user, calories in ((first, 100), (second, 200)):
+                Activity.objects.create(
+                    user_id=str(user._id), activity_type='Running', duration=30, calories=calories,
+                    date=datetime(2024, 5, 1)
+                )
+            frames, _ = events.pending_frames(events.broker.last_id - 2)
+        self.assertIn(b'event: shift\ndata: {"from_rank":1,"to_rank":null,"by":1}', frames[0])
+        self.assertIn(f'"user_id":"{second._id}","total_calories":200,"total_activities":1,"rank":1'.encode(), frames[1])
+
+
+class BenchmarkReportTest(SimpleTestCase):
+    """Test benchmark summaries and baseline comparison"""
+    
+    def test_summarize_percentiles(self):
+        """Test throughput and percentiles over successful requests only"""
+        samples = [(200, index / 1000) for index in range(1, 101)] + [(500, 1.0)]
+        summary = summarize(samples, elapsed=2.0)
+        self.assertEqual(summary['requests'], 101)
+        self.assertEqual(summary['errors'], 1)
+        self.assertEqual(summary['throughput'], 50.0)
+        self.assertEqual((summary['p50_ms'], summary['p95_ms'], summary['p99_ms']), (51.0, 96.0, 100.0))
+    
+    def test_regressions_beyond_threshold(self):
+        """Test that only slowdowns beyond the threshold are reported"""
+        baseline = {'read': {
+            'GET teams list': {'errors': 0, 'throughput': 100.0, 'p95_ms': 10.0},
+            'GET users list': {'errors': 0, 'throughput': 100.0, 'p95_ms': 10.0},
+        }}
+        results = {'read': {
+            'GET teams list': {'errors': 0, 'throughput': 90.0, 'p95_ms': 11.0},
+            'GET users list': {'errors': 0, 'throughput': 70.0, 'p95_ms': 15.0},
+            'GET stats list': {'errors': 0, 'throughput': 1.0, 'p95_ms': 900.0},
+        }}
+        regressions = find_regressions(results, baseline, threshold=0.2)
+        self.assertEqual(len(regressions), 2)
+        self.assertTrue(all(regression.startswith('read GET users list') for regression in regressions))
+
+
+class ProfilingTest(SimpleTestCase):
+    """Test the per-request performance breakdown"""
+    
+    def test_query_shape_elides_values(self):
+        """Test that query shapes keep field names and operators but not values"""
+        shape = query_shape('find', {
+            'find': 'activities',
+            'filter': {'user_id': 'abc', 'date': {'$lt': datetime(2024, 5, 1)}},
+            'sort': {'date': -1},
+        })
+        self.assertEqual(json.loads(shape), [
+            'find', 'activities', {'filter': {'date': {'$lt': '?'}, 'user_id': '?'}, 'sort': ['date']}
+        ])
+    
+    @override_settings(OCTOFIT_PROFILE_SAMPLE_RATE=1.0)
+    def test_server_timing_header(self):
+        """Test that sampled responses carry a Server-Timing breakdown"""
+        response = self.client.get('/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        for metric in ('db;', 'sql;', 'serialize;', 'render;', 'total;'):
+            self.assertIn(metric, response['Server-Timing'])
+    
+    def test_middleware_keeps_asgi_chain_async(self):
+        """Test that under ASGI the middleware chain is not wrapped to run on a thread"""
+        handler = ASGIHandler()
+        handler.load_middleware(is_async=True)
+        self.assertTrue(asyncio.iscoroutinefunction(handler._middleware_chain))
+    
+    @override_settings(OCTOFIT_PROFILE_SAMPLE_RATE=1.0)
+    def test_server_timing_header_under_asgi(self):
+        """Test that async requests are profiled too"""
+        response = asyncio.run(self.async_client.get('/'))
+        self.assertIn('total;', response['Server-Timing'])
+    
+    @override_settings(OCTOFIT_PROFILE_SAMPLE_RATE=0.0)
+    def test_unsampled_requests_are_untouched(self):
+        """Test that requests outside the sample get no header"""
+        response = self.client.get('/')
+        self.assertNotIn('Server-Timing', response)
+
@@ -20,12 +20,16 @@ from rest_framework.decorators import api_view
 from rest_framework.response import Response
 from rest_framework.reverse import reverse
 import os
+from . import async_views
 from .views import (
     UserViewSet,
     TeamViewSet,
     ActivityViewSet,
     LeaderboardViewSet,
-    WorkoutViewSet
+    TeamStandingViewSet,
+    WorkoutViewSet,
+    StatsViewSet,
+    DashboardViewSet
 )
 
 
@@ -43,7 +47,10 @@ def api_root(request, format=None):
         'teams': f'{base_url}/api/teams/',
         'activities': f'{base_url}/api/activities/',
         'leaderboard': f'{base_url}/api/leaderboard/',
+        'team_standings': f'{base_url}/api/team_standings/',
         'workouts': f'{base_url}/api/workouts/',
+        'stats': f'{base_url}/api/stats/',
+        'dashboard': f'{base_url}/api/dashboard/',
     })
 
 
@@ -53,10 +60,18 @@ router.register(r'users', UserViewSet, basename='user')
 router.register(r'teams', TeamViewSet, basename='team')
 router.register(r'activities', ActivityViewSet, basename='activity')
 router.register(r'leaderboard', LeaderboardViewSet, basename='leaderboard')
+router.register(r'team_standings', TeamStandingViewSet, basename='team-standing')
 router.register(r'workouts', WorkoutViewSet, basename='workout')
+router.register(r'stats', StatsViewSet, basename='stats')
+router.register(r'dashboard', DashboardViewSet, basename='dashboard')
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('', api_root, name='api-root'),
     path('api/', include(router.urls)),
+    # Async read endpoints, for the ASGI application (see async_views.py)
+    path('api/async/activities/recent/', async_views.recent_activities, name='async-activity-recent'),
+    path('api/async/activities/by_user/', async_views.activities_by_user, name='async-activity-by-user'),
+    path('api/async/leaderboard/top/', async_views.leaderboard_top, name='async-leaderboard-top'),
+    path('api/async/users/by_team/', async_views.users_by_team, name='async-user-by-team'),
 ]
@@ -1,107 +1,789 @@
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound, ValidationError
 from rest_framework.response import Response
-from .models import User, Team, Activity, Leaderboard, Workout
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from datetime import datetime, time, timedelta
+from queue import Full
+from . import dashboard, events, ranking, rollups, stats
+from .archive import find_across_tiers, iter_across_tiers
+from .cache import cache_response
+from .exports import iter_csv, iter_ndjson
+from .ingest import activity_document, apply_activity_change, insert_activities, write_behind
+from .pagination import keyset_query, mongo_sort
+from .search import FACETS, search_workouts
+from .renderers import CSVRenderer, EventStreamRenderer, NDJSONRenderer
+from .repository import Repository
+from .models import CASE_INSENSITIVE, User, Team, Activity, Leaderboard, TeamStanding, DailyRollup, Workout
 from .serializers import (
+    expand_choices,
+    expand_rows,
     UserSerializer,
     TeamSerializer,
     ActivitySerializer,
     LeaderboardSerializer,
-    WorkoutSerializer
+    TeamStandingSerializer,
+    WorkoutSerializer,
+    UserDocumentSerializer,
+    TeamDocumentSerializer,
+    ActivityDocumentSerializer,
+    LeaderboardDocumentSerializer,
+    TeamStandingDocumentSerializer,
+    WorkoutDocumentSerializer
 )
 
 
-class UserViewSet(viewsets.ModelViewSet):
+def parse_fields(request, param='fields'):
+    """Names listed as ?fields=a,b (or another `param`), or None when not given"""
+    value = request.query_params.get(param, None)
+    if not value:
+        return None
+    return tuple(dict.fromkeys(name.strip() for name in value.split(',') if name.strip())) or None
+
+
+def trim_fields(rows, fields):
+    """Keep only `fields` of each row dict (all of them when fields is None)"""
+    if fields is None:
+        return rows
+    return [{name: row[name] for name in fields if name in row} for row in rows]
+
+
+class DocumentReadMixin:
+    """
+    Serve read-only list actions from projected documents.
+
+    For GET requests to `document_actions`, `get_queryset` returns `.values()`
+    rows holding only the serialized fields, and `document_serializer_class`
+    formats them without instantiating models. Writes and single-object
+    reads keep the regular ModelSerializer.
+
+    GET requests may name the fields to return with ?fields=; only those
+    (plus the fields pages are ordered by) are loaded from MongoDB. Lists
+    may embed related documents with ?expand=user,team.
+    """
+    document_serializer_class = None
+    document_actions = ('list',)
+
+    def is_document_read(self):
+        request = getattr(self, 'request', None)
+        return request is not None and request.method == 'GET' and self.action in self.document_actions
+
+    def get_field_choices(self):
+        """Field names ?fields= may list"""
+        return self.serializer_class.Meta.fields
+
+    def get_requested_fields(self):
+        """Fields named with ?fields= on a GET, or None for all; unknown names are rejected"""
+        if not hasattr(self, '_requested_fields'):
+            request = getattr(self, 'request', None)
+            fields = parse_fields(request) if request is not None and request.method == 'GET' else None
+            if fields is not None:
+                choices = self.get_field_choices()
+                unknown = [name for name in fields if name not in choices]
+                if unknown:
+                    raise ValidationError({'fields': [f'Unknown field: {name}' for name in unknown]})
+            self._requested_fields = fields
+        return self._requested_fields
+
+    def get_requested_expand(self):
+        """Relations named with ?expand= on a GET; unknown names are rejected"""
+        if not hasattr(self, '_requested_expand'):
+            request = getattr(self, 'request', None)
+            expand = parse_fields(request, 'expand') if request is not None and request.method == 'GET' else None
+            if expand is not None:
+                choices = expand_choices(self.serializer_class)
+                unknown = [name for name in expand if name not in choices]
+                if unknown:
+                    raise ValidationError({'expand': [f'Cannot expand: {name}' for name in unknown]})
+            self._requested_expand = expand or ()
+        return self._requested_expand
+
+    def get_read_fields(self):
+        """Fields to load: the requested ones plus those the ordering pages by and expansions read"""
+        names = self.document_serializer_class.field_names
+        fields = self.get_requested_fields()
+        if fields is None:
+            return names
+        needed = [field.lstrip('-') for field in getattr(self, 'ordering', None) or ('_id',)]
+        if self.get_requested_expand():
+            meta = self.serializer_class.Meta
+            needed += [getattr(meta, 'expand_user_field', None), getattr(meta, 'expand_team_field', None)]
+        return tuple(name for name in names if name in fields or name in needed)
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['fields'] = self.get_requested_fields()
+        context['expand'] = self.get_requested_expand()
+        return context
+
+    def get_serializer_class(self):
+        if self.is_document_read():
+            return self.document_serializer_class
+        return super().get_serializer_class()
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.is_document_read():
+            queryset = queryset.values(*self.get_read_fields())
+        elif self.get_requested_fields() is not None:
+            queryset = queryset.only(*self.get_read_fields())
+        return queryset
+
+    def get_projection(self):
+        """MongoDB projection of the fields to load, for raw pymongo reads"""
+        return {name: 1 for name in self.get_read_fields()}
+
+
+class RepositoryReadMixin(DocumentReadMixin):
+    """
+    Serve document reads straight from a Repository instead of the ORM.
+
+    `list`, `retrieve` and the actions that call `document_response` query
+    the shared MongoClient with the same filter, ordering, projection and
+    keyset pagination the ORM would use, so the output is identical.
+    """
+    repository = None
+    document_actions = ('list', 'retrieve')
+
+    def get_document(self, projection=None):
+        """The document named by the URL; 404 if there is none"""
+        document = self.repository.get(self.kwargs[self.lookup_url_kwarg or self.lookup_field], projection)
+        if document is None:
+            raise NotFound()
+        return document
+
+    def document_response(self, query, ordering=None, find=None):
+        """
+        Paginate the documents matching `query` the way paginate_queryset
+        pages a queryset. `find` replaces the repository's find().
+        """
+        ordering = tuple(ordering or getattr(self, 'ordering', None) or ('_id',))
+        projection = self.get_projection()
+        find = find or self.repository.find
+        page = self.paginator.start_page(self.request, ordering) if self.paginator else None
+        if page is None:
+            serializer = self.get_serializer(find(query, projection, ordering), many=True)
+            return Response(serializer.data)
+        ordering, position = page
+        documents = find(query, projection, ordering, position, self.paginator.page_size + 1)
+        serializer = self.get_serializer(self.paginator.finish_page(documents), many=True)
+        return self.paginator.get_paginated_response(serializer.data)
+
+    def list(self, request, *args, **kwargs):
+        return self.document_response({})
+
+    def retrieve(self, request, *args, **kwargs):
+        return Response(self.get_serializer(self.get_document(self.get_projection())).data)
+
+
+class UserViewSet(RepositoryReadMixin, viewsets.ModelViewSet):
     """
     API endpoint that allows users to be viewed or edited.
     """
     queryset = User.objects.all()
     serializer_class = UserSerializer
+    document_serializer_class = UserDocumentSerializer
+    document_actions = ('list', 'retrieve', 'by_team')
+    repository = Repository(User)
 
     @action(detail=False, methods=['get'])
     def by_team(self, request):
         """Get users by team_id"""
         team_id = request.query_params.get('team_id', None)
         if team_id:
-            users = User.objects.filter(team_id=team_id)
-            serializer = self.get_serializer(users, many=True)
-            return Response(serializer.data)
+            return self.document_response({'team_id': team_id}, ('_id',))
         return Response({'error': 'team_id parameter is required'}, status=status.HTTP_400_BAD_REQUEST)
 
 
-class TeamViewSet(viewsets.ModelViewSet):
+class TeamViewSet(DocumentReadMixin, viewsets.ModelViewSet):
     """
     API endpoint that allows teams to be viewed or edited.
     """
     queryset = Team.objects.all()
     serializer_class = TeamSerializer
+    document_serializer_class = TeamDocumentSerializer
 
+    @cache_response(Team)
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
 
-class ActivityViewSet(viewsets.ModelViewSet):
+
+class ActivityViewSet(RepositoryReadMixin, viewsets.ModelViewSet):
     """
     API endpoint that allows activities to be viewed or edited.
+
+    Writes go through the repository too: the stored document is written
+    with one pymongo call and the change applied to the leaderboard and
+    daily rollups, as the model signals do for ORM writes. With
+    OCTOFIT_WRITE_BEHIND on, creates are queued and answered with 202
+    Accepted instead (see ingest.py).
     """
     queryset = Activity.objects.all()
     serializer_class = ActivitySerializer
+    document_serializer_class = ActivityDocumentSerializer
+    document_actions = ('list', 'retrieve', 'by_user', 'recent', 'export')
+    ordering = ('-date', '-_id')
+    repository = Repository(Activity)
+
+    def document_data(self, document):
+        return self.document_serializer_class(document, context=self.get_serializer_context()).data
+
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        if settings.OCTOFIT_WRITE_BEHIND:
+            return self.create_behind(activity_document(serializer.validated_data))
+        document = self.repository.insert_one(activity_document(serializer.validated_data))
+        apply_activity_change(None, document)
+        data = self.document_data(document)
+        return Response(data, status=status.HTTP_201_CREATED, headers=self.get_success_headers(data))
+
+    def create_behind(self, document):
+        """Queue the activity for the write-behind flusher and answer 202, or 503 when the queue is full"""
+        try:
+            write_behind.put(document)
+        except Full:
+            return Response(
+                {'error': 'Too many activities are waiting to be written; retry shortly'},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                headers={'Retry-After': str(max(round(write_behind.interval), 1))}
+            )
+        data = self.document_data(document)
+        return Response(data, status=status.HTTP_202_ACCEPTED, headers=self.get_success_headers(data))
+
+    def update(self, request, *args, **kwargs):
+        stored = self.get_document()
+        serializer = self.get_serializer(data=request.data, partial=kwargs.pop('partial', False))
+        serializer.is_valid(raise_exception=True)
+        document = {**stored, **serializer.validated_data}
+        self.repository.replace(document)
+        apply_activity_change(stored, document)
+        return Response(self.document_data(document))
+
+    def destroy(self, request, *args, **kwargs):
+        document = self.repository.delete(self.kwargs[self.lookup_url_kwarg or self.lookup_field])
+        if document is None:
+            raise NotFound()
+        apply_activity_change(document, None)
+        return Response(status=status.HTTP_204_NO_CONTENT)
 
     @action(detail=False, methods=['get'])
     def by_user(self, request):
-        """Get activities by user_id"""
+        """Get activities by user_id, archived ones included"""
         user_id = request.query_params.get('user_id', None)
         if user_id:
-            activities = Activity.objects.filter(user_id=user_id).order_by('-date')
-            serializer = self.get_serializer(activities, many=True)
-            return Response(serializer.data)
+            return self.document_response({'user_id': user_id}, find=find_across_tiers)
         return Response({'error': 'user_id parameter is required'}, status=status.HTTP_400_BAD_REQUEST)
 
+    @action(detail=False, methods=['post'])
+    def bulk(self, request):
+        """Create activities from a JSON array with one bulk insert"""
+        if not isinstance(request.data, list):
+            return Response({'error': 'Expected a JSON array of activities'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(request.data) > settings.OCTOFIT_BULK_MAX_ACTIVITIES:
+            return Response(
+                {'error': f'At most {settings.OCTOFIT_BULK_MAX_ACTIVITIES} activities per request'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        serializer = self.get_serializer(data=request.data, many=True)
+        if serializer.is_valid():
+            item_errors = [{}] * len(request.data)
+            valid_data = serializer.validated_data
+        else:
+            # The list serializer rejects the whole batch on any error, so
+            # re-validate just the items that passed to get their data
+            item_errors = serializer.errors
+            valid_items = [item for item, errors in zip(request.data, item_errors) if not errors]
+            valid_serializer = self.get_serializer(data=valid_items, many=True)
+            valid_serializer.is_valid(raise_exception=True)
+            valid_data = valid_serializer.validated_data
+
+        documents = [activity_document(data) for data in valid_data]
+        failed = insert_activities(documents)
+
+        results = []
+        written = iter(enumerate(documents))
+        for index, errors in enumerate(item_errors):
+            if errors:
+                results.append({'index': index, 'status': 'invalid', 'errors': errors})
+                continue
+            position, document = next(written)
+            if position in failed:
+                results.append({'index': index, 'status': 'failed', 'errors': {'non_field_errors': [failed[position]]}})
+            else:
+                results.append({'index': index, 'status': 'created', '_id': str(document['_id'])})
+
+        created = sum(1 for result in results if result['status'] == 'created')
+        return Response(
+            {'created': created, 'failed': len(results) - created, 'results': results},
+            status=status.HTTP_201_CREATED if created == len(results) else status.HTTP_207_MULTI_STATUS
+        )
+
+    @action(detail=False, methods=['get'], renderer_classes=[NDJSONRenderer, CSVRenderer])
+    def export(self, request):
+        """
+        Stream activities as ?format=ndjson|csv, optionally filtered by
+        user_id, start and end. Archived activities follow the hot ones.
+        """
+        query = {}
+        user_id = request.query_params.get('user_id', None)
+        if user_id:
+            query['user_id'] = user_id
+        try:
+            start = parse_date_param(request.query_params.get('start'))
+            end = parse_date_param(request.query_params.get('end'), end=True)
+        except ValueError:
+            return Response({'error': 'start and end must be ISO 8601 dates'}, status=status.HTTP_400_BAD_REQUEST)
+        date = stats.date_filter(start, end)
+        if date:
+            query['date'] = date
+
+        projection = self.get_projection()
+        cursor = (
+            self.repository.cursor(query, projection, self.ordering, no_cursor_timeout=True)
+            .batch_size(settings.OCTOFIT_EXPORT_BATCH_SIZE)
+        )
+        documents = iter_across_tiers(cursor, query, projection)
+        serializer = ActivityDocumentSerializer(context=self.get_serializer_context())
+        if request.accepted_renderer.format == 'csv':
+            response = StreamingHttpResponse(iter_csv(documents, serializer), content_type='text/csv; charset=utf-8')
+        else:
+            response = StreamingHttpResponse(iter_ndjson(documents, serializer), content_type='application/x-ndjson')
+        response['Content-Disposition'] = f'attachment; filename="activities.{request.accepted_renderer.format}"'
+        if stats.archive_scope(start, end) is not None:
+            response['X-Archived-Activities'] = 'included'
+        return response
+
     @action(detail=False, methods=['get'])
     def recent(self, request):
         """Get recent activities"""
-        limit = int(request.query_params.get('limit', 10))
-        activities = Activity.objects.all().order_by('-date')[:limit]
+        try:
+            limit = parse_limit(request.query_params.get('limit'))
+        except ValueError:
+            return Response({'error': 'limit must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+        activities = self.repository.find({}, self.get_projection(), self.ordering, limit=limit)
         serializer = self.get_serializer(activities, many=True)
         return Response(serializer.data)
 
 
-class LeaderboardViewSet(viewsets.ModelViewSet):
+class LeaderboardViewSet(RepositoryReadMixin, viewsets.ModelViewSet):
     """
     API endpoint that allows leaderboard to be viewed or edited.
+
+    `list` and `top` accept ?window=day|week|month|custom (custom with
+    ?start=&end=) to rank by the daily rollups of that window instead; the
+    day, week and month boards are materialized (see rollups.py).
+    `rank` and `around` look up one user's entry and its neighbours by
+    the maintained ranks, through the user_id and (rank, _id) indexes, so
+    they cost the same at any depth and agree with `top`. `stream` pushes
+    changes as they happen.
     """
     queryset = Leaderboard.objects.all().order_by('rank')
     serializer_class = LeaderboardSerializer
+    document_serializer_class = LeaderboardDocumentSerializer
+    document_actions = ('list', 'retrieve', 'top', 'rank', 'around')
+    ordering = ('rank', '_id')
+    repository = Repository(Leaderboard)
+    window_fields = ('user_id', 'total_calories', 'total_activities', 'total_duration', 'total_distance', 'rank')
+
+    def get_field_choices(self):
+        if self.request.query_params.get('window', None):
+            return self.window_fields
+        return super().get_field_choices()
+
+    def get_window(self, request):
+        """(name, start, end) of the requested window, or None for the all-time board"""
+        window = request.query_params.get('window', None)
+        if not window:
+            return None
+        try:
+            start = parse_date_param(request.query_params.get('start'))
+            end = parse_date_param(request.query_params.get('end'), end=True)
+        except ValueError:
+            raise ValueError('start and end must be ISO 8601 dates')
+        return (window, *rollups.window_range(window, start, end))
+
+    def window_key(self, request):
+        """Cache key part for the resolved window, so a new day, week or month is a new key"""
+        try:
+            return self.get_window(request)
+        except ValueError:
+            return None
+
+    def find_window(self, window, keep, ordering=('rank',), position=None, limit=0):
+        """
+        Rows of a windowed board, projected to the requested fields plus
+        `keep`. Current day, week and month boards are read from their
+        materialized builds; custom windows are aggregated.
+        """
+        name, start, end = window
+        fields = self.get_requested_fields()
+        projection = None if fields is None else {field: 1 for field in fields + keep}
+        if name in rollups.MATERIALIZED_WINDOWS:
+            return rollups.find_board(start, end, projection, ordering, position, limit)
+        pipeline = rollups.window_pipeline(start, end)
+        if projection is not None:
+            pipeline.append({'$project': projection})
+        if position is not None:
+            pipeline.append({'$match': keyset_query(ordering, position)})
+        pipeline.append({'$sort': dict(mongo_sort(ordering))})
+        if limit:
+            pipeline.append({'$limit': limit})
+        return rollups.aggregate(pipeline)
+
+    def expand_window_rows(self, rows, output):
+        """Embed ?expand= relations in windowed output rows"""
+        expand = self.get_requested_expand()
+        if expand:
+            expand_rows(rows, output, expand, user_field='user_id')
+        return output
+
+    def list(self, request, *args, **kwargs):
+        try:
+            window = self.get_window(request)
+        except ValueError as exc:
+            return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        if window is None:
+            return super().list(request, *args, **kwargs)
+
+        fields = self.get_requested_fields()
+        page = self.paginator.start_page(request, ('rank',)) if self.paginator else None
+        if page is None:
+            rows = self.find_window(window, ('rank', 'user_id'))
+            return Response(self.expand_window_rows(rows, trim_fields(rows, fields)))
+        ordering, position = page
+        rows = self.find_window(window, ('rank', 'user_id'), ordering, position, self.paginator.page_size + 1)
+        rows = self.paginator.finish_page(rows)
+        return self.paginator.get_paginated_response(self.expand_window_rows(rows, trim_fields(rows, fields)))
 
     @action(detail=False, methods=['get'])
+    @cache_response(Leaderboard, DailyRollup, User, Team, vary=window_key)
     def top(self, request):
         """Get top N entries from leaderboard"""
-        limit = int(request.query_params.get('limit', 10))
-        leaderboard = Leaderboard.objects.all().order_by('rank')[:limit]
+        try:
+            window = self.get_window(request)
+        except ValueError as exc:
+            return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            limit = parse_limit(request.query_params.get('limit'))
+        except ValueError:
+            return Response({'error': 'limit must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+        if window is not None:
+            rows = self.find_window(window, ('user_id',), limit=limit)
+            return Response(self.expand_window_rows(rows, trim_fields(rows, self.get_requested_fields())))
+        leaderboard = self.repository.find({}, self.get_projection(), self.ordering, limit=limit)
+        serializer = self.get_serializer(leaderboard, many=True)
+        return Response(serializer.data)
+
+    def get_user_entry(self, request, projection):
+        """The all-time entry of ?user_id=; 404 when the user has none"""
+        entry = self.repository.find_one({'user_id': request.query_params['user_id']}, projection)
+        if entry is None:
+            raise NotFound('No leaderboard entry for this user')
+        return entry
+
+    @action(detail=False, methods=['get'])
+    @cache_response(Leaderboard, User, Team)
+    def rank(self, request):
+        """Get the entry, and so the rank, of ?user_id="""
+        if not request.query_params.get('user_id'):
+            return Response({'error': 'user_id parameter is required'}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(self.get_serializer(self.get_user_entry(request, self.get_projection())).data)
+
+    @action(detail=False, methods=['get'])
+    @cache_response(Leaderboard, User, Team)
+    def around(self, request):
+        """Get the entries ranked up to ?radius= places above and below ?user_id="""
+        if not request.query_params.get('user_id'):
+            return Response({'error': 'user_id parameter is required'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            radius = min(max(int(request.query_params.get('radius', 5)), 0), 50)
+        except ValueError:
+            return Response({'error': 'radius must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+        rank = self.get_user_entry(request, {'rank': 1}).get('rank')
+        if rank is None:
+            # Upserted by a write whose re-ranking has not finished yet
+            raise NotFound('This user is not ranked yet')
+        leaderboard = self.repository.find(
+            {'rank': {'$gte': rank - radius, '$lte': rank + radius}}, self.get_projection(), self.ordering
+        )
         serializer = self.get_serializer(leaderboard, many=True)
         return Response(serializer.data)
 
+    @action(detail=False, methods=['get'])
+    def distribution(self, request):
+        """
+        Get how total calories are spread over users: ?percentiles= (comma
+        separated, default 50,75,90,99), a histogram of ?bins= ranges and
+        ties, plus the entry, tied rank and percentile of ?user_id= when
+        given. The distribution is computed in memory and may lag the
+        leaderboard by about OCTOFIT_RANKING_MAX_AGE_SECONDS; the user's
+        entry and rank are read from the leaderboard, like /rank/.
+        """
+        try:
+            percents = [float(value) for value in parse_fields(request, 'percentiles') or (50, 75, 90, 99)]
+            bins = int(request.query_params.get('bins', 20))
+        except ValueError:
+            return Response(
+                {'error': 'percentiles must be numbers and bins an integer'}, status=status.HTTP_400_BAD_REQUEST
+            )
+        if not all(0 <= percent <= 100 for percent in percents) or not 1 <= bins <= 1000:
+            return Response(
+                {'error': 'percentiles must be between 0 and 100 and bins between 1 and 1000'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        engine = ranking.get_engine()
+        data = {
+            'users': len(engine),
+            'percentiles': {f'{percent:g}': value for percent, value in engine.percentiles(percents).items()},
+            'histogram': engine.histogram(bins),
+            'ties': engine.ties(),
+        }
+        user_id = request.query_params.get('user_id', None)
+        if user_id:
+            entry = self.repository.find_one(
+                {'user_id': user_id}, {'_id': 0, 'user_id': 1, 'total_calories': 1, 'total_activities': 1, 'rank': 1}
+            )
+            if entry is not None:
+                calories = entry['total_calories']
+                entry.update(tied_rank=engine.tied_rank(calories), percentile=engine.percentile_of(calories))
+            data['user'] = entry
+        return Response(data)
+
+    @action(detail=False, methods=['get'], renderer_classes=[EventStreamRenderer])
+    def stream(self, request):
+        """Push rank and total changes as Server-Sent Events (see events.py)"""
+        response = StreamingHttpResponse(
+            events.stream(request.headers.get('Last-Event-ID')), content_type='text/event-stream'
+        )
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+
+class TeamStandingViewSet(DocumentReadMixin, viewsets.ReadOnlyModelViewSet):
+    """
+    API endpoint with team totals, members, calories per member and ranks.
+    """
+    queryset = TeamStanding.objects.all().order_by('rank')
+    serializer_class = TeamStandingSerializer
+    document_serializer_class = TeamStandingDocumentSerializer
+    ordering = ('rank', '_id')
+
+    @cache_response(TeamStanding)
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
 
-class WorkoutViewSet(viewsets.ModelViewSet):
+class WorkoutViewSet(RepositoryReadMixin, viewsets.ModelViewSet):
     """
     API endpoint that allows workouts to be viewed or edited.
     """
     queryset = Workout.objects.all()
     serializer_class = WorkoutSerializer
+    document_serializer_class = WorkoutDocumentSerializer
+    document_actions = ('list', 'retrieve', 'by_difficulty', 'by_type', 'search')
+    repository = Repository(Workout)
+
+    def find_workouts(self, query):
+        """Match workouts case-insensitively through the collation indexes"""
+        return self.repository.find(query, self.get_projection(), collation=CASE_INSENSITIVE)
 
     @action(detail=False, methods=['get'])
+    @cache_response(Workout)
     def by_difficulty(self, request):
         """Get workouts by difficulty level"""
         difficulty = request.query_params.get('difficulty', None)
         if difficulty:
-            workouts = Workout.objects.filter(difficulty_level__iexact=difficulty)
+            workouts = self.find_workouts({'difficulty_level': difficulty})
             serializer = self.get_serializer(workouts, many=True)
             return Response(serializer.data)
         return Response({'error': 'difficulty parameter is required'}, status=status.HTTP_400_BAD_REQUEST)
 
     @action(detail=False, methods=['get'])
+    @cache_response(Workout)
     def by_type(self, request):
         """Get workouts by exercise type"""
         exercise_type = request.query_params.get('type', None)
         if exercise_type:
-            workouts = Workout.objects.filter(exercise_type__iexact=exercise_type)
+            workouts = self.find_workouts({'exercise_type': exercise_type})
             serializer = self.get_serializer(workouts, many=True)
             return Response(serializer.data)
         return Response({'error': 'type parameter is required'}, status=status.HTTP_400_BAD_REQUEST)
+
+    @action(detail=False, methods=['get'])
+    @cache_response(Workout)
+    def search(self, request):
+        """
+        Search workouts by ?q= words or a ?prefix= of their name,
+        ?difficulty=, ?type= and ?min_duration=/?max_duration= minutes,
+        with facet counts per difficulty and type.
+        """
+        params = request.query_params
+        if params.get('q', '').strip() and params.get('prefix', '').strip():
+            return Response({'error': 'use either q or prefix'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            min_duration, max_duration = (
+                int(params[name]) if params.get(name) else None for name in ('min_duration', 'max_duration')
+            )
+            limit = max(min(int(params.get('limit', 20)), 100), 1)
+        except ValueError:
+            return Response(
+                {'error': 'min_duration, max_duration and limit must be integers'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        found = search_workouts(
+            q=params.get('q', '').strip(),
+            prefix=params.get('prefix', '').strip(),
+            filters={name: params.get(name) for name in FACETS},
+            min_duration=min_duration,
+            max_duration=max_duration,
+            projection=self.get_projection(),
+            limit=limit,
+        )
+        found['results'] = self.get_serializer(found['results'], many=True).data
+        return Response(found)
+
+
+def parse_date_param(value, end=False):
+    """
+    Parse a date or datetime query parameter into an aware datetime.
+
+    A bare date used as an `end` bound includes that whole day.
+    Returns None when the value is missing and raises ValueError when malformed.
+    """
+    if not value:
+        return None
+    day = parse_date(value)
+    if day is not None:
+        parsed = datetime.combine(day + timedelta(days=1) if end else day, time.min)
+    else:
+        parsed = parse_datetime(value)
+        if parsed is None:
+            raise ValueError(value)
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+def parse_limit(value, default=10):
+    """
+    Parse ?limit= for recent and top, clamped to 1..OCTOFIT_MAX_LIMIT.
+
+    Returns `default` when the value is missing and raises ValueError when
+    it is not an integer.
+    """
+    if value in (None, ''):
+        return default
+    return max(min(int(value), settings.OCTOFIT_MAX_LIMIT), 1)
+
+
+def parse_count(value, default, maximum):
+    """
+    Parse a count query parameter such as ?limit=, between 1 and `maximum`.
+
+    Returns `default` when the value is missing and raises ValueError when
+    it is not an integer in that range.
+    """
+    if value in (None, ''):
+        return default
+    count = int(value)
+    if not 1 <= count <= maximum:
+        raise ValueError(value)
+    return count
+
+
+class StatsViewSet(viewsets.ViewSet):
+    """
+    API endpoint with activity totals and averages, optionally filtered by
+    ?start=&end= dates and trimmed to ?fields=.
+
+    Archived activities are counted, from their monthly summaries, by the
+    totals overall, per user and per team when the range covers whole
+    archived months. When archived months fall in the range, the
+    X-Archived-Activities header says whether they were `included` or
+    `excluded` (per activity type, or for a range that splits a month).
+    """
+
+    def get_date_range(self, request):
+        return (
+            parse_date_param(request.query_params.get('start')),
+            parse_date_param(request.query_params.get('end'), end=True),
+        )
+
+    def aggregate(self, request, build_pipeline, archived=True, **kwargs):
+        """Run a stats pipeline; `archived` when it can add archived monthly summaries"""
+        try:
+            start, end = self.get_date_range(request)
+        except ValueError:
+            return Response({'error': 'start and end must be ISO 8601 dates'}, status=status.HTTP_400_BAD_REQUEST)
+        scope = stats.archive_scope(start, end)
+        included = archived and scope == 'months'
+        if archived:
+            kwargs['archived'] = included
+        pipeline = build_pipeline(start, end, **kwargs)
+        fields = parse_fields(request)
+        if fields is not None:
+            pipeline.append({'$project': {'_id': 0, **{name: 1 for name in fields}}})
+        response = Response(stats.aggregate(pipeline))
+        if scope is not None:
+            response['X-Archived-Activities'] = 'included' if included else 'excluded'
+        return response
+
+    def list(self, request):
+        """Get totals over all activities"""
+        return self.aggregate(request, stats.overall_pipeline)
+
+    @action(detail=False, methods=['get'])
+    def by_user(self, request):
+        """Get totals per user, highest calories first"""
+        try:
+            limit = parse_count(request.query_params.get('limit'), 100, 1000)
+        except ValueError:
+            return Response({'error': 'limit must be an integer from 1 to 1000'}, status=status.HTTP_400_BAD_REQUEST)
+        return self.aggregate(request, stats.by_user_pipeline, limit=limit)
+
+    @action(detail=False, methods=['get'])
+    def by_team(self, request):
+        """Get totals per team"""
+        return self.aggregate(request, stats.by_team_pipeline)
+
+    @action(detail=False, methods=['get'])
+    def by_activity_type(self, request):
+        """Get totals per activity type"""
+        # Monthly summaries have no activity type
+        return self.aggregate(request, stats.by_activity_type_pipeline, archived=False)
+
+
+class DashboardViewSet(viewsets.ViewSet):
+    """
+    API endpoint with everything the app's pages show, in one response:
+    the top ?top= leaderboard entries, the ?recent= latest activities, the
+    ?teams= best team standings and a sample of ?workouts= workouts. Each
+    count is from 1 to OCTOFIT_MAX_LIMIT.
+
+    ?sections= selects some of them. Sections run concurrently; one that
+    misses its time budget is returned as null and named in `errors`.
+    """
+
+    def list(self, request):
+        """Get the dashboard sections"""
+        names = parse_fields(request, 'sections') or tuple(dashboard.SECTIONS)
+        unknown = [name for name in names if name not in dashboard.SECTIONS]
+        if unknown:
+            raise ValidationError({'sections': [f'Unknown section: {name}' for name in unknown]})
+        requested, invalid = {}, {}
+        for name in names:
+            function, param, default = dashboard.SECTIONS[name]
+            try:
+                requested[name] = parse_count(request.query_params.get(param), default, settings.OCTOFIT_MAX_LIMIT)
+            except ValueError:
+                invalid[param] = [f'Must be an integer from 1 to {settings.OCTOFIT_MAX_LIMIT}']
+        if invalid:
+            raise ValidationError(invalid)
+        data, errors = dashboard.build_dashboard(requested)
+        return Response({**{name: data.get(name) for name in names}, 'errors': errors})